@@ -0,0 +1,261 @@
+"""
+Benchmarks for pyavaccess against the avsim:// simulator
+
+Measures command latency (p50/p95/p99) and throughput for single and
+multi-line commands and fleet-wide polling, a recorded session played back
+as fast as possible, plus microbenchmarks of the reply parsers. Results are written as JSON so runs can be compared:
+
+    python -m benchmarks.bench_matrix --output before.json
+    python -m benchmarks.bench_matrix --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+from pyavaccess import HDMIMatrixSerial, MatrixFleet
+from pyavaccess.avaccess_serial import _ReplyFramer, encodeCommand, encodeCommands
+from pyavaccess.command import AVAccessCommand
+from pyavaccess.config.matrix_devices import PATTERN_ALL, PATTERN_OUT
+from pyavaccess.reply_parser import parseValues
+from pyavaccess.routing import RoutingTable
+
+AV_DEVICE = "4KMX42-H2A"
+
+# Relative slowdown reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.10
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """
+    @param samples: Sorted samples
+    @param pct: Percentile between 0 and 100
+    @return: Nearest-rank percentile
+    """
+    index = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+def measure(operation: Callable[[], object], iterations: int) -> Dict[str, float]:
+    """
+    @param operation: Operation to time, called once per iteration
+    @param iterations: Number of timed calls after one warm up call
+    @return: Latency percentiles in milliseconds and operations per second
+    """
+    operation()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        opStarted = time.perf_counter()
+        operation()
+        samples.append((time.perf_counter() - opStarted) * 1000)
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+        "p99_ms": percentile(samples, 99),
+        "ops_per_sec": iterations / elapsed,
+    }
+
+
+def benchCommands(url: str, iterations: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time single and multi-line commands on one matrix
+    """
+    matrix = HDMIMatrixSerial(url, AV_DEVICE)
+    return {
+        "getMapping": measure(lambda: matrix.getMapping(1), iterations),
+        "mapOutput": measure(lambda: matrix.mapOutput(1, 2), iterations),
+        "getMappings": measure(matrix.getMappings, iterations),
+        "getAPI": measure(matrix.getAPI, iterations),
+        "getAllInputEDIDStatus": measure(matrix.getAllInputEDIDStatus, iterations),
+        "snapshot": measure(matrix.snapshot, iterations),
+    }
+
+
+def benchFleet(url: str, devices: int, iterations: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time polling a whole fleet of simulated matrices
+    """
+    fleet = MatrixFleet(
+        {index: HDMIMatrixSerial(url, AV_DEVICE) for index in range(devices)}
+    )
+    return {
+        "fleetGetMappings": measure(fleet.getMappings, iterations),
+        "fleetSnapshot": measure(fleet.snapshot, iterations),
+    }
+
+
+def benchReplay(url: str, iterations: int) -> Dict[str, Dict[str, float]]:
+    """
+    Record a session, then time it played back from the capture without delays
+    Leaves only the framing and parsing, so I/O timing doesn't hide regressions
+    """
+    operations = {
+        "replayGetMappings": lambda matrix: matrix.getMappings(),
+        "replaySnapshot": lambda matrix: matrix.snapshot(),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.avcap")
+        recorded = HDMIMatrixSerial(url, AV_DEVICE, lazy=True)
+        recorded.startCapture(path)
+        for operation in operations.values():
+            # measure() makes one warm up call
+            for _ in range(iterations + 1):
+                operation(recorded)
+        recorded.stopCapture()
+
+        replayed = HDMIMatrixSerial("avreplay://{}?speed=0".format(path), AV_DEVICE)
+        return {
+            name: measure(lambda: operation(replayed), iterations)
+            for name, operation in operations.items()
+        }
+
+
+def benchParsers(iterations: int) -> Dict[str, Dict[str, float]]:
+    """
+    Time the reply parsers without any I/O
+    """
+    matrix = HDMIMatrixSerial("avsim://4kmx42", AV_DEVICE)
+    mappingsReply = "MP in1 out1\r\nMP in3 out2"
+    muteReply = (
+        "MUTE hdmiaudioout1 off\r\nMUTE hdmiaudioout2 off\r\n"
+        "MUTE audioout1 on\r\nMUTE spdifaudioout2 off"
+    )
+    helpLines = matrix.profile.commands
+    helpReply = b"".join(line.encode("ascii") + b"\r\n" for line in helpLines)
+    framer = _ReplyFramer()
+
+    def frameHelp() -> None:
+        framer.begin(len(helpLines))
+        framer.feed(helpReply)
+        framer.poll()
+
+    # Large matrix with one route changed between polls
+    previousRouting = RoutingTable(64, 64, {outNum: outNum for outNum in range(1, 65)})
+    currentRouting = previousRouting.copy()
+    currentRouting[40] = 1
+
+    snapshotBatch = matrix.batch()
+    snapshotBatch.getMappings()
+    snapshotBatch.getAllMuteStatus()
+    snapshotBatch.getAllInputEDIDStatus()
+    for outNum in range(1, matrix.outputs + 1):
+        snapshotBatch.getAutoCECStatus(outNum)
+        snapshotBatch.getCECDelay(outNum)
+    snapshotCommands = snapshotBatch._commands
+    uncompiledCommands = [AVAccessCommand(command.cmdStr) for command in snapshotCommands]
+
+    parsers = {
+        "mapWithPatternOut": lambda: matrix.mapWithPattern(mappingsReply, PATTERN_OUT),
+        "mapWithPatternAll": lambda: matrix.mapWithPattern("SW in3 all", PATTERN_ALL),
+        "parseRouting": lambda: matrix._parseRouting(mappingsReply),
+        "parseRoutingAll": lambda: matrix._parseRouting("SW in3 all", "SW"),
+        "parseMuteAll": lambda: parseValues(muteReply, "MUTE"),
+        "frameHelpReply": frameHelp,
+        "encodeCommands": lambda: encodeCommands(snapshotCommands),
+        "encodeCommandsUncompiled": lambda: encodeCommands(uncompiledCommands),
+        "compileCommand": lambda: matrix.profile.command("SET SW inX outY", 3, 1),
+        "formatCommand": lambda: encodeCommand("SET SW in{} out{}".format(3, 1)),
+        "routingDiff64": lambda: currentRouting.diff(previousRouting),
+        "routingEqual64": lambda: currentRouting == previousRouting,
+        "setupDevice": lambda: matrix._setupDevice(AV_DEVICE, matrix.apiVersion),
+    }
+    results = {}
+    for name, parser in parsers.items():
+        seconds = timeit.timeit(parser, number=iterations)
+        results[name] = {
+            "us_per_call": seconds / iterations * 1000000,
+            "ops_per_sec": iterations / seconds,
+        }
+    return results
+
+
+def compare(
+    current: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD
+) -> List[str]:
+    """
+    @param threshold: Relative slowdown to report, 0.1 for 10%
+    @return: Description of every metric that got slower than the threshold
+    """
+    regressions = []
+    for group, benchmarks in current["results"].items():
+        for name, metrics in benchmarks.items():
+            before = baseline.get("results", {}).get(group, {}).get(name)
+            if not before:
+                continue
+            # Throughput is comparable for every benchmark kind
+            oldRate, newRate = before["ops_per_sec"], metrics["ops_per_sec"]
+            if newRate < oldRate * (1 - threshold):
+                regressions.append(
+                    "{}.{}: {:.0f} -> {:.0f} ops/s ({:+.1%})".format(
+                        group, name, oldRate, newRate, newRate / oldRate - 1
+                    )
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="avsim://4kmx42", help="Matrix url")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--fleet-size", type=int, default=16)
+    parser.add_argument("--parser-iterations", type=int, default=20000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Report regressions against this JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="Relative slowdown reported as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "url": args.url,
+        "timestamp": time.time(),
+        "results": {
+            "commands": benchCommands(args.url, args.iterations),
+            "fleet": benchFleet(
+                args.url, args.fleet_size, max(1, args.iterations // 10)
+            ),
+            "replay": benchReplay(args.url, args.iterations),
+            "parsers": benchParsers(args.parser_iterations),
+        },
+    }
+
+    for group, benchmarks in report["results"].items():
+        print("[{}]".format(group))
+        for name, metrics in benchmarks.items():
+            print(
+                "  {:<24} {}".format(
+                    name,
+                    "  ".join(
+                        "{}={:.3f}".format(key, value) for key, value in metrics.items()
+                    ),
+                )
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as outputFile:
+            json.dump(report, outputFile, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baselineFile:
+            regressions = compare(report, json.load(baselineFile), args.threshold)
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,32 @@
 # Set default logging handler to avoid "No handler found" warnings.
 import logging
 
+import serial
+
 from .hdmi_matrix import HDMIMatrixSerial
+from .async_hdmi_matrix import AsyncHDMIMatrix
+from .routing import RoutingTable
+from .snapshot import MatrixSnapshot
+from .preset import MatrixPreset, PresetResult
+from .settings import MatrixSettings, SettingsReport
+from .fleet import AsyncMatrixFleet, MatrixFleet
+from .broker import HDMIMatrixClient, MatrixBroker
+from .identity_cache import DeviceIdentityCache
+from .discovery import discoverMatrices
+from .exceptions import (
+    AVAccessError,
+    CommandTimeout,
+    ConnectionLost,
+    DeadlineExceeded,
+    DeviceErrorReply,
+)
+from .listener import MatrixEvent, MatrixListener
+from .poller import MatrixPoller
+from .metrics import Instrumentation, MetricsRecorder
+from .profiles import DEVICE_PROFILES, DeviceProfile, ProfileRegistry
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+# Make our url handlers (ex: avsim://) available to serial.serial_for_url
+if "pyavaccess.urlhandler" not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append("pyavaccess.urlhandler")
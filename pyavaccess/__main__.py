@@ -0,0 +1,7 @@
+"""
+Run the matrix broker: python -m pyavaccess /dev/ttyUSB0 4KMX42-H2A
+"""
+
+from .broker import main
+
+main()
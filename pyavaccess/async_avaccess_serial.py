@@ -0,0 +1,433 @@
+import asyncio
+import io
+import logging
+import time
+from typing import Any, Callable, List, Optional, Pattern
+
+import serial
+
+from .avaccess_serial import (
+    COMMAND_TIMEOUT,
+    PATTERN_VER_REPLY,
+    RECONNECT_ATTEMPTS,
+    RETRY_ATTEMPTS,
+    _BatchRecovery,
+    _ReplyFramer,
+    commandTimeout,
+    encodeCommand,
+    encodeCommands,
+    reconnectBackoff,
+)
+from .command import AVAccessCommand
+from .exceptions import (
+    CommandTimeout,
+    ConnectionLost,
+    DeadlineExceeded,
+    DeviceErrorReply,
+)
+from .metrics import NO_INSTRUMENTATION, Instrumentation, parseReplies
+from .state import MISSING, MatrixState, lookupCommands, recordCommands
+
+_LOGGER = logging.getLogger(__name__)
+
+# How often to check ports that have no file descriptor (ex: socket://, loop://)
+POLL_INTERVAL = 0.005
+
+
+class AsyncAVAccessSerial:
+    """
+    asyncio class for communicating with AV Access devices over RS232 serial
+
+    Serial ports are switched to non-blocking mode and driven by the event
+    loop's reader/writer callbacks on the port file descriptor, so no thread is
+    blocked while waiting on the device.
+
+    Failed batches are resynchronised or reconnected and sent again like
+    AVAccessSerial does. There is no lazy option, the port is only opened
+    when open() is awaited.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: Optional[float] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        reconnectAttempts: int = RECONNECT_ATTEMPTS,
+        retryAttempts: int = RETRY_ATTEMPTS,
+    ) -> None:
+        """
+        Initialize the AVAccess device for connecting over serial
+        @param url: Port url or device name
+        @param timeout: Seconds to wait for the replies to a batch of commands,
+            None to give each command the default of its verb
+        @param instrumentation: Receives per-command timings and counts
+        @param reconnectAttempts: Times to reopen a dropped connection, 0 to raise
+        @param retryAttempts: Times to resend a batch whose reply was cut short,
+            0 to raise
+        """
+        self.timeout = timeout
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        self.reconnectAttempts = reconnectAttempts
+        self.retryAttempts = retryAttempts
+        self._framer = _ReplyFramer()
+        # Cached device state, None when caching is off
+        self.state: Optional[MatrixState] = None
+        # Error line of the device profile, None until it is loaded or if it
+        # declares none
+        self.errorReplyPattern: Optional[Pattern[bytes]] = None
+        # Called with (commands, device outputs, parsed results) after each exchange
+        self._replyObservers: List[
+            Callable[[List[AVAccessCommand], List[str], List[Any]], None]
+        ] = []
+        # Number of writes that waited on the device to reply
+        self.roundTrips = 0
+        self._lock: Optional[asyncio.Lock] = None
+        self._fd: Optional[int] = None
+        self._port = serial.serial_for_url(url, do_not_open=True)
+        self._port.baudrate = 115200
+        self._port.bytesize = serial.EIGHTBITS
+        self._port.parity = serial.PARITY_NONE
+        self._port.stopbits = serial.STOPBITS_ONE
+        # Never block inside the event loop
+        self._port.timeout = 0
+        self._port.write_timeout = 0
+
+    async def open(self) -> None:
+        """
+        Open the port
+        """
+        self._openPort()
+        self._lock = asyncio.Lock()
+
+    def _openPort(self) -> None:
+        self._port.open()
+        try:
+            self._fd = self._port.fileno()
+        except (AttributeError, NotImplementedError, io.UnsupportedOperation):
+            # Url handlers without a file descriptor are polled instead
+            self._fd = None
+
+    async def close(self) -> None:
+        """
+        Close the port
+        """
+        self._port.close()
+        self._fd = None
+
+    async def _SendData(
+        self,
+        cmdStr: str,
+        useDeviceEOL: bool = False,
+        lineCount: int = 1,
+        timeout: Optional[float] = None,
+    ) -> str:
+        """
+        Send a command to the device and receive its response
+        @param cmdStr: Data to send
+        @param timeout: Seconds the device has to reply, None for the verb default
+        @return: Response from the device
+        """
+        command = AVAccessCommand(cmdStr, lineCount, useDeviceEOL, timeout=timeout)
+        replies = await self._SendBatch([command])
+        return replies[0]
+
+    async def _SendBatch(
+        self, commands: List[AVAccessCommand], timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Send several commands in one write and split the replies back out in order
+        Without a timeout the batch gets the sum of its commands' deadlines. A
+        reply cut short is retried after resynchronising, and a dropped
+        connection after reconnecting, see AVAccessSerial._SendBatch()
+        @param commands: Commands to send
+        @param timeout: Seconds the whole batch may take, overrides self.timeout
+        @return: Response from the device for each command
+        """
+        # Make sure every string exists
+        if not all(command.cmdStr for command in commands):
+            raise ValueError("Cannot send empty line to device!")
+        if self._lock is None:
+            raise serial.PortNotOpenError()
+
+        recovery = _BatchRecovery(commands, self.retryAttempts, self.reconnectAttempts)
+        async with self._lock:
+            while True:
+                try:
+                    return await self._Attempt(commands, timeout)
+                except DeadlineExceeded:
+                    raise
+                except CommandTimeout as exc:
+                    if not recovery.shouldResync(exc, False):
+                        raise
+                    await self._resync(exc)
+                except serial.SerialTimeoutException:
+                    raise
+                except serial.SerialException as exc:
+                    if not recovery.shouldReconnect(False):
+                        raise
+                    await self._reconnect(exc)
+                    # The device may have acted on the batch before the drop
+                    if not recovery.retrySafe:
+                        raise
+
+                # The batch may or may not have reached the device, send it again
+                for command in commands:
+                    self.instrumentation.observeRetry(command.verb)
+
+    async def _Attempt(
+        self, commands: List[AVAccessCommand], timeout: Optional[float]
+    ) -> List[str]:
+        """
+        Write a batch and read its replies once, called with the lock held
+        @param timeout: Seconds the whole batch may take, overrides self.timeout
+        @return: Response from the device for each command
+        """
+        self._port.reset_output_buffer()
+        self._port.reset_input_buffer()
+        self._framer.clear()
+
+        encoded = encodeCommands(commands)
+        _LOGGER.debug('Sending "%s"...', encoded)
+        self.roundTrips += 1
+        if timeout is not None:
+            budget = timeout
+        elif self.timeout is not None:
+            budget = self.timeout
+        else:
+            budget = sum(commandTimeout(command) for command in commands)
+
+        # Filled in as replies arrive, so a timeout knows which command stalled
+        replies: List[bytes] = []
+        try:
+            await asyncio.wait_for(self._Exchange(encoded, commands, replies), budget)
+        except DeviceErrorReply as exc:
+            # Replies to the rest of the batch may still be on their way
+            if len(replies) + 1 < len(commands):
+                await self._resync(exc)
+            raise
+        except asyncio.TimeoutError:
+            self.instrumentation.observeTimeout(commands[len(replies)].verb)
+            received = bytes(self._framer.buffer)
+            if timeout is not None:
+                raise DeadlineExceeded(
+                    "Batch of {} commands did not finish in {}s".format(
+                        len(commands), timeout
+                    ),
+                    received,
+                ) from None
+            # Usually only reached by invalid command
+            exc = CommandTimeout(
+                "Connection timed out! Last received bytes {}".format(
+                    [hex(c) for c in received]
+                ),
+                received,
+            )
+            # Replies to the rest of the batch may still be on their way
+            if len(replies) + 1 < len(commands):
+                await self._resync(exc)
+            raise exc from None
+        _LOGGER.debug('Received "%s"', replies)
+
+        # Return the responses as ascii strings
+        return [ret.decode("ascii").strip() for ret in replies]
+
+    async def _reconnect(self, cause: Exception) -> None:
+        """
+        Reopen the port after the connection dropped, backing off between attempts
+        See AVAccessSerial._reconnect()
+        @param cause: Error that showed the connection was lost
+        """
+        _LOGGER.warning("Lost connection to %s: %s", self._port.port, cause)
+        # Changes made while we were away were not seen, read them again
+        if self.state is not None:
+            self.state.invalidate()
+
+        delays = reconnectBackoff()
+        for attempt in range(1, self.reconnectAttempts + 1):
+            try:
+                self._port.close()
+            except serial.SerialException:
+                pass
+            self._fd = None
+            try:
+                self._openPort()
+            except serial.SerialException as exc:
+                _LOGGER.debug("Reconnect attempt %s failed: %s", attempt, exc)
+                cause = exc
+                if attempt < self.reconnectAttempts:
+                    await asyncio.sleep(next(delays))
+                continue
+            _LOGGER.info("Reconnected to %s", self._port.port)
+            self._framer.clear()
+            return
+        raise ConnectionLost(
+            "Could not reconnect to {} after {} attempts".format(
+                self._port.port, self.reconnectAttempts
+            )
+        ) from cause
+
+    async def _resync(self, cause: Exception) -> None:
+        """
+        Get back in step with the device after a batch was rejected before the
+        replies to its later commands arrived, see AVAccessSerial._resync()
+        @param cause: Error that left replies unread, raised if resync fails
+        """
+        _LOGGER.debug("Resynchronising after %s...", cause)
+        self._port.reset_input_buffer()
+        self._framer.clear()
+        await self._Write(encodeCommand("GET VER"))
+        self.roundTrips += 1
+
+        async def drain() -> None:
+            received = b""
+            while not PATTERN_VER_REPLY.search(received):
+                received += await self._ReadChunk()
+
+        try:
+            await asyncio.wait_for(drain(), COMMAND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise cause from None
+
+    async def _Run(self, command: AVAccessCommand) -> Any:
+        """
+        Send a command to the device and parse its response
+        @param command: Command to send
+        @return: Parsed response from the device
+        """
+        results = await self._RunBatch([command])
+        return results[0]
+
+    async def _RunBatch(
+        self,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Send several commands in one write and parse each response
+        @param commands: Commands to send
+        @param combine: Turns the list of parsed responses into a single result
+        @param timeout: Seconds the whole batch may take
+        @return: Parsed response from the device for each command, or the combined result
+        """
+        # Serve what we can from cached state and only send the rest
+        results = lookupCommands(self.state, commands)
+        toSend = [
+            command for command, result in zip(commands, results) if result is MISSING
+        ]
+        if toSend:
+            deviceOutputs = await self._SendBatch(toSend, timeout)
+            _LOGGER.debug("Device output: %s", deviceOutputs)
+            parsed = parseReplies(self.instrumentation, toSend, deviceOutputs)
+            recordCommands(self.state, toSend, parsed)
+            for observer in self._replyObservers:
+                observer(toSend, deviceOutputs, parsed)
+
+            sentResults = iter(parsed)
+            results = [
+                next(sentResults) if result is MISSING else result for result in results
+            ]
+
+        if combine is None:
+            return results
+        return combine(results)
+
+    async def _Exchange(
+        self,
+        encoded: List[bytes],
+        commands: List[AVAccessCommand],
+        replies: List[bytes],
+    ) -> None:
+        """
+        Write the commands and read back one reply per command
+        @param encoded: Each command as sent over the wire
+        @param replies: Receives the raw reply bytes including terminators
+        """
+        instrumentation = self.instrumentation
+        timed = instrumentation.enabled
+        if timed:
+            sentAt = time.perf_counter()
+
+        await self._Write(b"".join(encoded))
+        framer = self._framer
+        for command, encodedCmd in zip(commands, encoded):
+            framer.begin(
+                command.lineCount, command.useDeviceEOL, self.errorReplyPattern
+            )
+            # Bytes left over from the previous reply have already arrived
+            firstByteAt = time.perf_counter() if timed and framer.buffer else None
+            reply = framer.poll()
+            while reply is None:
+                chunk = await self._ReadChunk()
+                if timed and firstByteAt is None:
+                    firstByteAt = time.perf_counter()
+                framer.feed(chunk)
+                reply = framer.poll()
+            if framer.error is not None:
+                raise DeviceErrorReply(
+                    command.cmdStr, framer.error.decode("ascii", "replace")
+                )
+            replies.append(reply)
+            if timed:
+                instrumentation.observeCommand(
+                    command.verb,
+                    firstByteAt - sentAt,
+                    time.perf_counter() - sentAt,
+                    len(encodedCmd),
+                    len(reply),
+                )
+
+    async def _Write(self, data: bytes) -> None:
+        """
+        Write all of data without blocking the event loop
+        @param data: Bytes to send
+        """
+        view = memoryview(data)
+        while view:
+            written = self._port.write(view)
+            # Url handlers without non-blocking support write everything at once
+            view = view[len(view) if written is None else written :]
+            if view:
+                await self._WaitFor(writable=True)
+
+    async def _ReadChunk(self) -> bytes:
+        """
+        Wait until the device sends something
+        @return: All bytes currently waiting on the port
+        """
+        while True:
+            waiting = self._port.in_waiting
+            if waiting:
+                chunk = self._port.read(waiting)
+                if chunk:
+                    return chunk
+            await self._WaitFor(writable=False)
+
+    async def _WaitFor(self, writable: bool) -> None:
+        """
+        Suspend until the port is readable or writable
+        @param writable: Wait for writability instead of readability
+        """
+        if self._fd is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            return
+
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def _wake() -> None:
+            if not ready.done():
+                ready.set_result(None)
+
+        if writable:
+            loop.add_writer(self._fd, _wake)
+        else:
+            loop.add_reader(self._fd, _wake)
+        try:
+            await ready
+        finally:
+            # Also runs on cancellation so the fd is never left registered
+            if writable:
+                loop.remove_writer(self._fd)
+            else:
+                loop.remove_reader(self._fd)
@@ -0,0 +1,112 @@
+import logging
+from typing import Any, Generator, Optional, Tuple
+
+from .async_avaccess_serial import AsyncAVAccessSerial
+from .avaccess_serial import RECONNECT_ATTEMPTS, RETRY_ATTEMPTS
+from .hdmi_matrix import HDMIMatrixApplyMixin, HDMIMatrixBase
+from .identity_cache import DeviceIdentityCache
+from .metrics import Instrumentation
+from .profiles import DEVICE_PROFILES, ProfileRegistry
+
+# Config
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncHDMIMatrix(AsyncAVAccessSerial, HDMIMatrixApplyMixin, HDMIMatrixBase):
+    """
+    asyncio class for AV Access HDMI Matrix devices
+
+    Every getter and setter of HDMIMatrixSerial is available here and returns
+    an awaitable of the same result. Arguments are validated before anything
+    is sent, so bad input raises ValueError immediately.
+
+    Usage:
+        async with AsyncHDMIMatrix("/dev/ttyUSB0", "4KMX42-H2A") as av:
+            await av.mapOutput(1, 4)
+    """
+
+    def __init__(
+        self,
+        url: str,
+        device: str,
+        timeout: Optional[float] = None,
+        cacheTTL: Optional[float] = None,
+        identityCache: Optional[DeviceIdentityCache] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        registry: ProfileRegistry = DEVICE_PROFILES,
+        reconnectAttempts: int = RECONNECT_ATTEMPTS,
+        retryAttempts: int = RETRY_ATTEMPTS,
+    ) -> None:
+        """
+        Initialize the AVAccess device for connecting over serial
+        Nothing is sent until connect() is awaited
+        @param timeout: Seconds to wait for the replies to a batch of commands,
+            None to give each command the default of its verb
+        @param cacheTTL: Seconds to serve state from memory, None to always read the device
+        @param identityCache: Known API versions, skips GET VER for cached devices
+        @param instrumentation: Receives per-command timings and counts
+        @param registry: Device profiles to load the device config from
+        @param reconnectAttempts: Times to reopen a dropped connection, 0 to raise
+        @param retryAttempts: Times to resend a batch whose reply was cut short,
+            0 to raise
+        """
+        _LOGGER.debug("Creating async HDMI Matrix %s...", device)
+        super().__init__(
+            url, timeout, instrumentation, reconnectAttempts, retryAttempts
+        )
+        self.url = url
+        self.model = device
+        self.identityCache = identityCache
+        self.registry = registry
+        if cacheTTL is not None:
+            self.enableCache(cacheTTL)
+
+    async def connect(self) -> None:
+        """
+        Open the port and load the device config for its API version
+        """
+        await self.open()
+
+        if self.identityCache is not None:
+            apiVersion = self.identityCache.get(self.url, self.model)
+            if apiVersion is not None:
+                try:
+                    self._setupDevice(self.model, apiVersion)
+                    return
+                except ValueError:
+                    self.identityCache.remove(self.url, self.model)
+
+        apiVersion = await self.getVer()
+        self._setupDevice(self.model, apiVersion)
+        if self.identityCache is not None:
+            self.identityCache.set(self.url, self.model, apiVersion)
+
+    async def _runSteps(self, steps: Generator[Tuple[Any, Any], Any, Any]) -> Any:
+        """
+        Execute each batch the steps yield, in order
+        See HDMIMatrixApplyMixin._runSteps()
+        @param steps: Generator yielding (batch, combine) for each round trip
+        @return: Value the steps return
+        """
+        result: Any = None
+        error: Optional[Exception] = None
+        while True:
+            try:
+                if error is None:
+                    batch, combine = steps.send(result)
+                else:
+                    batch, combine = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                result = await batch.execute(combine)
+            except Exception as exc:
+                error = exc
+
+    async def __aenter__(self) -> "AsyncHDMIMatrix":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
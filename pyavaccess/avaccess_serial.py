@@ -1,19 +1,284 @@
 import serial
 import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Pattern
+
+from .command import AVAccessCommand
+from .exceptions import (
+    CommandTimeout,
+    ConnectionLost,
+    DeadlineExceeded,
+    DeviceErrorReply,
+)
+from .metrics import NO_INSTRUMENTATION, Instrumentation, parseReplies
+from .state import MISSING, MatrixState, lookupCommands, recordCommands
 
 _LOGGER = logging.getLogger(__name__)
 SERIAL_TIMEOUT = 10
 
+# Seconds a command may take before it is treated as lost
+COMMAND_TIMEOUT = 2.0
+# help lists every command and RESET/REBOOT restart the device, give them longer
+SLOW_COMMAND_TIMEOUT = SERIAL_TIMEOUT
+SLOW_COMMANDS = frozenset(("help", "RESET", "REBOOT"))
+
+# Times to reopen a dropped connection before giving up
+RECONNECT_ATTEMPTS = 3
+# Seconds to wait after the first failed reopen, doubling up to the maximum
+RECONNECT_BACKOFF = 0.1
+RECONNECT_BACKOFF_MAX = 5.0
+
+# Times to resend a batch whose reply was cut short, if every command is safe to
+RETRY_ATTEMPTS = 2
+
+# Most responses end with \r\n but some end with \n\r such as GET VER
+EOL = b"\r\n"
+DEVICE_EOL = b"\n\r"
+
+# GET VER is the only reply ending with \n\r, marking a known point in the stream
+PATTERN_VER_REPLY = re.compile(rb"VER [\d.]+\n\r")
+
+
+def encodeCommand(cmdStr: str) -> bytes:
+    """
+    @param cmdStr: Command without line ending
+    @return: Command as sent over the wire
+    """
+    return (cmdStr + "\r\n").encode("ascii")
+
+
+def encodeCommands(commands: List[AVAccessCommand]) -> List[bytes]:
+    """
+    @param commands: Commands about to be sent
+    @return: Bytes to write for each command, only encoding commands that were
+        not precompiled
+    """
+    return [command.encoded or encodeCommand(command.cmdStr) for command in commands]
+
+
+def commandTimeout(command: AVAccessCommand) -> float:
+    """
+    @param command: Command about to be sent
+    @return: Seconds the device has to finish replying to the command
+    """
+    if command.timeout is not None:
+        return command.timeout
+    if command.verb in SLOW_COMMANDS:
+        return SLOW_COMMAND_TIMEOUT
+    return COMMAND_TIMEOUT
+
+
+def reconnectBackoff() -> Iterator[float]:
+    """
+    @return: Seconds to wait after each failed reopen, doubling up to the maximum
+    """
+    delay = RECONNECT_BACKOFF
+    while True:
+        yield delay
+        delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+
+
+class _BatchRecovery:
+    """
+    Decides when a failed batch is sent again, shared by the blocking and
+    asyncio transports so both recover the same way
+
+    A reply cut short by its deadline is retried after resynchronising, and a
+    dropped connection after reconnecting, when every command in the batch is
+    safe to send again. A listener thread owns the port and stops on its own
+    errors, so nothing is retried while one runs.
+    """
+
+    __slots__ = (
+        "retrySafe",
+        "_retryAttempts",
+        "_reconnectAttempts",
+        "_retries",
+        "_reconnected",
+    )
+
+    def __init__(
+        self,
+        commands: List[AVAccessCommand],
+        retryAttempts: int,
+        reconnectAttempts: int,
+    ) -> None:
+        """
+        @param commands: Batch being sent
+        @param retryAttempts: Times to resend a reply cut short, 0 to raise
+        @param reconnectAttempts: Times to reopen a dropped connection, 0 to raise
+        """
+        self.retrySafe = all(command.isRetrySafe for command in commands)
+        self._retryAttempts = retryAttempts
+        self._reconnectAttempts = reconnectAttempts
+        self._retries = 0
+        self._reconnected = False
+
+    def shouldResync(self, exc: CommandTimeout, listening: bool) -> bool:
+        """
+        @param exc: A command in the batch ran out of time
+        @param listening: A listener thread owns the port
+        @return: True to resynchronise and send the batch again
+        """
+        # Silence usually means an invalid command, sending it again would only
+        # wait out the deadline again
+        if (
+            not exc.received
+            or not self.retrySafe
+            or self._retries >= self._retryAttempts
+            or listening
+        ):
+            return False
+        self._retries += 1
+        return True
+
+    def shouldReconnect(self, listening: bool) -> bool:
+        """
+        A batch reconnects once, reopening the port may itself take several attempts
+        @param listening: A listener thread owns the port
+        @return: True to reopen the port, the batch is then sent again if
+            retrySafe, as the device may have acted on it before the drop
+        """
+        if not self._reconnectAttempts or self._reconnected or listening:
+            return False
+        self._reconnected = True
+        return True
+
+
+class _ReplyFramer:
+    """
+    Incrementally split device replies out of a buffered byte stream
+    """
+
+    __slots__ = (
+        "buffer",
+        "error",
+        "_terminator",
+        "_lineCount",
+        "_linesRead",
+        "_scanPos",
+        "_errorPattern",
+    )
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        # Error line that ended the last reply early, None if it was a normal reply
+        self.error: Optional[bytes] = None
+        self._terminator = EOL
+        self._lineCount = 1
+        self._linesRead = 0
+        self._scanPos = 0
+        self._errorPattern: Optional[Pattern[bytes]] = None
+
+    def begin(
+        self,
+        lineCount: int = 1,
+        useDeviceEOL: bool = False,
+        errorPattern: Optional[Pattern[bytes]] = None,
+    ) -> None:
+        """
+        Start framing a new reply, keeping any bytes already buffered
+        @param lineCount: Number of terminated lines in the reply
+        @param useDeviceEOL: Lines end with \\n\\r instead of \\r\\n
+        @param errorPattern: Error line of the device profile, see
+            DeviceProfile.errorReplyPattern, None if it declares none
+        """
+        self._errorPattern = errorPattern
+        self._terminator = DEVICE_EOL if useDeviceEOL else EOL
+        self.error = None
+        self._lineCount = lineCount
+        self._linesRead = 0
+        self._scanPos = 0
+
+    def feed(self, data: bytes) -> None:
+        """
+        Append received bytes to the buffer
+        @param data: Bytes read from the port
+        """
+        self.buffer += data
+
+    def poll(self) -> Optional[bytes]:
+        """
+        Scan newly buffered bytes for line terminators
+        An error line from the device ends the reply early and is kept in error
+        @return: The complete reply, or None if more bytes are needed
+        """
+        buffer = self.buffer
+        terminator = self._terminator
+        while self._linesRead < self._lineCount:
+            index = buffer.find(terminator, self._scanPos)
+            if index < 0:
+                # Rescan the tail next time in case a terminator is split across chunks
+                self._scanPos = max(self._scanPos, len(buffer) - len(terminator) + 1)
+                return None
+            lineStart = self._scanPos
+            self._scanPos = index + len(terminator)
+            self._linesRead += 1
+            errorPattern = self._errorPattern
+            if errorPattern is not None and errorPattern.match(
+                buffer, lineStart, index
+            ):
+                self.error = bytes(buffer[lineStart:index]).strip()
+                break
+
+        # Keep leftover bytes buffered for the next reply
+        reply = bytes(buffer[: self._scanPos])
+        del buffer[: self._scanPos]
+        self._scanPos = 0
+        return reply
+
+    def clear(self) -> None:
+        """
+        Throw away any buffered bytes
+        """
+        self.buffer.clear()
+        self._scanPos = 0
+
 
 class AVAccessSerial:
     """
     General class for communicating with AV Access devices over RS232 serial
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self,
+        url: str,
+        lazy: bool = False,
+        instrumentation: Optional[Instrumentation] = None,
+        reconnectAttempts: int = RECONNECT_ATTEMPTS,
+        retryAttempts: int = RETRY_ATTEMPTS,
+    ) -> None:
         """
         Initialize the AVAccess device for connecting over serial
+        @param lazy: Don't open the port until the first command is sent
+        @param instrumentation: Receives per-command timings and counts
+        @param reconnectAttempts: Times to reopen a dropped connection, 0 to raise
+        @param retryAttempts: Times to resend a batch whose reply was cut short,
+            0 to raise
         """
+        self._framer = _ReplyFramer()
+        self.reconnectAttempts = reconnectAttempts
+        self.retryAttempts = retryAttempts
+        self.instrumentation = instrumentation or NO_INSTRUMENTATION
+        # When the first byte of the reply being read arrived, only set while timing
+        self._firstByteAt: Optional[float] = None
+        # Only one thread may talk to the port at a time
+        self._lock = threading.RLock()
+        # Background reader that owns the port, if one is running
+        self._listener = None
+        # Cached device state, None when caching is off
+        self.state: Optional[MatrixState] = None
+        # Error line of the device profile, None until it is loaded or if it
+        # declares none
+        self.errorReplyPattern: Optional[Pattern[bytes]] = None
+        # Called with (commands, device outputs, parsed results) after each exchange
+        self._replyObservers: List[
+            Callable[[List[AVAccessCommand], List[str], List[Any]], None]
+        ] = []
+        # Number of writes that waited on the device to reply
+        self.roundTrips = 0
         self._port = serial.serial_for_url(url, do_not_open=True)
         self._port.baudrate = 115200
         self._port.bytesize = serial.EIGHTBITS
@@ -21,66 +286,331 @@ class AVAccessSerial:
         self._port.stopbits = serial.STOPBITS_ONE
         self._port.timeout = SERIAL_TIMEOUT
         self._port.write_timeout = SERIAL_TIMEOUT
-        self._port.open()
+        if not lazy:
+            self._port.open()
+
+    def startCapture(self, path: str) -> None:
+        """
+        Record every byte written to and read from the port, with timestamps
+        Start before startListening() so the reader thread is recorded too,
+        play the capture back with an avreplay:// url
+        @param path: Capture file, appended to if it exists
+        """
+        from .capture import CaptureWriter, CapturingPort
+
+        with self._lock:
+            if isinstance(self._port, CapturingPort):
+                raise ValueError(
+                    "Already capturing to {}!".format(self._port.writer.path)
+                )
+            _LOGGER.debug("Capturing traffic to %s...", path)
+            writer = CaptureWriter(path, self._port.port)
+            self._port = CapturingPort(self._port, writer)
+
+    def stopCapture(self) -> None:
+        """
+        Stop recording started by startCapture() and close the capture file
+        """
+        from .capture import CapturingPort
+
+        with self._lock:
+            if isinstance(self._port, CapturingPort):
+                self._port.writer.close()
+                self._port = self._port._wrapped
 
     def _SendData(
-        self, cmdStr: str, useDeviceEOL: bool = False, lineCount: int = 1
+        self,
+        cmdStr: str,
+        useDeviceEOL: bool = False,
+        lineCount: int = 1,
+        timeout: Optional[float] = None,
     ) -> str:
         """
         Send a command to the device and receive its response
         @param cmdStr: Data to send
+        @param timeout: Seconds the device has to reply, None for the verb default
         @return: Response from the device
         """
+        command = AVAccessCommand(cmdStr, lineCount, useDeviceEOL, timeout=timeout)
+        return self._SendBatch([command])[0]
+
+    def _SendBatch(
+        self, commands: List[AVAccessCommand], timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Send several commands in one write and split the replies back out in order
+        Each command has its own deadline, see commandTimeout(). A reply cut
+        short by its deadline is retried after resynchronising, and a dropped
+        connection after reconnecting, when every command in the batch is safe
+        to send again
+        @param commands: Commands to send
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @return: Response from the device for each command
+        """
         _LOGGER.debug("Checking cmdStr content before sending to device")
-        # Make sure string exists
-        if not cmdStr:
+        # Make sure every string exists
+        if not all(command.cmdStr for command in commands):
             raise ValueError("Cannot send empty line to device!")
 
+        batchDeadline = None if timeout is None else time.monotonic() + timeout
+        recovery = _BatchRecovery(
+            commands, self.retryAttempts, self.reconnectAttempts
+        )
+        with self._lock:
+            while True:
+                try:
+                    return self._Exchange(commands, batchDeadline, timeout)
+                except DeadlineExceeded:
+                    raise
+                except CommandTimeout as exc:
+                    if not recovery.shouldResync(exc, self._listener is not None):
+                        raise
+                    self._resync(exc)
+                except serial.SerialTimeoutException:
+                    raise
+                except serial.SerialException as exc:
+                    if not recovery.shouldReconnect(self._listener is not None):
+                        raise
+                    self._reconnect(exc)
+                    # The device may have acted on the batch before the drop
+                    if not recovery.retrySafe:
+                        raise
+
+                # The batch may or may not have reached the device, send it again
+                for command in commands:
+                    self.instrumentation.observeRetry(command.verb)
+
+    def _Exchange(
+        self,
+        commands: List[AVAccessCommand],
+        batchDeadline: Optional[float],
+        timeout: Optional[float],
+    ) -> List[str]:
+        """
+        Write a batch and read its replies, called with the port lock held
+        @param batchDeadline: time.monotonic() value the whole batch must finish by
+        @param timeout: Seconds the whole batch may take, for error messages
+        @return: Response from the device for each command
+        """
+        if not self._port.is_open:
+            _LOGGER.debug("Opening port on first use...")
+            self._port.open()
+
+        # Unsolicited lines must not be thrown away while a listener runs
+        if self._listener is not None:
+            return self._listener.exchange(commands, batchDeadline)
+
         _LOGGER.debug("Clearing buffers...")
         self._port.reset_output_buffer()
         self._port.reset_input_buffer()
+        self._framer.clear()
 
-        # Process the cmd for sending
-        _LOGGER.debug('Encoding "%s"...', cmdStr)
-        cmdStr = cmdStr + "\r\n"
-        encodedCmd = cmdStr.encode("ascii")
+        # Process the cmds for sending
+        encoded = encodeCommands(commands)
+        encodedCmds = b"".join(encoded)
 
-        _LOGGER.debug('Sending "%s"...', encodedCmd)
-        self._port.write(encodedCmd)
+        instrumentation = self.instrumentation
+        timed = instrumentation.enabled
+        if timed:
+            sentAt = time.perf_counter()
+
+        _LOGGER.debug('Sending "%s"...', encodedCmds)
+        self._port.write(encodedCmds)
         self._port.flush()
+        self.roundTrips += 1
 
         _LOGGER.debug("Receiving...")
-        result = bytearray()
-        linesRead = 0
-        while True:
-            char = self._port.read(1)
+        replies = []
+        for command, encodedCmd in zip(commands, encoded):
+            deadline = time.monotonic() + commandTimeout(command)
+            if batchDeadline is not None and batchDeadline < deadline:
+                deadline = batchDeadline
+            try:
+                ret = self._ReadReply(command, deadline, timed)
+            except DeviceErrorReply as exc:
+                # Replies to the rest of the batch may still be on their way
+                if command is not commands[-1]:
+                    self._resync(exc)
+                raise
+            except CommandTimeout as exc:
+                instrumentation.observeTimeout(command.verb)
+                if deadline is batchDeadline:
+                    raise DeadlineExceeded(
+                        "Batch of {} commands did not finish in {}s".format(
+                            len(commands), timeout
+                        ),
+                        exc.received,
+                    ) from exc
+                # Replies to the rest of the batch may still be on their way
+                if command is not commands[-1]:
+                    self._resync(exc)
+                raise
+            if timed:
+                instrumentation.observeCommand(
+                    command.verb,
+                    self._firstByteAt - sentAt,
+                    time.perf_counter() - sentAt,
+                    len(encodedCmd),
+                    len(ret),
+                )
+            _LOGGER.debug('Received "%s"', ret)
+            # Keep the response as an ascii string
+            replies.append(ret.decode("ascii").strip())
+        return replies
 
-            # Check for end of incoming serial
-            if char is None:
-                break
+    def _reconnect(self, cause: Exception) -> None:
+        """
+        Reopen the port after the connection dropped, backing off between attempts
+        The device config and API version are kept, so nothing else is resent
+        @param cause: Error that showed the connection was lost
+        """
+        _LOGGER.warning("Lost connection to %s: %s", self._port.port, cause)
+        # Changes made while we were away were not seen, read them again
+        if self.state is not None:
+            self.state.invalidate()
+
+        delays = reconnectBackoff()
+        for attempt in range(1, self.reconnectAttempts + 1):
+            try:
+                self._port.close()
+            except serial.SerialException:
+                pass
+            try:
+                self._port.open()
+            except serial.SerialException as exc:
+                _LOGGER.debug("Reconnect attempt %s failed: %s", attempt, exc)
+                cause = exc
+                if attempt < self.reconnectAttempts:
+                    time.sleep(next(delays))
+                continue
+            _LOGGER.info("Reconnected to %s", self._port.port)
+            self._framer.clear()
+            return
+        raise ConnectionLost(
+            "Could not reconnect to {} after {} attempts".format(
+                self._port.port, self.reconnectAttempts
+            )
+        ) from cause
+
+    def _resync(self, cause: Exception) -> None:
+        """
+        Get back in step with the device after a reply was cut short, or a
+        batch was rejected before the replies to its later commands arrived
+        Late bytes of those replies would be read as the start of the next one,
+        so GET VER is sent and everything up to its reply is thrown away
+        @param cause: Error that left replies unread, raised if resync fails
+        """
+        _LOGGER.debug("Resynchronising after %s...", cause)
+        port = self._port
+        port.reset_input_buffer()
+        self._framer.clear()
+        port.write(encodeCommand("GET VER"))
+        port.flush()
+        self.roundTrips += 1
+
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        received = b""
+        while not PATTERN_VER_REPLY.search(received):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise cause
+            port.timeout = remaining
+            received += port.read(port.in_waiting or 1)
+
+    def _Run(self, command: AVAccessCommand) -> Any:
+        """
+        Send a command to the device and parse its response
+        @param command: Command to send
+        @return: Parsed response from the device
+        """
+        return self._RunBatch([command])[0]
+
+    def _RunBatch(
+        self,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Send several commands in one write and parse each response
+        @param commands: Commands to send
+        @param combine: Turns the list of parsed responses into a single result
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @return: Parsed response from the device for each command, or the combined result
+        """
+        # Serve what we can from cached state and only send the rest
+        results = lookupCommands(self.state, commands)
+        toSend = [
+            command for command, result in zip(commands, results) if result is MISSING
+        ]
+        if toSend:
+            deviceOutputs = self._SendBatch(toSend, timeout)
+            _LOGGER.debug("Device output: %s", deviceOutputs)
+            parsed = parseReplies(self.instrumentation, toSend, deviceOutputs)
+            recordCommands(self.state, toSend, parsed)
+            for observer in self._replyObservers:
+                observer(toSend, deviceOutputs, parsed)
+
+            sentResults = iter(parsed)
+            results = [
+                next(sentResults) if result is MISSING else result
+                for result in results
+            ]
 
-            # If we received back nothing, but not null (ex: "")
-            if not char:
+        if combine is None:
+            return results
+        return combine(results)
+
+    def _ReadReply(
+        self, command: AVAccessCommand, deadline: float, timed: bool = False
+    ) -> bytes:
+        """
+        Read one reply from the device, pulling bytes in chunks
+        @param command: Command the reply belongs to
+        @param deadline: time.monotonic() value by which the reply must be complete
+        @param timed: Record when the first byte of the reply arrived in _firstByteAt
+        @return: Raw reply bytes including terminators
+        """
+        port = self._port
+        framer = self._framer
+        framer.begin(command.lineCount, command.useDeviceEOL, self.errorReplyPattern)
+        # Changing the timeout reconfigures real ports, so only do it when needed
+        budget = commandTimeout(command)
+        remaining = deadline - time.monotonic()
+        if remaining < budget:
+            budget = max(remaining, 0)
+        if port.timeout != budget:
+            port.timeout = budget
+        if timed:
+            # Bytes left over from the previous reply have already arrived
+            self._firstByteAt = time.perf_counter() if framer.buffer else None
+        while True:
+            reply = framer.poll()
+            if reply is not None:
+                if framer.error is not None:
+                    raise DeviceErrorReply(
+                        command.cmdStr, framer.error.decode("ascii", "replace")
+                    )
+                return reply
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 # Usually only reached by invalid command
-                raise serial.SerialTimeoutException(
+                raise CommandTimeout(
                     "Connection timed out! Last received bytes {}".format(
-                        [hex(c) for c in result]
-                    )
+                        [hex(c) for c in framer.buffer]
+                    ),
+                    bytes(framer.buffer),
                 )
+            # Don't block far past the deadline, without reconfiguring on every read
+            if port.timeout > 2 * remaining:
+                port.timeout = remaining
 
-            result += char
-            if len(result) > 0 and (
-                # Most responses end with \r\n but some end with \n\r such as GET VER
-                result.endswith(b"\n\r" if useDeviceEOL else b"\r\n")
-            ):
-                linesRead += 1
-
-            if linesRead >= lineCount:
-                break
-
-        # Process the byte array for returning
-        ret = bytes(result)
-        _LOGGER.debug('Received "%s"', ret)
+            # Block for the first byte, then take whatever else has arrived
+            chunk = port.read(port.in_waiting or 1)
+            if not chunk:
+                continue
 
-        # Return the response as an ascii string
-        return ret.decode("ascii").strip()
+            if timed and self._firstByteAt is None:
+                self._firstByteAt = time.perf_counter()
+            framer.feed(chunk)
@@ -0,0 +1,97 @@
+import logging
+from typing import Any, Callable, List, Optional
+
+from .command import AVAccessCommand
+from .hdmi_matrix import HDMIMatrixBase
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HDMIMatrixBatch(HDMIMatrixBase):
+    """
+    Queue several matrix commands and send them in a single write
+
+    The batch has the same getters and setters as the matrix it was created
+    from. Calling them only queues the command and returns its index in the
+    results; execute() writes every queued command at once and splits the
+    reply stream back into one parsed result per command, in order.
+
+    Usage:
+        batch = av.batch()
+        batch.getMapping(1)
+        batch.getMuteStatus("audioout1")
+        mapping, mute = batch.execute()
+
+    For an AsyncHDMIMatrix, execute() returns an awaitable of the results.
+    """
+
+    def __init__(
+        self,
+        matrix: HDMIMatrixBase,
+        timeout: Optional[float] = None,
+        bypassCache: bool = False,
+    ) -> None:
+        """
+        @param matrix: Matrix the commands are sent to
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @param bypassCache: Send reads to the device even if the matrix has their
+            values cached, the replies still update the cache
+        """
+        self._matrix = matrix
+        self.timeout = timeout
+        self.bypassCache = bypassCache
+        self._commands: List[AVAccessCommand] = []
+        self.results: Optional[List[Any]] = None
+
+        # Share the device config so arguments are checked before queueing
+        self.registry = matrix.registry
+        self._setupDevice(matrix.model, matrix.apiVersion)
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    @property
+    def commands(self) -> List[str]:
+        """
+        @return: Command strings queued so far, in the order they will be sent
+        """
+        return [command.cmdStr for command in self._commands]
+
+    def _Run(self, command: AVAccessCommand) -> int:
+        """
+        Queue a command
+        @param command: Command to send
+        @return: Index of the command's result
+        """
+        if self.bypassCache:
+            command.readState = None
+        self._commands.append(command)
+        return len(self._commands) - 1
+
+    def execute(self, combine: Optional[Callable[[List[Any]], Any]] = None) -> Any:
+        """
+        Send all queued commands and clear the queue
+        @param combine: Turns the list of parsed responses into a single result
+        @return: Parsed response from the device for each command, or the combined result
+        """
+        commands, self._commands = self._commands, []
+        _LOGGER.debug("Sending batch of %s commands...", len(commands))
+        results = self._matrix._RunBatch(commands, combine, self.timeout)
+        if combine is None and isinstance(results, list):
+            self.results = results
+        return results
+
+    def __enter__(self) -> "HDMIMatrixBatch":
+        return self
+
+    def __exit__(self, excType, *exc_info) -> None:
+        # Only send the batch if building it succeeded
+        if excType is None:
+            self.execute()
+
+    async def __aenter__(self) -> "HDMIMatrixBatch":
+        return self
+
+    async def __aexit__(self, excType, *exc_info) -> None:
+        if excType is None:
+            self.results = await self.execute()
@@ -0,0 +1,620 @@
+"""
+Share one matrix between processes through a local broker
+
+The broker owns the serial port and serves clients over a Unix socket. Run it
+as a service:
+
+    pyavaccess-broker /dev/ttyUSB0 4KMX42-H2A --socket /run/pyavaccess.sock
+
+or "python -m pyavaccess" with the same arguments.
+
+and replace HDMIMatrixSerial with HDMIMatrixClient in every process that
+needs the matrix:
+
+    av = HDMIMatrixClient("/run/pyavaccess.sock")
+    av.mapOutput(1, 4)
+
+Requests and replies are single lines of JSON. Clients validate arguments,
+build commands and parse replies themselves, so only command strings and
+raw device replies cross the socket. The broker sends them through the
+matrix like its own commands, so they update its state cache and reach its
+poller.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import serial
+
+from .command import AVAccessCommand
+from .exceptions import (
+    AVAccessError,
+    CommandTimeout,
+    ConnectionLost,
+    DeadlineExceeded,
+    DeviceErrorReply,
+)
+from .hdmi_matrix import HDMIMatrixApplyMixin, HDMIMatrixBase, HDMIMatrixSerial
+from .listener import (
+    STATE_VERBS,
+    STATUS_KINDS,
+    MatrixEvent,
+    MatrixListener,
+    replyStates,
+)
+from .metrics import NO_INSTRUMENTATION, parseReplies
+from .state import MISSING, MatrixState, lookupCommands, recordCommands
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds the broker answers reads from the matrix's state cache
+BROKER_CACHE_TTL = 1.0
+# State key prefix of the last raw reply to a read, see MatrixBroker._wireCommand
+_REPLY = "REPLY"
+# Seconds a client waits for the broker to answer a request
+CLIENT_TIMEOUT = 30.0
+# How often the server checks whether it should stop
+POLL_INTERVAL = 0.1
+# Seconds between attempts to restart a listener whose connection dropped
+LISTENER_RESTART_INTERVAL = 5.0
+
+# Errors a client raises again by name, others become AVAccessError
+_ERRORS = {
+    error.__name__: error
+    for error in (
+        AVAccessError,
+        CommandTimeout,
+        ConnectionLost,
+        DeadlineExceeded,
+        ValueError,
+    )
+}
+
+
+def _encodeError(exc: Exception) -> Dict[str, Any]:
+    error = {"type": type(exc).__name__, "message": str(exc)}
+    if isinstance(exc, DeviceErrorReply):
+        error.update(command=exc.command, reply=exc.reply)
+    return error
+
+
+def _decodeError(error: Dict[str, Any]) -> Exception:
+    if error["type"] == "DeviceErrorReply":
+        return DeviceErrorReply(error["command"], error["reply"])
+    return _ERRORS.get(error["type"], AVAccessError)(error["message"])
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """
+    Serves one client connection, one request line at a time
+    """
+
+    server: "_BrokerServer"
+
+    def handle(self) -> None:
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request["op"]
+            except (ValueError, KeyError, TypeError):
+                self._send({"error": {"type": "ValueError", "message": "Bad request"}})
+                continue
+
+            if op == "hello":
+                self._send(
+                    {
+                        "model": broker.matrix.model,
+                        "apiVersion": broker.matrix.apiVersion,
+                    }
+                )
+            elif op == "run":
+                try:
+                    replies = broker.run(request["commands"], request.get("timeout"))
+                except Exception as exc:
+                    self._send({"error": _encodeError(exc)})
+                else:
+                    self._send({"replies": replies})
+            elif op == "subscribe":
+                broker._addSubscriber(self)
+                self._send({"subscribed": True})
+            else:
+                self._send(
+                    {
+                        "error": {
+                            "type": "ValueError",
+                            "message": "Unknown op {!r}".format(op),
+                        }
+                    }
+                )
+        broker._removeSubscriber(self)
+
+    def setup(self) -> None:
+        super().setup()
+        self._writeLock = threading.Lock()
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        data = json.dumps(message).encode("utf-8") + b"\n"
+        with self._writeLock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+
+class _BrokerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, broker: "MatrixBroker") -> None:
+        self.broker = broker
+        super().__init__(path, _BrokerHandler)
+
+    def service_actions(self) -> None:
+        # Called by serve_forever() between requests
+        self.broker._checkListener()
+
+
+class MatrixBroker:
+    """
+    Owns a matrix's port and serves it to local clients over a Unix socket
+
+    Commands from every client are sent one batch at a time through the
+    matrix, so they share its state cache and reply observers with local
+    callers. A read is answered from the cache while the values its last
+    reply carried are fresh and unchanged.
+    State changes are pushed to clients that subscribed, and the listener is
+    restarted if its connection drops.
+
+    Usage:
+        matrix = HDMIMatrixSerial("/dev/ttyUSB0", "4KMX42-H2A")
+        with MatrixBroker(matrix, "/run/pyavaccess.sock") as broker:
+            broker.serveForever()
+    """
+
+    def __init__(
+        self,
+        matrix: HDMIMatrixSerial,
+        path: str,
+        cacheTTL: float = BROKER_CACHE_TTL,
+        events: bool = True,
+        mode: int = 0o600,
+    ) -> None:
+        """
+        @param matrix: Matrix whose port the broker owns
+        @param path: Unix socket to listen on, replaced if left over from a previous run
+        @param cacheTTL: Seconds a read is answered from the matrix's state cache
+            if the matrix has none yet, 0 to always read
+        @param events: Listen for unsolicited state changes and push them to subscribers
+        @param mode: Permissions of the socket file
+        """
+        self.matrix = matrix
+        self.path = path
+        if cacheTTL and matrix.state is None:
+            matrix.enableCache(cacheTTL)
+        self._subscribers: List[_BrokerHandler] = []
+        self._subscribersLock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._serving = False
+
+        if os.path.exists(path):
+            _LOGGER.debug("Removing stale broker socket %s...", path)
+            os.unlink(path)
+        # Create the socket file with its final permissions, never wider
+        umask = os.umask(~mode & 0o777)
+        try:
+            self._server = _BrokerServer(path, self)
+        finally:
+            os.umask(umask)
+
+        self._listener: Optional[MatrixListener] = None
+        self._unsubscribe: Optional[Callable[[], None]] = None
+        # time.monotonic() value before which a dead listener is not restarted
+        self._listenerRestartAt = 0.0
+        if events:
+            self._listener = matrix.startListening()
+            self._unsubscribe = self._listener.subscribe(self._onEvent)
+
+    def run(
+        self, wireCommands: List[List[Any]], timeout: Optional[float] = None
+    ) -> List[str]:
+        """
+        Send commands from a client, answering fresh reads from the state cache
+        @param wireCommands: [cmdStr, lineCount, useDeviceEOL, timeout] for each command
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @return: Raw reply from the device for each command
+        """
+        commands = []
+        for cmdStr, lineCount, useDeviceEOL, commandTimeout in wireCommands:
+            # One command per line, a client must not smuggle in another
+            if not isinstance(cmdStr, str) or "\r" in cmdStr or "\n" in cmdStr:
+                raise ValueError("Invalid command {!r}".format(cmdStr))
+            commands.append(
+                self._wireCommand(
+                    cmdStr, int(lineCount), bool(useDeviceEOL), commandTimeout
+                )
+            )
+
+        # Raw replies come back, the client parses them itself
+        return self.matrix._RunBatch(commands, None, timeout)
+
+    def _wireCommand(
+        self,
+        cmdStr: str,
+        lineCount: int,
+        useDeviceEOL: bool,
+        timeout: Optional[float],
+    ) -> AVAccessCommand:
+        """
+        Command from a client, reading and writing the matrix's state cache
+        The raw reply to a read is cached next to the values it carries and
+        only served while the cache still holds those values
+        @return: Command whose result is the raw reply from the device
+        """
+        command = AVAccessCommand(cmdStr, lineCount, useDeviceEOL, timeout=timeout)
+        if cmdStr in ("RESET", "REBOOT"):
+            command.writeState = lambda state, deviceOutput: state.invalidate()
+            return command
+        if command.replyVerb not in STATUS_KINDS:
+            return command
+
+        outputs = self.matrix.outputs
+        key = (_REPLY, cmdStr)
+
+        def writeState(state: MatrixState, deviceOutput: str) -> None:
+            for kind, target, value in replyStates(deviceOutput, outputs):
+                state.set((STATE_VERBS[kind], target), value)
+            if command.isQuery:
+                state.set(key, deviceOutput)
+
+        def readState(state: MatrixState) -> Any:
+            deviceOutput = state.get(key)
+            if deviceOutput is MISSING:
+                return MISSING
+            for kind, target, value in replyStates(deviceOutput, outputs):
+                if state.get((STATE_VERBS[kind], target)) != value:
+                    return MISSING
+            return deviceOutput
+
+        command.writeState = writeState
+        if command.isQuery:
+            command.readState = readState
+        return command
+
+    def _checkListener(self) -> None:
+        """
+        Restart the listener if it stopped because the connection dropped
+        GET VER is sent first, reconnecting if the connection is still down
+        """
+        listener = self._listener
+        if listener is None or listener.running:
+            return
+        if time.monotonic() < self._listenerRestartAt:
+            return
+        _LOGGER.info("Restarting listener for %s...", self.matrix.url)
+        try:
+            with self.matrix._lock:
+                self.matrix.getVer()
+                listener.start()
+        except (AVAccessError, serial.SerialException) as exc:
+            _LOGGER.warning("Could not restart listener: %s", exc)
+            self._listenerRestartAt = time.monotonic() + LISTENER_RESTART_INTERVAL
+            return
+        # Changes made while nobody was listening were not seen
+        self.matrix.invalidateCache()
+
+    def _onEvent(self, event: MatrixEvent) -> None:
+        """
+        Push the change to subscribers, the listener already cached it
+        """
+        message = {
+            "event": {
+                "kind": event.kind,
+                "target": event.target,
+                "value": event.value,
+                "line": event.line,
+            }
+        }
+        with self._subscribersLock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber._send(message)
+            except OSError:
+                self._removeSubscriber(subscriber)
+
+    def _addSubscriber(self, handler: _BrokerHandler) -> None:
+        with self._subscribersLock:
+            self._subscribers.append(handler)
+
+    def _removeSubscriber(self, handler: _BrokerHandler) -> None:
+        with self._subscribersLock:
+            if handler in self._subscribers:
+                self._subscribers.remove(handler)
+
+    def serveForever(self) -> None:
+        """
+        Serve clients until stop() is called
+        """
+        _LOGGER.info("Broker for %s listening on %s", self.matrix.url, self.path)
+        self._serving = True
+        try:
+            self._server.serve_forever(POLL_INTERVAL)
+        finally:
+            self._serving = False
+
+    def start(self) -> None:
+        """
+        Serve clients from a background thread
+        """
+        self._thread = threading.Thread(
+            target=self.serveForever, name="pyavaccess-broker", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop serving, stop listening to the device and remove the socket file
+        """
+        if self._serving:
+            self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+            self._listener.stop()
+            self._listener = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self) -> "MatrixBroker":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class HDMIMatrixClient(HDMIMatrixApplyMixin, HDMIMatrixBase):
+    """
+    Matrix served by a MatrixBroker in another process
+
+    Has every getter and setter of HDMIMatrixSerial, including batches,
+    snapshots, presets and settings, so switching only means changing the
+    constructor.
+    Arguments are validated and replies parsed in this process.
+
+    Usage:
+        av = HDMIMatrixClient("/run/pyavaccess.sock")
+        av.mapOutput(1, 4)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        cacheTTL: Optional[float] = None,
+        timeout: float = CLIENT_TIMEOUT,
+    ) -> None:
+        """
+        @param path: Unix socket the broker listens on
+        @param cacheTTL: Seconds to serve state from memory in this process,
+            None to always ask the broker
+        @param timeout: Seconds to wait for the broker to answer a request,
+            longer batches get their own timeout
+        """
+        _LOGGER.debug("Connecting to matrix broker %s...", path)
+        self.url = path
+        self.timeout = timeout
+        # Number of requests that waited on the broker
+        self.roundTrips = 0
+        self._lock = threading.Lock()
+        self._socket: Optional[socket.socket] = None
+        self._connect()
+        self._eventSockets: List[socket.socket] = []
+
+        identity = self._request({"op": "hello"})
+        self._setupDevice(identity["model"], identity["apiVersion"])
+        if cacheTTL is not None:
+            self.enableCache(cacheTTL)
+
+    def _connect(self) -> None:
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        self._socket.connect(self.url)
+        self._reader = self._socket.makefile("rb")
+
+    def _disconnect(self) -> None:
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+            self._socket = None
+
+    def _request(
+        self, message: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        @param message: Request for the broker
+        @param timeout: Seconds the request may take if longer than the client's
+        @return: The broker's reply
+        """
+        data = json.dumps(message).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._socket is None:
+                self._connect()
+            if timeout is not None and timeout > self.timeout:
+                self._socket.settimeout(timeout)
+            try:
+                self._socket.sendall(data)
+                line = self._reader.readline()
+            except socket.timeout:
+                # A late reply would answer the next request, start over
+                self._disconnect()
+                raise CommandTimeout(
+                    "Broker {} did not answer in time".format(self.url)
+                ) from None
+            except OSError as exc:
+                self._disconnect()
+                raise ConnectionLost(
+                    "Lost connection to broker {}: {}".format(self.url, exc)
+                ) from exc
+            finally:
+                if self._socket is not None:
+                    self._socket.settimeout(self.timeout)
+            if not line:
+                self._disconnect()
+        if not line:
+            raise ConnectionLost("Broker {} closed the connection".format(self.url))
+        reply = json.loads(line)
+        if "error" in reply:
+            raise _decodeError(reply["error"])
+        return reply
+
+    def _Run(self, command: AVAccessCommand) -> Any:
+        """
+        Send a command through the broker and parse its response
+        @param command: Command to send
+        @return: Parsed response from the device
+        """
+        return self._RunBatch([command])[0]
+
+    def _RunBatch(
+        self,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Send several commands through the broker in one request
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @return: Parsed response from the device for each command, or the combined result
+        """
+        results = lookupCommands(self.state, commands)
+        toSend = [
+            command for command, result in zip(commands, results) if result is MISSING
+        ]
+        if toSend:
+            reply = self._request(
+                {
+                    "op": "run",
+                    "commands": [
+                        [
+                            command.cmdStr,
+                            command.lineCount,
+                            command.useDeviceEOL,
+                            command.timeout,
+                        ]
+                        for command in toSend
+                    ],
+                    "timeout": timeout,
+                },
+                timeout,
+            )
+            self.roundTrips += 1
+            parsed = parseReplies(NO_INSTRUMENTATION, toSend, reply["replies"])
+            recordCommands(self.state, toSend, parsed)
+
+            sentResults = iter(parsed)
+            results = [
+                next(sentResults) if result is MISSING else result for result in results
+            ]
+
+        if combine is None:
+            return results
+        return combine(results)
+
+    def subscribe(self, callback: Callable[[MatrixEvent], None]) -> Callable[[], None]:
+        """
+        @param callback: Called from a background thread with every MatrixEvent
+            the broker's device reports
+        @return: Function that unsubscribes the callback
+        """
+        eventSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        eventSocket.connect(self.url)
+        eventSocket.sendall(b'{"op": "subscribe"}\n')
+        reader = eventSocket.makefile("rb")
+        reader.readline()
+        self._eventSockets.append(eventSocket)
+
+        def read() -> None:
+            for line in reader:
+                event = json.loads(line).get("event")
+                if event is None:
+                    continue
+                if self.state is not None:
+                    self.invalidateCache()
+                try:
+                    callback(MatrixEvent(**event))
+                except Exception:
+                    _LOGGER.exception("Error in matrix event callback")
+
+        threading.Thread(
+            target=read, name="pyavaccess-client-events", daemon=True
+        ).start()
+
+        def unsubscribe() -> None:
+            if eventSocket in self._eventSockets:
+                self._eventSockets.remove(eventSocket)
+                eventSocket.shutdown(socket.SHUT_RDWR)
+                eventSocket.close()
+
+        return unsubscribe
+
+    def close(self) -> None:
+        """
+        Disconnect from the broker
+        """
+        for eventSocket in list(self._eventSockets):
+            eventSocket.shutdown(socket.SHUT_RDWR)
+            eventSocket.close()
+        self._eventSockets.clear()
+        with self._lock:
+            self._disconnect()
+
+    def __enter__(self) -> "HDMIMatrixClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run a broker until interrupted, see the pyavaccess-broker console script
+    @param argv: Command line arguments, None for sys.argv
+    """
+    parser = argparse.ArgumentParser(
+        prog="pyavaccess-broker",
+        description="Share an AV Access matrix between local processes",
+    )
+    parser.add_argument("url", help="Port url or device name, ex: /dev/ttyUSB0")
+    parser.add_argument("device", help="Device model, ex: 4KMX42-H2A")
+    parser.add_argument(
+        "--socket", default="/run/pyavaccess.sock", help="Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=BROKER_CACHE_TTL,
+        help="Seconds to answer reads from the matrix's state cache",
+    )
+    parser.add_argument(
+        "--mode",
+        type=lambda mode: int(mode, 8),
+        default=0o600,
+        help="Permissions of the socket file, in octal",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    matrix = HDMIMatrixSerial(args.url, args.device)
+    with MatrixBroker(matrix, args.socket, args.cache_ttl, mode=args.mode) as broker:
+        try:
+            broker.serveForever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,145 @@
+"""
+Binary traffic captures of the bytes exchanged with a device
+
+A capture file starts with MAGIC and is followed by records, each a
+RECORD header (kind, seconds since the capture started, data length) and
+the data. Records are only ever appended, every capture session starts
+with an OPENED record holding the port's url and ends with an empty CLOSED
+record. Closing and reopening the port in between, ex: to reconnect, is
+recorded as CLOSED and OPENED records holding the url.
+
+Play a capture back with the avreplay:// url handler.
+"""
+
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Iterator, Optional
+
+MAGIC = b"AVCAP\x01"
+RECORD = struct.Struct("<cdI")
+
+# Record kinds
+OPENED = b"O"
+WRITTEN = b"W"
+READ = b"R"
+CLOSED = b"C"
+
+
+@dataclass(frozen=True)
+class CaptureRecord:
+    """
+    One event in a capture
+    """
+
+    __slots__ = ("kind", "at", "data")
+
+    # OPENED, WRITTEN, READ or CLOSED
+    kind: bytes
+    # Seconds since the capture session started
+    at: float
+    # Bytes written or read, the port's url for OPENED and CLOSED
+    data: bytes
+
+
+def readCapture(path: str) -> Iterator[CaptureRecord]:
+    """
+    @param path: Capture file
+    @return: Every record in the file, in order
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a pyavaccess capture!".format(path))
+        while True:
+            header = file.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # A capture cut short by a crash ends with a partial record
+                return
+            kind, at, length = RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield CaptureRecord(kind, at, data)
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file
+    """
+
+    def __init__(self, path: str, url: str) -> None:
+        """
+        @param path: Capture file, created if missing and appended to otherwise
+        @param url: Url of the captured port, recorded when the session starts
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file: BinaryIO = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._startedAt = time.monotonic()
+        self.record(OPENED, url.encode("utf-8"))
+
+    def record(self, kind: bytes, data: bytes) -> None:
+        """
+        @param kind: Record kind, ex: WRITTEN
+        @param data: Bytes written or read
+        """
+        at = time.monotonic() - self._startedAt
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD.pack(kind, at, len(data)))
+            self._file.write(data)
+            # One flush per command batch keeps field captures usable after a crash
+            if kind == WRITTEN:
+                self._file.flush()
+
+    def close(self) -> None:
+        # Unlike the port closing, the end of the session has no url
+        self.record(CLOSED, b"")
+        with self._lock:
+            self._file.close()
+
+
+class CapturingPort:
+    """
+    Serial port wrapper recording every write and read to a capture
+
+    Everything else is passed through to the wrapped port.
+    """
+
+    def __init__(self, port: Any, writer: CaptureWriter) -> None:
+        """
+        @param port: pyserial port to record
+        @param writer: Capture the traffic is appended to
+        """
+        # Not "port", which is the wrapped port's url
+        object.__setattr__(self, "_wrapped", port)
+        object.__setattr__(self, "writer", writer)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._wrapped, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Ex: the timeout, which is changed on the wrapped port
+        setattr(self._wrapped, name, value)
+
+    def open(self) -> None:
+        self._wrapped.open()
+        self.writer.record(OPENED, self._wrapped.port.encode("utf-8"))
+
+    def close(self) -> None:
+        self.writer.record(CLOSED, self._wrapped.port.encode("utf-8"))
+        self._wrapped.close()
+
+    def write(self, data: bytes) -> Optional[int]:
+        self.writer.record(WRITTEN, bytes(data))
+        return self._wrapped.write(data)
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._wrapped.read(size)
+        if data:
+            self.writer.record(READ, data)
+        return data
@@ -0,0 +1,213 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from .command import AVAccessCommand
+from .hdmi_matrix import HDMIMatrixBase
+
+if TYPE_CHECKING:
+    from .hdmi_matrix import HDMIMatrixSerial
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds a write waits for newer writes to the same target
+DEFAULT_WINDOW = 0.1
+
+# Field holding the target of each set command that can be coalesced,
+# None for commands without a target (ex: "SET SW in3 out1" -> "out1")
+COALESCE_TARGETS = {
+    "SET SW": 3,
+    "SET MUTE": 2,
+    "SET EDID": 2,
+    "SET AUTOCEC_FN": 2,
+    "SET AUTOCEC_D": 2,
+    "SET CEC_PWR": 2,
+    "SET IR_SC": None,
+}
+
+
+def coalesceKey(command: AVAccessCommand) -> Optional[Tuple[str, Optional[str]]]:
+    """
+    @param command: Command about to be sent
+    @return: (verb, target) shared by writes that replace each other,
+        None if the command can't be coalesced
+    """
+    verb = command.verb
+    if verb not in COALESCE_TARGETS:
+        return None
+    field = COALESCE_TARGETS[verb]
+    if field is None:
+        return verb, None
+    return verb, command.cmdStr.split()[field]
+
+
+class _PendingWrite:
+    """
+    Latest write to a target and everyone waiting on it
+    """
+
+    __slots__ = ("command", "futures")
+
+    def __init__(self, command: AVAccessCommand) -> None:
+        self.command = command
+        self.futures: List[Future] = []
+
+
+class HDMIMatrixCoalescer(HDMIMatrixBase):
+    """
+    Collapse rapid-fire writes to the same target into the latest one
+
+    The coalescer has the same getters and setters as the matrix, but they
+    return a concurrent.futures.Future. Set commands wait up to window seconds
+    for newer writes to the same target (ex: the same output for mapOutput),
+    then only the latest value of each target is sent, all in one write. Every
+    caller of a collapsed write gets the reply to the value that was sent.
+
+    Reads, reboots and batches are sent straight away from the calling thread,
+    after any pending writes so they see them.
+
+    Usage:
+        with av.coalescing(window=0.2) as avWrites:
+            for inNum in (2, 3, 4):
+                mapping = avWrites.mapOutput(1, inNum)
+            print(mapping.result())  # {1: 4}, only "SET SW in4 out1" was sent
+    """
+
+    def __init__(
+        self, matrix: "HDMIMatrixSerial", window: float = DEFAULT_WINDOW
+    ) -> None:
+        """
+        @param matrix: Matrix the commands are sent to
+        @param window: Seconds from the first pending write until the writes are sent
+        """
+        self._matrix = matrix
+        self.window = window
+        # Number of writes replaced by a newer write before being sent
+        self.coalesced = 0
+        self._pending: Dict[Tuple[str, Optional[str]], _PendingWrite] = {}
+        self._pendingLock = threading.Lock()
+        # Keeps flushed writes in order with commands sent from other threads
+        self._sendLock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+        # Share the device config so arguments are checked before queueing
+        self.registry = matrix.registry
+        self._setupDevice(matrix.model, matrix.apiVersion)
+
+    @property
+    def roundTrips(self) -> int:
+        return self._matrix.roundTrips
+
+    def _Run(self, command: AVAccessCommand) -> Future:
+        """
+        Hold a write for coalescing, or send any other command now
+        @param command: Command to send
+        @return: Future for the parsed response from the device
+        """
+        key = coalesceKey(command)
+        if key is None:
+            return self._RunBatch([command], lambda results: results[0])
+
+        future: Future = Future()
+        with self._pendingLock:
+            write = self._pending.pop(key, None)
+            if write is None:
+                write = _PendingWrite(command)
+            else:
+                _LOGGER.debug(
+                    'Replacing "%s" with "%s"', write.command.cmdStr, command.cmdStr
+                )
+                write.command = command
+                self.coalesced += 1
+            write.futures.append(future)
+            # A newer write goes after everything pending, like it would unbatched
+            self._pending[key] = write
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def _RunBatch(
+        self,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """
+        Send pending writes followed by the commands, in one write
+        @param timeout: Seconds the commands may take
+        @return: Future for the parsed responses, or the combined result
+        """
+        future: Future = Future()
+        with self._sendLock:
+            writes = self._takePending()
+            try:
+                results = self._send(writes, commands, timeout)
+                future.set_result(results if combine is None else combine(results))
+            except BaseException as exc:
+                future.set_exception(exc)
+        return future
+
+    def flush(self) -> None:
+        """
+        Send every pending write now instead of waiting for the window to end
+        """
+        with self._sendLock:
+            writes = self._takePending()
+            if writes:
+                try:
+                    self._send(writes, [], None)
+                except BaseException as exc:
+                    _LOGGER.debug("Coalesced writes failed: %s", exc)
+
+    def _takePending(self) -> List[_PendingWrite]:
+        with self._pendingLock:
+            writes = list(self._pending.values())
+            self._pending.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return writes
+
+    def _send(
+        self,
+        writes: List[_PendingWrite],
+        commands: List[AVAccessCommand],
+        timeout: Optional[float],
+    ) -> List[Any]:
+        """
+        Send the latest pending writes and the commands in one batch
+        Failures are passed to the writers' futures and raised
+        @return: Parsed responses to the commands
+        """
+        if not writes:
+            return self._matrix._RunBatch(commands, None, timeout)
+
+        _LOGGER.debug("Sending %s coalesced writes...", len(writes))
+        try:
+            results = self._matrix._RunBatch(
+                [write.command for write in writes] + commands, None, timeout
+            )
+        except BaseException as exc:
+            for write in writes:
+                for future in write.futures:
+                    future.set_exception(exc)
+            raise
+        for write, result in zip(writes, results):
+            for future in write.futures:
+                future.set_result(result)
+        return results[len(writes) :]
+
+    def close(self) -> None:
+        """
+        Send any pending writes
+        """
+        self.flush()
+
+    def __enter__(self) -> "HDMIMatrixCoalescer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,114 @@
+import re
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    from .state import MatrixState
+
+# Input or output argument of a command (ex: "in2", "out1", "audioout1")
+PATTERN_TARGET = re.compile(r"^(?:in\d+|\w*out\d+)$")
+
+
+class AVAccessCommand:
+    """
+    A single command for an AV Access device and how to read its reply
+    """
+
+    __slots__ = (
+        "cmdStr",
+        "lineCount",
+        "useDeviceEOL",
+        "parser",
+        "readState",
+        "writeState",
+        "timeout",
+        "encoded",
+    )
+
+    def __init__(
+        self,
+        cmdStr: str,
+        lineCount: int = 1,
+        useDeviceEOL: bool = False,
+        parser: Optional[Callable[[str], Any]] = None,
+        readState: Optional[Callable[["MatrixState"], Any]] = None,
+        writeState: Optional[Callable[["MatrixState", Any], None]] = None,
+        timeout: Optional[float] = None,
+        encoded: Optional[bytes] = None,
+    ) -> None:
+        """
+        @param cmdStr: Command to send, without line ending
+        @param lineCount: Number of lines the device replies with
+        @param useDeviceEOL: Reply lines end with \\n\\r instead of \\r\\n
+        @param parser: Turns the device output into the value returned to the caller
+        @param readState: Answers the command from cached state, or returns MISSING
+        @param writeState: Records the parsed result in cached state
+        @param timeout: Seconds the device has to reply, None for the verb default
+        @param encoded: Precompiled bytes to send, None to encode cmdStr when sent
+        """
+        self.cmdStr = cmdStr
+        self.lineCount = lineCount
+        self.useDeviceEOL = useDeviceEOL
+        self.parser = parser
+        self.readState = readState
+        self.writeState = writeState
+        self.timeout = timeout
+        self.encoded = encoded
+
+    @property
+    def verb(self) -> str:
+        """
+        @return: Command name without its arguments (ex: "GET MP", "SET SW", "REBOOT")
+        """
+        fields = self.cmdStr.split(" ", 2)
+        if fields[0] in ("GET", "SET") and len(fields) > 1:
+            return "{} {}".format(fields[0], fields[1])
+        return fields[0]
+
+    @property
+    def replyVerb(self) -> Optional[str]:
+        """
+        @return: First word of the reply lines (ex: "MP" for "GET MP all"), None if unknown
+        """
+        fields = self.cmdStr.split(" ", 2)
+        if fields[0] in ("GET", "SET") and len(fields) > 1:
+            return fields[1]
+        return None
+
+    @property
+    def replyTarget(self) -> Optional[str]:
+        """
+        @return: Input or output the reply is about (ex: "out1" for
+            "SET SW in3 out1"), None for "all" or commands without a target
+        """
+        fields = self.cmdStr.split()
+        if fields[0] not in ("GET", "SET") or "all" in fields:
+            return None
+        targets = [field for field in fields[2:] if PATTERN_TARGET.match(field)]
+        return targets[-1] if targets else None
+
+    @property
+    def isQuery(self) -> bool:
+        """
+        @return: True if the command only reads from the device
+        """
+        return self.cmdStr.startswith("GET ") or self.cmdStr == "help"
+
+    @property
+    def isRetrySafe(self) -> bool:
+        """
+        @return: True if sending the command twice leaves the device as sending
+            it once: reads and sets to an absolute value, not RESET or REBOOT
+        """
+        return self.cmdStr.startswith(("GET ", "SET ")) or self.cmdStr == "help"
+
+    def parse(self, deviceOutput: str) -> Any:
+        """
+        @param deviceOutput: Stripped reply from the device
+        @return: Parsed reply, or the raw reply if the command has no parser
+        """
+        if self.parser is None:
+            return deviceOutput
+        return self.parser(deviceOutput)
+
+    def __repr__(self) -> str:
+        return "AVAccessCommand({!r}, lineCount={})".format(self.cmdStr, self.lineCount)
@@ -0,0 +1,166 @@
+import itertools
+import logging
+import math
+import queue
+import threading
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
+from .command import AVAccessCommand
+from .hdmi_matrix import HDMIMatrixBase
+
+if TYPE_CHECKING:
+    from .hdmi_matrix import HDMIMatrixSerial
+
+_LOGGER = logging.getLogger(__name__)
+
+# Lower numbers are sent first
+PRIORITY_CONTROL = 0
+PRIORITY_POLL = 10
+
+
+def defaultPriority(commands: List[AVAccessCommand]) -> int:
+    """
+    @param commands: Commands sent together
+    @return: PRIORITY_POLL if every command only reads, PRIORITY_CONTROL otherwise
+    """
+    if all(command.isQuery for command in commands):
+        return PRIORITY_POLL
+    return PRIORITY_CONTROL
+
+
+class _CommandWorker:
+    """
+    Single writer thread that owns all I/O with one matrix
+    """
+
+    def __init__(self, matrix: "HDMIMatrixSerial") -> None:
+        self._matrix = matrix
+        self._jobs: "queue.PriorityQueue" = queue.PriorityQueue()
+        # Keeps jobs of equal priority in submission order
+        self._sequence = itertools.count()
+        self._thread = threading.Thread(
+            target=self._work, name="pyavaccess-{}".format(matrix.model), daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        priority: float,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]],
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """
+        @param timeout: Seconds the commands may take once sent
+        @return: Future for the parsed results of the commands
+        """
+        future: Future = Future()
+        self._jobs.put(
+            (priority, next(self._sequence), commands, combine, timeout, future)
+        )
+        return future
+
+    def stop(self) -> None:
+        """
+        Finish every queued job, then stop the thread
+        """
+        self._jobs.put((math.inf, next(self._sequence), None, None, None, None))
+        self._thread.join()
+
+    def _work(self) -> None:
+        while True:
+            _, _, commands, combine, timeout, future = self._jobs.get()
+            if commands is None:
+                return
+            # Skip jobs the caller cancelled while they were queued
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._matrix._RunBatch(commands, combine, timeout))
+            except BaseException as exc:
+                _LOGGER.debug("Queued commands %s failed: %s", commands, exc)
+                future.set_exception(exc)
+
+
+class HDMIMatrixQueue(HDMIMatrixBase):
+    """
+    Share one matrix between threads through a single-writer command queue
+
+    The queue has the same getters and setters as the matrix, but they return
+    a concurrent.futures.Future instead of blocking. A dedicated worker thread
+    sends the commands one job at a time, control commands (SET, REBOOT, ...)
+    ahead of reads unless a priority is given with withPriority().
+
+    Usage:
+        with av.commandQueue() as avQueue:
+            mapping = avQueue.getMapping(1)
+            avQueue.mapOutput(2, 3).result()
+            print(mapping.result())
+    """
+
+    def __init__(
+        self,
+        matrix: "HDMIMatrixSerial",
+        priority: Optional[int] = None,
+        worker: Optional[_CommandWorker] = None,
+    ) -> None:
+        """
+        @param matrix: Matrix the commands are sent to
+        @param priority: Priority of every command, None to pick by command type
+        @param worker: Worker thread to share with another queue
+        """
+        self._matrix = matrix
+        self._priority = priority
+        self._worker = worker if worker is not None else _CommandWorker(matrix)
+
+        # Share the device config so arguments are checked before queueing
+        self.registry = matrix.registry
+        self._setupDevice(matrix.model, matrix.apiVersion)
+
+    @property
+    def roundTrips(self) -> int:
+        return self._matrix.roundTrips
+
+    def withPriority(self, priority: int) -> "HDMIMatrixQueue":
+        """
+        @param priority: Priority for commands sent through the returned queue
+        @return: Queue sharing this queue's worker thread
+        """
+        return HDMIMatrixQueue(self._matrix, priority, self._worker)
+
+    def _Run(self, command: AVAccessCommand) -> Future:
+        """
+        Queue a command
+        @param command: Command to send
+        @return: Future for the parsed response from the device
+        """
+        return self._RunBatch([command], lambda results: results[0])
+
+    def _RunBatch(
+        self,
+        commands: List[AVAccessCommand],
+        combine: Optional[Callable[[List[Any]], Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Future:
+        """
+        Queue several commands to send in one write
+        @param timeout: Seconds the commands may take once the worker sends them
+        @return: Future for the parsed responses, or the combined result
+        """
+        priority = self._priority
+        if priority is None:
+            priority = defaultPriority(commands)
+        return self._worker.submit(priority, commands, combine, timeout)
+
+    def close(self) -> None:
+        """
+        Send everything still queued and stop the worker thread
+        """
+        self._worker.stop()
+
+    def __enter__(self) -> "HDMIMatrixQueue":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
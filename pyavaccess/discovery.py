@@ -0,0 +1,198 @@
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import serial
+from serial.tools import list_ports
+
+from .fleet import MAX_CONCURRENCY
+from .hdmi_matrix import HDMIMatrixSerial
+from .identity_cache import DeviceIdentityCache
+from .profiles import DEVICE_PROFILES, ProfileRegistry
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds a port has to answer a probe, a matrix replies within milliseconds
+PROBE_TIMEOUT = 0.5
+
+# Last part of an IPv4 address given as a range, ex: socket://10.0.0.20-29:4001
+PATTERN_HOST_RANGE = re.compile(r"^(\w+://(?:\d+\.){3})(\d+)-(\d+)(.*)$")
+PATTERN_API_VERSION = re.compile(r"VER \d+(?:\.\d+)*")
+
+
+def expandUrls(urls: Iterable[str]) -> List[str]:
+    """
+    @param urls: Port urls, the host of network urls may end in a range
+    @return: Every url, with ranges expanded to one url per address
+    """
+    expanded = []
+    for url in urls:
+        match = PATTERN_HOST_RANGE.match(url)
+        if match is None:
+            expanded.append(url)
+            continue
+        prefix, first, last, suffix = match.groups()
+        expanded.extend(
+            "{}{}{}".format(prefix, host, suffix)
+            for host in range(int(first), int(last) + 1)
+        )
+    return expanded
+
+
+def candidatePorts(
+    urls: Optional[Iterable[str]] = None, serialPorts: bool = True
+) -> List[str]:
+    """
+    @param urls: Extra port urls to try, see expandUrls()
+    @param serialPorts: Include the serial ports found on this host
+    @return: Urls of every port that may have a matrix behind it
+    """
+    candidates = []
+    if serialPorts:
+        candidates.extend(port.device for port in list_ports.comports())
+    candidates.extend(expandUrls(urls or []))
+    # Keep the first of any duplicates
+    return list(dict.fromkeys(candidates))
+
+
+def _readLines(port: Any, count: int, deadline: float) -> List[str]:
+    """
+    @param count: Lines to read
+    @param deadline: time.monotonic() value to give up by
+    @return: Lines read before the deadline, at most count
+    """
+    buffer = b""
+    lines: List[str] = []
+    while len(lines) < count:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        port.timeout = remaining
+        buffer += port.read(port.in_waiting or 1)
+        parts = re.split(rb"[\r\n]+", buffer)
+        # The last part has no line ending yet
+        buffer = parts.pop()
+        lines.extend(part.decode("ascii", "replace") for part in parts if part)
+    return lines[:count]
+
+
+def probe(
+    url: str,
+    timeout: float = PROBE_TIMEOUT,
+    registry: ProfileRegistry = DEVICE_PROFILES,
+) -> Optional[Tuple[str, str]]:
+    """
+    Ask a port for its API version and find the model it belongs to
+    When several models share the version, the "help" listing decides
+    @param url: Port url
+    @param timeout: Seconds each request may take
+    @param registry: Device profiles to match the replies against
+    @return: (model, apiVersion) of the matrix on the port, None if there is no
+        matrix or it could not be identified
+    """
+    try:
+        port = serial.serial_for_url(url, do_not_open=True)
+        port.baudrate = 115200
+        port.timeout = timeout
+        port.write_timeout = timeout
+        port.open()
+    except (serial.SerialException, OSError, ValueError) as exc:
+        _LOGGER.debug("Could not open %s: %s", url, exc)
+        return None
+
+    try:
+        port.reset_input_buffer()
+        port.write(b"GET VER\r\n")
+        lines = _readLines(port, 1, time.monotonic() + timeout)
+        match = PATTERN_API_VERSION.match(lines[0]) if lines else None
+        if match is None:
+            _LOGGER.debug("No matrix on %s, replied %s", url, lines)
+            return None
+        apiVersion = match.group(0)
+        try:
+            models = registry.models(apiVersion)
+        except ValueError:
+            models = []
+        if len(models) == 1:
+            return models[0], apiVersion
+        if not models:
+            _LOGGER.debug("No device profile for %s on %s", apiVersion, url)
+            return None
+
+        # A shorter listing is only complete once the timeout passes
+        profiles = [registry.find(model, apiVersion) for model in models]
+        port.write(b"help\r\n")
+        helpLines = _readLines(
+            port,
+            max(len(profile.commands) for profile in profiles),
+            time.monotonic() + timeout,
+        )
+        matching = [
+            profile.model for profile in profiles if helpLines == list(profile.commands)
+        ]
+        if len(matching) == 1:
+            return matching[0], apiVersion
+        _LOGGER.warning(
+            "Could not tell which of %s is on %s, pass the model instead", models, url
+        )
+        return None
+    except (serial.SerialException, OSError) as exc:
+        _LOGGER.debug("Probing %s failed: %s", url, exc)
+        return None
+    finally:
+        port.close()
+
+
+def discoverMatrices(
+    urls: Optional[Iterable[str]] = None,
+    serialPorts: bool = True,
+    timeout: float = PROBE_TIMEOUT,
+    maxConcurrency: int = MAX_CONCURRENCY,
+    identityCache: Optional[DeviceIdentityCache] = None,
+    registry: ProfileRegistry = DEVICE_PROFILES,
+    **options: Any,
+) -> Dict[str, HDMIMatrixSerial]:
+    """
+    Find the matrices on this host's serial ports and the given urls
+    Every port is probed at the same time, so discovery takes about as long
+    as the slowest probe instead of the sum of all of them
+    @param urls: Extra port urls to try, ex: "socket://10.0.0.20-29:4001"
+    @param serialPorts: Include the serial ports found on this host
+    @param timeout: Seconds each port has to answer
+    @param maxConcurrency: Maximum number of ports probed at once
+    @param identityCache: Remembers the found API versions for later startups
+    @param registry: Device profiles to identify and configure the matrices with
+    @param options: Passed on to HDMIMatrixSerial, ex: cacheTTL
+    @return: Ready to use matrices, without another GET VER, keyed by url
+    """
+    candidates = candidatePorts(urls, serialPorts)
+    if not candidates:
+        return {}
+    _LOGGER.debug("Probing %s ports...", len(candidates))
+    workers = min(maxConcurrency, len(candidates))
+    with ThreadPoolExecutor(workers, thread_name_prefix="pyavaccess-probe") as pool:
+        identities = list(
+            pool.map(lambda url: probe(url, timeout, registry), candidates)
+        )
+
+    matrices = {}
+    for url, identity in zip(candidates, identities):
+        if identity is None:
+            continue
+        model, apiVersion = identity
+        _LOGGER.debug("Found %s %s on %s", model, apiVersion, url)
+        if identityCache is not None:
+            identityCache.set(url, model, apiVersion)
+        # The port opens on first use, the probe already confirmed the version
+        matrices[url] = HDMIMatrixSerial(
+            url,
+            model,
+            lazy=True,
+            identityCache=identityCache,
+            registry=registry,
+            apiVersion=apiVersion,
+            **options,
+        )
+    return matrices
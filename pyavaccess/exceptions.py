@@ -0,0 +1,49 @@
+import serial
+
+
+class AVAccessError(Exception):
+    """
+    Base class for errors raised by pyavaccess
+    """
+
+
+class DeviceErrorReply(AVAccessError):
+    """
+    The device answered a command with an error instead of a reply
+    """
+
+    def __init__(self, command: str, reply: str) -> None:
+        """
+        @param command: Command that was rejected
+        @param reply: Error line sent by the device
+        """
+        super().__init__('Device rejected "{}": {}'.format(command, reply))
+        self.command = command
+        self.reply = reply
+
+
+class ConnectionLost(AVAccessError, serial.SerialException):
+    """
+    The connection to the device dropped and could not be reopened
+    """
+
+
+class CommandTimeout(AVAccessError, serial.SerialTimeoutException):
+    """
+    The device did not finish replying to a command before its deadline
+    Usually means the command was invalid, the device ignores those
+    """
+
+    def __init__(self, message: str, received: bytes = b"") -> None:
+        """
+        @param message: Description of what timed out
+        @param received: Bytes of the unfinished reply, empty if nothing arrived
+        """
+        super().__init__(message)
+        self.received = received
+
+
+class DeadlineExceeded(CommandTimeout):
+    """
+    A batch did not finish before the deadline set by the caller
+    """
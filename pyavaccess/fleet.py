@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional
+
+from .async_hdmi_matrix import AsyncHDMIMatrix
+from .hdmi_matrix import HDMIMatrixSerial
+
+_LOGGER = logging.getLogger(__name__)
+
+# Default number of devices talked to at once
+MAX_CONCURRENCY = 32
+
+
+@dataclass(frozen=True)
+class FleetResult:
+    """
+    Per-device outcome of an operation run across a fleet
+    """
+
+    __slots__ = ("results", "errors", "elapsed")
+
+    # Return value for each device that succeeded {name: result}
+    results: Dict[Hashable, Any]
+    # Exception for each device that failed {name: exception}
+    errors: Dict[Hashable, BaseException]
+    # Seconds spent on the whole operation
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        """
+        @return: True if every device succeeded
+        """
+        return not self.errors
+
+
+class MatrixFleet:
+    """
+    Run the same operation on many matrices in parallel
+
+    Each matrix still handles one command at a time, but devices are driven
+    from a thread pool so a fleet-wide operation takes about as long as the
+    slowest device instead of the sum of all of them.
+
+    Usage:
+        fleet = MatrixFleet({"lobby": av1, "bar": av2})
+        result = fleet.mapAllOutputs(3)
+        for name, exc in result.errors.items():
+            print("{} failed: {}".format(name, exc))
+    """
+
+    def __init__(
+        self,
+        matrices: Optional[Mapping[Hashable, HDMIMatrixSerial]] = None,
+        maxConcurrency: int = MAX_CONCURRENCY,
+    ) -> None:
+        """
+        @param matrices: Matrices keyed by a name of your choice
+        @param maxConcurrency: Maximum number of devices talked to at once
+        """
+        self.matrices: Dict[Hashable, HDMIMatrixSerial] = dict(matrices or {})
+        self.maxConcurrency = maxConcurrency
+
+    def add(self, name: Hashable, matrix: HDMIMatrixSerial) -> None:
+        """
+        @param name: Name to report the matrix's results under
+        @param matrix: Matrix to add to the fleet
+        """
+        self.matrices[name] = matrix
+
+    def remove(self, name: Hashable) -> HDMIMatrixSerial:
+        """
+        @param name: Name of the matrix
+        @return: The matrix removed from the fleet
+        """
+        return self.matrices.pop(name)
+
+    def run(self, operation: Callable[[HDMIMatrixSerial], Any]) -> FleetResult:
+        """
+        Call operation with every matrix in parallel
+        @param operation: Function taking a matrix, ex: lambda av: av.getMappings()
+        @return: Result or exception for every device
+        """
+        started = time.perf_counter()
+        results: Dict[Hashable, Any] = {}
+        errors: Dict[Hashable, BaseException] = {}
+        if self.matrices:
+            workers = min(self.maxConcurrency, len(self.matrices))
+            with ThreadPoolExecutor(
+                workers, thread_name_prefix="pyavaccess-fleet"
+            ) as pool:
+                futures = {
+                    name: pool.submit(operation, matrix)
+                    for name, matrix in self.matrices.items()
+                }
+                for name, future in futures.items():
+                    exc = future.exception()
+                    if exc is None:
+                        results[name] = future.result()
+                    else:
+                        _LOGGER.debug("Fleet operation failed on %s: %s", name, exc)
+                        errors[name] = exc
+        return FleetResult(results, errors, time.perf_counter() - started)
+
+    """ Fleet Operations """
+
+    def getMappings(self) -> FleetResult:
+        """
+        @return: Mapping of all outputs for every device
+        """
+        return self.run(lambda matrix: matrix.getMappings())
+
+    def snapshot(self) -> FleetResult:
+        """
+        @return: MatrixSnapshot for every device
+        """
+        return self.run(lambda matrix: matrix.snapshot())
+
+    def mapOutput(self, outNum: int, inNum: int) -> FleetResult:
+        """
+        Map an input to an output on every device
+        @param outNum: output number
+        @param inNum: input number
+        @return: New mapping of the output for every device
+        """
+        return self.run(lambda matrix: matrix.mapOutput(outNum, inNum))
+
+    def mapAllOutputs(self, inNum: int) -> FleetResult:
+        """
+        Map an input to all outputs on every device
+        @param inNum: input number
+        @return: New mapping of all outputs for every device
+        """
+        return self.run(lambda matrix: matrix.mapAllOutputs(inNum))
+
+
+class AsyncMatrixFleet:
+    """
+    Run the same operation on many asyncio matrices concurrently
+
+    Usage:
+        fleet = AsyncMatrixFleet({"lobby": av1, "bar": av2})
+        result = await fleet.mapAllOutputs(3)
+    """
+
+    def __init__(
+        self,
+        matrices: Optional[Mapping[Hashable, AsyncHDMIMatrix]] = None,
+        maxConcurrency: int = MAX_CONCURRENCY,
+    ) -> None:
+        """
+        @param matrices: Matrices keyed by a name of your choice
+        @param maxConcurrency: Maximum number of devices talked to at once
+        """
+        self.matrices: Dict[Hashable, AsyncHDMIMatrix] = dict(matrices or {})
+        self.maxConcurrency = maxConcurrency
+
+    def add(self, name: Hashable, matrix: AsyncHDMIMatrix) -> None:
+        """
+        @param name: Name to report the matrix's results under
+        @param matrix: Matrix to add to the fleet
+        """
+        self.matrices[name] = matrix
+
+    def remove(self, name: Hashable) -> AsyncHDMIMatrix:
+        """
+        @param name: Name of the matrix
+        @return: The matrix removed from the fleet
+        """
+        return self.matrices.pop(name)
+
+    async def run(
+        self, operation: Callable[[AsyncHDMIMatrix], Awaitable[Any]]
+    ) -> FleetResult:
+        """
+        Await operation with every matrix concurrently
+        @param operation: Function taking a matrix, ex: lambda av: av.getMappings()
+        @return: Result or exception for every device
+        """
+        started = time.perf_counter()
+        limit = asyncio.Semaphore(self.maxConcurrency)
+
+        async def runOne(matrix: AsyncHDMIMatrix) -> Any:
+            async with limit:
+                return await operation(matrix)
+
+        names = list(self.matrices)
+        outcomes = await asyncio.gather(
+            *(runOne(self.matrices[name]) for name in names), return_exceptions=True
+        )
+
+        results: Dict[Hashable, Any] = {}
+        errors: Dict[Hashable, BaseException] = {}
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, BaseException):
+                _LOGGER.debug("Fleet operation failed on %s: %s", name, outcome)
+                errors[name] = outcome
+            else:
+                results[name] = outcome
+        return FleetResult(results, errors, time.perf_counter() - started)
+
+    """ Fleet Operations """
+
+    async def getMappings(self) -> FleetResult:
+        """
+        @return: Mapping of all outputs for every device
+        """
+        return await self.run(lambda matrix: matrix.getMappings())
+
+    async def snapshot(self) -> FleetResult:
+        """
+        @return: MatrixSnapshot for every device
+        """
+        return await self.run(lambda matrix: matrix.snapshot())
+
+    async def mapOutput(self, outNum: int, inNum: int) -> FleetResult:
+        """
+        Map an input to an output on every device
+        @param outNum: output number
+        @param inNum: input number
+        @return: New mapping of the output for every device
+        """
+        return await self.run(lambda matrix: matrix.mapOutput(outNum, inNum))
+
+    async def mapAllOutputs(self, inNum: int) -> FleetResult:
+        """
+        Map an input to all outputs on every device
+        @param inNum: input number
+        @return: New mapping of all outputs for every device
+        """
+        return await self.run(lambda matrix: matrix.mapAllOutputs(inNum))
@@ -1,60 +1,155 @@
 import logging
+import threading
+import time
 from re import Pattern
-
-from .avaccess_serial import AVAccessSerial
-from .config.matrix_devices import MatrixDevices, PATTERN_ALL, PATTERN_OUT
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+)
+
+from .avaccess_serial import RECONNECT_ATTEMPTS, RETRY_ATTEMPTS, AVAccessSerial
+from .command import AVAccessCommand
+from .config.matrix_devices import PATTERN_ALL
+from .exceptions import CommandTimeout, DeviceErrorReply
+from .identity_cache import DeviceIdentityCache
+from .metrics import Instrumentation
+from .preset import MatrixPreset, PresetResult, planRouting
+from .profiles import DEVICE_PROFILES, DeviceProfile, ProfileRegistry
+from .reply_parser import parseRoutingInputs, parseValue, parseValues
+from .routing import RoutingTable
+from .settings import APPLIED, FAILED, UNCHANGED, MatrixSettings, SettingsReport
+from .snapshot import MatrixSnapshot
+from .state import MISSING, MatrixState
+
+if TYPE_CHECKING:
+    from .batch import HDMIMatrixBatch
+    from .coalesce import HDMIMatrixCoalescer
+    from .command_queue import HDMIMatrixQueue
+    from .listener import MatrixListener
+    from .poller import MatrixPoller
 
 # Config
 _LOGGER = logging.getLogger(__name__)
 
+# Attributes only known once the device config is loaded
+_CONFIG_ATTRIBUTES = frozenset(
+    (
+        "apiVersion",
+        "inputs",
+        "outputs",
+        "audioOutputs",
+        "prmEDIDCount",
+        "maxDelay",
+        "irModeCount",
+        "commandCount",
+        "profile",
+    )
+)
+
+
+def _recordValues(verb: str) -> Callable[[MatrixState, dict], None]:
+    """
+    @param verb: Reply verb the values were read from (ex: "EDID")
+    @return: Function caching each {target: value} under (verb, target)
+    """
+
+    def record(state: MatrixState, values: dict) -> None:
+        for target, value in values.items():
+            state.set((verb, target), value)
+
+    return record
+
 
-class HDMIMatrixSerial(AVAccessSerial):
+def _recordValue(verb: str, target: Any) -> Callable[[MatrixState, Any], None]:
     """
-    General class for AV Access HDMI Matrix devices
+    @param verb: Reply verb the value was read from (ex: "MUTE")
+    @param target: Target the value belongs to (ex: "audioout1")
+    @return: Function caching the value under (verb, target)
     """
+    return lambda state, value: state.set((verb, target), value)
 
-    def __init__(self, url: str, device: str) -> None:
-        """
-        Initialize the AVAccess device for connecting over serial
-        """
-        _LOGGER.debug("Creating HDMI Matrix %s...")
-        super().__init__(url)
 
-        # Begin device setup
-        self.model = device
-        self.apiVersion = self.getVer()
+# Cache the input mapped to each output {out: in}
+_recordMappings = _recordValues("MP")
+
+
+# Cached state key verb of each settings field, see MatrixState
+_SETTING_STATE_VERBS = {
+    "edid": "EDID",
+    "autoCEC": "AUTOCEC_FN",
+    "cecDelay": "AUTOCEC_D",
+    "mute": "MUTE",
+}
+
+
+def _forgetState(state: MatrixState, deviceOutput: str) -> None:
+    """
+    Drop all cached state, ex: after the device reboots
+    """
+    state.invalidate()
+
+
+class HDMIMatrixBase:
+    """
+    Commands and parsing shared by every AV Access HDMI Matrix client
+
+    Each command method validates its arguments, builds an AVAccessCommand and
+    hands it to _Run. The transport decides what _Run returns: the parsed reply
+    for blocking clients, or an awaitable of it for asyncio clients.
+    """
 
-        # Get the device config from the yaml file
-        deviceConfig = self._getDeviceConfig(device, self.apiVersion)
-        self.inputs = deviceConfig["inputCount"]
-        self.outputs = deviceConfig["outputCount"]
-        self.audioOutputs = deviceConfig["audioOutputs"]
-        self.prmEDIDCount = deviceConfig["EDIDParamCount"]
-        self.maxDelay = deviceConfig["maxDelayInMin"]
-        self.irModeCount = deviceConfig["irModeCount"]
-        self.commandCount = deviceConfig["commandCount"]
+    # Cached device state, None when caching is off
+    state: Optional[MatrixState] = None
+    # Error line of the device profile, see DeviceProfile.errorReplyPattern
+    errorReplyPattern: Optional[Pattern[bytes]] = None
+    # Device profiles the device config is loaded from
+    registry: ProfileRegistry = DEVICE_PROFILES
 
+    def _Run(self, command: AVAccessCommand) -> Any:
+        """
+        Send a command to the device and parse its response
+        @param command: Command to send
+        @return: Parsed response from the device
+        """
+        raise NotImplementedError
 
-    def _getDeviceConfig(self, device: str, apiVersion: str) -> dict:
+    def _setupDevice(self, device: str, apiVersion: str) -> None:
         """
+        Load the device config for the detected API version
         @param device: Device name
-        @param apiVersion APi version string in format "VER #.#.#"
-        @return: Configuration for the device
+        @param apiVersion: API version string in format "VER #.#.#"
+        """
+        self.model = device
+        self.apiVersion = apiVersion
+
+        # Get the device profile from the registry
+        self.profile = self._getDeviceProfile(device, apiVersion)
+        self.inputs = self.profile.inputCount
+        self.outputs = self.profile.outputCount
+        self.audioOutputs = self.profile.audioOutputs
+        self.prmEDIDCount = self.profile.EDIDParamCount
+        self.maxDelay = self.profile.maxDelayInMin
+        self.irModeCount = self.profile.irModeCount
+        self.commandCount = self.profile.commandCount
+        self.errorReplyPattern = self.profile.errorReplyPattern
+
+    def _getDeviceProfile(self, device: str, apiVersion: str) -> DeviceProfile:
+        """
+        @param device: Device name, any case
+        @param apiVersion: API version string in format "VER #.#.#"
+        @return: Profile describing the device
         """
-        _LOGGER.debug("Finding config for %s version %s...", device, apiVersion)
+        _LOGGER.debug("Finding profile for %s version %s...", device, apiVersion)
         # Don't send anything to the device if we don't know what version we're using
-        if apiVersion not in MatrixDevices:
-            raise ValueError("Device version %s does not exist in the config!", apiVersion)
-
-        # User device input case insensitive
-        absDevice = device.upper()
-
-        # If the device is not in the config, raise an error
-        if absDevice not in MatrixDevices[apiVersion]:
-            raise ValueError("Device %s does not exist in the config!", device)
-
-        # Only return the config for the device
-        return MatrixDevices[apiVersion][absDevice]
+        return self.registry.find(device, apiVersion)
 
     """ Function Helper Methods """
 
@@ -131,6 +226,7 @@ class HDMIMatrixSerial(AVAccessSerial):
     def mapWithPattern(self, mapping: str, pattern: Pattern[str]) -> dict:
         """
         Create a dictionary for all values
+        Getters parse their replies with reply_parser instead, this is kept for callers
         @param mapping: mapping string (ex: "MP in1 all")
         @param pattern: number of outputs for the dict
         @return: dictionary mapping all outputs to an input  {out: in, out: in, ...}
@@ -152,7 +248,7 @@ class HDMIMatrixSerial(AVAccessSerial):
 
             # If the pattern is for all, create the dict in one shot
             if pattern == PATTERN_ALL:
-                outputKV = {str(i): input_value for i in range(1, self.outputs + 1)}
+                outputKV = {i: input_value for i in range(1, self.outputs + 1)}
                 break
 
             # If the pattern is for a single output, add the output to the dict and keep going
@@ -161,6 +257,111 @@ class HDMIMatrixSerial(AVAccessSerial):
 
         return outputKV
 
+    def _parseRouting(self, deviceOutput: str, verb: str = "MP") -> RoutingTable:
+        """
+        @param deviceOutput: Routing reply (ex: "MP in1 out1\r\nMP in3 out2")
+        @param verb: Reply verb, "MP" for reads or "SW" for switches
+        @return: Input mapped to each output in the reply
+        """
+        outputs = self.outputs
+        inputs = self.inputs
+        # Parsed once per distinct reply, each call gets its own table
+        mapped = parseRoutingInputs(deviceOutput, verb, outputs, inputs)
+        return RoutingTable._fromInputs(outputs, inputs, mapped)
+
+    """ State Cache Methods """
+
+    def enableCache(self, ttl: float) -> None:
+        """
+        Serve reads of routing, mute, CEC and EDID state from memory
+        Set commands and full reads write their replies through to the cache
+        @param ttl: Seconds a value is served from memory before reading it again
+        """
+        _LOGGER.debug("Enabling state cache with a ttl of %ss...", ttl)
+        self.state = MatrixState(ttl)
+
+    def disableCache(self) -> None:
+        """
+        Always read state from the device
+        """
+        self.state = None
+
+    def invalidateCache(self) -> None:
+        """
+        Forget all cached state so the next reads go to the device
+        """
+        if self.state is not None:
+            self.state.invalidate()
+
+    def _cachedValues(self, state: MatrixState, verb: str, targets: Iterable) -> Any:
+        """
+        @return: Cached value of every target {target: value}, or MISSING if unknown
+        """
+        targets = list(targets)
+        values = state.getMany((verb, target) for target in targets)
+        if values is MISSING:
+            return MISSING
+        return dict(zip(targets, values))
+
+    def _cachedMappings(self, state: MatrixState) -> Any:
+        """
+        @return: Cached mapping of all outputs, or MISSING if any are unknown
+        """
+        outNums = range(1, self.outputs + 1)
+        inNums = state.getMany(("MP", outNum) for outNum in outNums)
+        if inNums is MISSING:
+            return MISSING
+        return RoutingTable(self.outputs, self.inputs, dict(zip(outNums, inNums)))
+
+    """ Batch Methods """
+
+    def batch(
+        self, timeout: Optional[float] = None, bypassCache: bool = False
+    ) -> "HDMIMatrixBatch":
+        """
+        Queue several commands to send in a single write
+        @param timeout: Seconds the whole batch may take, None for no overall deadline
+        @param bypassCache: Send reads to the device even if their values are cached
+        @return: Batch with the same getters and setters as this matrix
+        """
+        from .batch import HDMIMatrixBatch
+
+        return HDMIMatrixBatch(self, timeout, bypassCache)
+
+    def snapshot(self, timeout: Optional[float] = None) -> MatrixSnapshot:
+        """
+        Read the full device state in a single batch
+        Routing, mute and EDID use the "all" commands, CEC settings are read per output
+        @param timeout: Seconds the whole snapshot may take, None for no deadline
+        @return: Typed snapshot of the device state
+        """
+        _LOGGER.debug("Taking snapshot of device state...")
+        batch = self.batch(timeout)
+        batch.getMappings()
+        batch.getAllMuteStatus()
+        batch.getAllInputEDIDStatus()
+        outNums = range(1, self.outputs + 1)
+        for outNum in outNums:
+            batch.getAutoCECStatus(outNum)
+        for outNum in outNums:
+            batch.getCECDelay(outNum)
+
+        started = time.perf_counter()
+        startRoundTrips = self.roundTrips
+
+        def combine(results: list) -> MatrixSnapshot:
+            return MatrixSnapshot(
+                routing=results[0].snapshot(),
+                mute=results[1],
+                edid=results[2],
+                autoCEC=dict(zip(outNums, results[3 : 3 + self.outputs])),
+                cecDelay=dict(zip(outNums, results[3 + self.outputs :])),
+                elapsed=time.perf_counter() - started,
+                roundTrips=self.roundTrips - startRoundTrips,
+            )
+
+        return batch.execute(combine)
+
     """ System Methods """
 
     def factoryReset(self) -> str:
@@ -168,22 +369,22 @@ class HDMIMatrixSerial(AVAccessSerial):
         Reset the device to factory settings
         @return: Device output
         """
-        cmdStr = "RESET"
+        cmdStr, encoded = self.profile.command("RESET")
         _LOGGER.debug("Resetting device to factory settings...")
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(cmdStr, encoded=encoded, writeState=_forgetState)
+        )
 
     def reboot(self) -> str:
         """
         Reboot the device
         @return: Device output
         """
-        cmdStr = "REBOOT"
+        cmdStr, encoded = self.profile.command("REBOOT")
         _LOGGER.debug("Rebooting device...")
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(cmdStr, encoded=encoded, writeState=_forgetState)
+        )
 
     def getVer(self) -> str:
         """
@@ -191,30 +392,32 @@ class HDMIMatrixSerial(AVAccessSerial):
         """
         cmdStr = "GET VER"
         _LOGGER.debug("Getting firmware version...")
-        deviceOutput = self._SendData(cmdStr, True)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(AVAccessCommand(cmdStr, useDeviceEOL=True))
 
-    def getIR_SC(self) -> str:
+    def getIR_SC(self) -> int:
         """
-        @return: Current IR system code
+        @return: Current IR system code mode
         """
-        cmdStr = "GET IR_SC"
+        cmdStr, encoded = self.profile.command("GET IR_SC")
         _LOGGER.debug("Getting IR system code...")
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr, encoded=encoded, parser=lambda out: parseValue(out, "IR_SC")
+            )
+        )
 
     def getAPI(self) -> str:
         """
         Debug method for quickly getting all commands available over rs232
         @return: Device API list
         """
-        cmdStr = "help"
+        cmdStr, encoded = self.profile.command("help")
         _LOGGER.debug("Getting available commands...")
-        deviceOutput = self._SendData(cmdStr, lineCount=self.commandCount)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr, encoded=encoded, lineCount=self.profile.replyLines(cmdStr)
+            )
+        )
 
     """ Status Methods """
 
@@ -225,120 +428,176 @@ class HDMIMatrixSerial(AVAccessSerial):
         """
         self.isOutNumInBounds(outNum)
 
-        cmdStr = "GET MP out{}".format(outNum)
+        cmdStr, encoded = self.profile.command("GET MP outY", outNum)
         _LOGGER.debug("Getting mapping for output %s...", outNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        # Get dict w/ input number mapped to the output {out: in}
-        outputMap = self.mapWithPattern(deviceOutput, PATTERN_OUT)
-        # Only return the input number
-        return outputMap[outNum]
+        # Only return the input number from the dict {out: in}
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "MP", outNum),
+                readState=lambda state: state.get(("MP", outNum)),
+                writeState=lambda state, inNum: state.set(("MP", outNum), inNum),
+            )
+        )
 
-    def getMappings(self) -> dict:
+    def getMappings(self) -> RoutingTable:
         """
-        @return: Dictionary of current input mapping to all outputs {out: in, out: in, ...}
+        @return: Current input mapped to every output, reads like {out: in, ...}
         """
-        cmdStr = "GET MP all"
+        cmdStr, encoded = self.profile.command("GET MP all")
         _LOGGER.debug("Getting mappings for all outputs...")
-        deviceOutput = self._SendData(cmdStr, lineCount=self.outputs)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return self.mapWithPattern(deviceOutput, PATTERN_OUT)
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                lineCount=self.profile.replyLines(cmdStr),
+                parser=self._parseRouting,
+                readState=self._cachedMappings,
+                writeState=_recordMappings,
+            )
+        )
 
-    def getAutoCECStatus(self, outNum: int) -> str:
+    def getAutoCECStatus(self, outNum: int) -> bool:
         """
         @param outNum: output number
-        @return: Current "CEC AUTO POWER ON/OFF Status" of the output
+        @return: True if "CEC AUTO POWER" is on for the output
         """
         self.isOutNumInBounds(outNum)
 
-        cmdStr = "GET AUTOCEC_FN out{}".format(outNum)
+        cmdStr, encoded = self.profile.command("GET AUTOCEC_FN outY", outNum)
         _LOGGER.debug("Getting Auto CEC status for output %s...", outNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "AUTOCEC_FN", outNum),
+                readState=lambda state: state.get(("AUTOCEC_FN", outNum)),
+                writeState=_recordValue("AUTOCEC_FN", outNum),
+            )
+        )
 
-    def getCECDelay(self, outNum: int) -> str:
+    def getCECDelay(self, outNum: int) -> int:
         """
         @param outNum: output number
-        @return: Current "CEC POWER Delay Time Status" of the output
+        @return: Current "CEC POWER Delay Time" of the output in minutes
         """
         self.isOutNumInBounds(outNum)
 
-        cmdStr = "GET AUTOCEC_D out{}".format(outNum)
+        cmdStr, encoded = self.profile.command("GET AUTOCEC_D outY", outNum)
         _LOGGER.debug("Getting CEC Delay for output %s...", outNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "AUTOCEC_D", outNum),
+                readState=lambda state: state.get(("AUTOCEC_D", outNum)),
+                writeState=_recordValue("AUTOCEC_D", outNum),
+            )
+        )
 
-    def getInputEDIDStatus(self, inNum: int) -> str:
+    def getInputEDIDStatus(self, inNum: int) -> int:
         """
         @param inNum: input number
-        @return: Current EDID Status of the input
+        @return: Current EDID param number of the input
         """
         self.isInputNumInBounds(inNum)
 
-        cmdStr = "GET EDID in{}".format(inNum)
+        cmdStr, encoded = self.profile.command("GET EDID inX", inNum)
         _LOGGER.debug("Getting EDID status for output %s...", inNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "EDID", inNum),
+                readState=lambda state: state.get(("EDID", inNum)),
+                writeState=_recordValue("EDID", inNum),
+            )
+        )
 
-    def getAllInputEDIDStatus(self) -> str:
+    def getAllInputEDIDStatus(self) -> Dict[int, int]:
         """
         Return the EDID of all inputs
-        @return: EDID status of all inputs
+        @return: EDID param number of all inputs {in: prm, in: prm, ...}
         """
-        cmdStr = "GET EDID all"
+        cmdStr, encoded = self.profile.command("GET EDID all")
         _LOGGER.debug("Getting EDID status for all inputs...")
-        deviceOutput = self._SendData(cmdStr, lineCount=self.inputs)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        inNums = range(1, self.inputs + 1)
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                lineCount=self.profile.replyLines(cmdStr),
+                parser=lambda out: parseValues(out, "EDID"),
+                readState=lambda state: self._cachedValues(state, "EDID", inNums),
+                writeState=_recordValues("EDID"),
+            )
+        )
 
-    def getMuteStatus(self, outString: str) -> str:
+    def getMuteStatus(self, outString: str) -> bool:
         """
         @param outString: string of the audio output device
-        @return: Mute status of the output
+        @return: True if the output is muted
         """
         self.isAudioOutStringOnDevice(outString)
 
-        cmdStr = "GET MUTE {}".format(outString)
+        cmdStr, encoded = self.profile.command("GET MUTE audioout", outString)
         _LOGGER.debug("Getting mute status for %s...", outString)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "MUTE", outString),
+                readState=lambda state: state.get(("MUTE", outString)),
+                writeState=_recordValue("MUTE", outString),
+            )
+        )
 
-    def getAllMuteStatus(self) -> str:
+    def getAllMuteStatus(self) -> Dict[str, bool]:
         """
-        @param outString: string of the audio output device or "all"
-        @return: SMute status of all outputs
+        @return: Mute status of all audio outputs {name: muted, name: muted, ...}
         """
-        cmdStr = "GET MUTE all"
+        cmdStr, encoded = self.profile.command("GET MUTE all")
         _LOGGER.debug(
             "Getting mute status for all audio outputs...",
         )
-        deviceOutput = self._SendData(cmdStr, lineCount=4)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                lineCount=self.profile.replyLines(cmdStr),
+                parser=lambda out: parseValues(out, "MUTE"),
+                readState=lambda state: self._cachedValues(
+                    state, "MUTE", self.audioOutputs
+                ),
+                writeState=_recordValues("MUTE"),
+            )
+        )
 
     """ Control Methods """
 
-    def mapOutput(self, outNum: int, inNum: int) -> dict:
+    def mapOutput(self, outNum: int, inNum: int) -> RoutingTable:
         """
         Map an input to an output
         @param outNum: output number
         @param inNum: input number
-        @return: Dict of current input mapped to the output {out: in}
+        @return: Current input mapped to the output, reads like {out: in}
         """
         self.isOutNumInBounds(outNum)
         self.isInputNumInBounds(inNum)
 
-        cmdStr = "SET SW in{} out{}".format(inNum, outNum)
+        cmdStr, encoded = self.profile.command("SET SW inX outY", inNum, outNum)
         _LOGGER.debug("Mapping input %s to output %s...", inNum, outNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return self.mapWithPattern(deviceOutput, PATTERN_OUT)
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: self._parseRouting(out, "SW"),
+                writeState=_recordMappings,
+            )
+        )
 
-    def mapAllOutputs(self, inNum: int) -> dict:
+    def mapAllOutputs(self, inNum: int) -> RoutingTable:
         """
         Map an inputs to all outputs
         @param inNum: input number
@@ -346,13 +605,18 @@ class HDMIMatrixSerial(AVAccessSerial):
         """
         self.isInputNumInBounds(inNum)
 
-        cmdStr = "SET SW in{} all".format(inNum)
+        cmdStr, encoded = self.profile.command("SET SW inX all", inNum)
         _LOGGER.debug("Mapping input %s to all outputs...", inNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return self.mapWithPattern(deviceOutput, PATTERN_ALL)
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: self._parseRouting(out, "SW"),
+                writeState=_recordMappings,
+            )
+        )
 
-    def setCECPower(self, outNum: int, state: bool) -> str:
+    def setCECPower(self, outNum: int, state: bool) -> bool:
         """
         Set the CEC power state of the output
         @param outNum: output number
@@ -361,18 +625,22 @@ class HDMIMatrixSerial(AVAccessSerial):
         """
         self.isOutNumInBounds(outNum)
 
-        # Get the text to use for the command based on state
+        # Get the text to log based on state
         stateText = "on" if state else "off"
 
-        cmdStr = "SET CEC_PWR out{} {}".format(outNum, stateText)
+        cmdStr, encoded = self.profile.command("SET CEC_PWR outY on/off", outNum, state)
         _LOGGER.debug(
             "Setting CEC power state for output %s to %s...", outNum, stateText
         )
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "CEC_PWR", outNum),
+            )
+        )
 
-    def setAutoCEC(self, outNum: int, state: bool) -> str:
+    def setAutoCEC(self, outNum: int, state: bool) -> bool:
         """
         Set the CEC auto power state of the output
         @param outNum: output number
@@ -381,18 +649,25 @@ class HDMIMatrixSerial(AVAccessSerial):
         """
         self.isOutNumInBounds(outNum)
 
-        # Get the text to use for the command based on state
+        # Get the text to log based on state
         stateText = "on" if state else "off"
 
-        cmdStr = "SET AUTOCEC_FN out{} {}".format(outNum, stateText)
+        cmdStr, encoded = self.profile.command(
+            "SET AUTOCEC_FN outY on/off", outNum, state
+        )
         _LOGGER.debug(
             "Setting CEC auto power state for output %s to %s...", outNum, stateText
         )
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "AUTOCEC_FN", outNum),
+                writeState=_recordValue("AUTOCEC_FN", outNum),
+            )
+        )
 
-    def setCECDelay(self, outNum: int, delay: int) -> str:
+    def setCECDelay(self, outNum: int, delay: int) -> int:
         """
         Set the CEC power delay time for the output
         @param outNum: output number
@@ -402,56 +677,570 @@ class HDMIMatrixSerial(AVAccessSerial):
         self.isOutNumInBounds(outNum)
         self.isDelayInBounds(delay)
 
-        cmdStr = "SET AUTOCEC_D out{} {}".format(outNum, delay)
+        cmdStr, encoded = self.profile.command("SET AUTOCEC_D outY min", outNum, delay)
         _LOGGER.debug("Setting CEC delay for output %s to %s...", outNum, delay)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "AUTOCEC_D", outNum),
+                writeState=_recordValue("AUTOCEC_D", outNum),
+            )
+        )
 
-    def setInputEDIDStatus(self, inNum: int, prmNum: int) -> str:
+    def setInputEDIDStatus(self, inNum: int, prmNum: int) -> int:
         """
         Set the EDID of the input
         @param inNum: input number
         @param prmNum: EDID param number (see API)
-        @return: Current EDID status of the input
+        @return: Current EDID param number of the input
         """
         self.isInputNumInBounds(inNum)
         self.isEDIDPrmNumInBounds(prmNum)
 
-        cmdStr = "SET EDID in{} {}".format(inNum, prmNum)
+        cmdStr, encoded = self.profile.command("SET EDID inX prm", inNum, prmNum)
         _LOGGER.debug("Setting EDID for input %s to %s...", inNum, prmNum)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "EDID", inNum),
+                writeState=_recordValue("EDID", inNum),
+            )
+        )
 
-    def setIR_SC(self, mode: int) -> str:
+    def setIR_SC(self, mode: int) -> int:
         """
         Set the IR system code
         @param mode: IR system code (see API)
-        @return: Current IR system code
+        @return: Current IR system code mode
         """
         self.isIRInBounds(mode)
 
-        cmdStr = "SET IR_SC mode{}".format(mode)
+        cmdStr, encoded = self.profile.command("SET IR_SC modeX", mode)
         _LOGGER.debug("Setting IR system code to mode %s...", mode)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr, encoded=encoded, parser=lambda out: parseValue(out, "IR_SC")
+            )
+        )
 
-    def setMuteStatus(self, outString: str, state: bool) -> str:
+    def setMuteStatus(self, outString: str, state: bool) -> bool:
         """
         Set the mute status of the output
         @param outString: string of the audio output device
         @param state: True = On, False = Off
-        @return: Current mute status of the output
+        @return: True if the output is now muted
         """
         self.isAudioOutStringOnDevice(outString)
 
-        # Get the text to use for the command based on state
+        # Get the text to log based on state
         stateText = "on" if state else "off"
 
-        cmdStr = "SET MUTE {} {}".format(outString, stateText)
+        cmdStr, encoded = self.profile.command(
+            "SET MUTE audioout on/off", outString, state
+        )
         _LOGGER.debug("Setting mute status for %s to %s...", outString, stateText)
-        deviceOutput = self._SendData(cmdStr)
-        _LOGGER.debug("Device output: %s", deviceOutput)
-        return deviceOutput
+        return self._Run(
+            AVAccessCommand(
+                cmdStr,
+                encoded=encoded,
+                parser=lambda out: parseValue(out, "MUTE", outString),
+                writeState=_recordValue("MUTE", outString),
+            )
+        )
+
+
+class HDMIMatrixApplyMixin:
+    """
+    Methods that take several round trips, ex: read, compare and write
+
+    Each one is written as a generator of steps that yields a batch and its
+    combine, and is sent the combined result back (or has the batch's error
+    thrown in). _runSteps() drives the steps, so blocking, asyncio and broker
+    clients share the same logic.
+    """
+
+    def _runSteps(self, steps: Generator[Tuple[Any, Any], Any, Any]) -> Any:
+        """
+        Execute each batch the steps yield, in order
+        @param steps: Generator yielding (batch, combine) for each round trip
+        @return: Value the steps return
+        """
+        result: Any = None
+        error: Optional[Exception] = None
+        while True:
+            try:
+                if error is None:
+                    batch, combine = steps.send(result)
+                else:
+                    batch, combine = steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            result = error = None
+            try:
+                result = batch.execute(combine)
+            except Exception as exc:
+                error = exc
+
+    def applyPreset(self, preset: MatrixPreset) -> PresetResult:
+        """
+        Bring the device to a preset with as few commands as possible
+        The current settings are read once (or taken from the state cache), only
+        the differences are sent in a single batch, and the set replies confirm
+        the result without reading the device again
+        @param preset: Routing, mute and CEC settings to apply
+        @return: Settings the device confirmed and the commands that were sent
+        """
+        return self._runSteps(self._presetSteps(preset))
+
+    def applySettings(self, settings: MatrixSettings) -> SettingsReport:
+        """
+        Configure the device from a settings document in three round trips
+        The current values are read once (or taken from the state cache), the
+        fields that differ are set in a single batch and read back from the
+        device with as few reads as possible to verify them
+        @param settings: EDID, CEC, mute and IR settings to apply
+        @return: Whether each field was applied, unchanged or failed
+        """
+        return self._runSteps(self._settingsSteps(settings))
+
+    """ Preset Methods """
+
+    def _presetReads(
+        self, preset: MatrixPreset
+    ) -> Tuple["HDMIMatrixBatch", Callable[[list], MatrixPreset]]:
+        """
+        Read the current value of everything a preset sets
+        Cached values are used when the state cache is on
+        @param preset: Preset about to be applied
+        @return: Batch of reads and the combine turning its results into the
+            current settings
+        """
+        batch = self.batch()
+        if preset.routing:
+            batch.getMappings()
+        if preset.mute:
+            batch.getAllMuteStatus()
+        for outNum in preset.autoCEC:
+            batch.getAutoCECStatus(outNum)
+        for outNum in preset.cecDelay:
+            batch.getCECDelay(outNum)
+
+        def combine(results: list) -> MatrixPreset:
+            values = iter(results)
+            return MatrixPreset(
+                routing=next(values) if preset.routing else {},
+                mute=next(values) if preset.mute else {},
+                autoCEC={outNum: next(values) for outNum in preset.autoCEC},
+                cecDelay={outNum: next(values) for outNum in preset.cecDelay},
+            )
+
+        return batch, combine
+
+    def _presetWrites(
+        self, preset: MatrixPreset, current: MatrixPreset, startRoundTrips: int
+    ) -> Tuple["HDMIMatrixBatch", Callable[[list], PresetResult]]:
+        """
+        Queue the fewest set commands that take the current settings to the preset
+        @param preset: Preset to apply
+        @param current: Current value of everything the preset sets
+        @param startRoundTrips: roundTrips before the current settings were read
+        @return: Batch of writes and the combine turning its replies into the
+            confirmed settings
+        """
+        batch = self.batch()
+        # Setting each reply confirms, in the order the commands are queued
+        targets: list = []
+
+        allInput, singles = planRouting(preset.routing, current.routing)
+        if allInput is not None:
+            batch.mapAllOutputs(allInput)
+            targets.append(("routing", None))
+        for outNum, inNum in singles.items():
+            batch.mapOutput(outNum, inNum)
+            targets.append(("routing", None))
+        for outString, state in preset.mute.items():
+            if current.mute.get(outString) != state:
+                batch.setMuteStatus(outString, state)
+                targets.append(("mute", outString))
+        for outNum, state in preset.autoCEC.items():
+            if current.autoCEC.get(outNum) != state:
+                batch.setAutoCEC(outNum, state)
+                targets.append(("autoCEC", outNum))
+        for outNum, delay in preset.cecDelay.items():
+            if current.cecDelay.get(outNum) != delay:
+                batch.setCECDelay(outNum, delay)
+                targets.append(("cecDelay", outNum))
+        commands = batch.commands
+
+        def combine(results: list) -> PresetResult:
+            confirmed = {
+                "routing": dict(current.routing),
+                "mute": dict(current.mute),
+                "autoCEC": dict(current.autoCEC),
+                "cecDelay": dict(current.cecDelay),
+            }
+            for (setting, target), value in zip(targets, results):
+                if setting == "routing":
+                    confirmed["routing"].update(value)
+                else:
+                    confirmed[setting][target] = value
+            applied = MatrixPreset(
+                **{
+                    setting: {
+                        target: confirmed[setting].get(target)
+                        for target in getattr(preset, setting)
+                    }
+                    for setting in confirmed
+                }
+            )
+            return PresetResult(
+                preset, applied, commands, self.roundTrips - startRoundTrips
+            )
+
+        return batch, combine
+
+    def _presetSteps(
+        self, preset: MatrixPreset
+    ) -> Generator[Tuple[Any, Any], Any, PresetResult]:
+        """
+        Steps of applyPreset(), see _runSteps()
+        """
+        _LOGGER.debug("Applying preset %s...", preset)
+        startRoundTrips = self.roundTrips
+        current = yield self._presetReads(preset)
+        writes, writeCombine = self._presetWrites(preset, current, startRoundTrips)
+        if not len(writes):
+            return writeCombine([])
+        return (yield writes, writeCombine)
+
+    """ Settings Methods """
+
+    def _settingsReads(
+        self, fields: Iterable[Tuple[str, Any]]
+    ) -> Tuple["HDMIMatrixBatch", Callable[[list], Dict[Tuple[str, Any], Any]]]:
+        """
+        Read the current value of settings fields with as few commands as possible
+        EDID and mute take one "all" read each, the CEC settings have no "all"
+        read and are read per output
+        @param fields: Fields to read, keyed like MatrixSettings.fields()
+        @return: Batch of reads and the combine turning its results into
+            {(setting, target): value}
+        """
+        fields = list(fields)
+        settings = {setting for setting, _ in fields}
+        batch = self.batch()
+        # What each queued read returns, (setting, None) for a whole setting
+        reads: List[Tuple[str, Any]] = []
+        if "edid" in settings:
+            batch.getAllInputEDIDStatus()
+            reads.append(("edid", None))
+        if "mute" in settings:
+            batch.getAllMuteStatus()
+            reads.append(("mute", None))
+        for setting, target in fields:
+            if setting == "autoCEC":
+                batch.getAutoCECStatus(target)
+                reads.append((setting, target))
+            elif setting == "cecDelay":
+                batch.getCECDelay(target)
+                reads.append((setting, target))
+        if "irMode" in settings:
+            batch.getIR_SC()
+            reads.append(("irMode", None))
+
+        def combine(results: list) -> Dict[Tuple[str, Any], Any]:
+            values = {}
+            for (setting, target), result in zip(reads, results):
+                if setting in ("edid", "mute"):
+                    for readTarget, value in result.items():
+                        values[(setting, readTarget)] = value
+                else:
+                    values[(setting, target)] = result
+            return values
+
+        return batch, combine
+
+    def _settingsWrites(
+        self, fields: Dict[Tuple[str, Any], Any], current: Dict[Tuple[str, Any], Any]
+    ) -> Tuple["HDMIMatrixBatch", List[Tuple[str, Any]]]:
+        """
+        Queue a set command for every field that differs from the device
+        @param fields: Wanted value of each field
+        @param current: Value of each field on the device
+        @return: Batch of writes and the fields it changes
+        """
+        batch = self.batch()
+        changed = []
+        for (setting, target), value in fields.items():
+            if current.get((setting, target)) == value:
+                continue
+            if setting == "edid":
+                batch.setInputEDIDStatus(target, value)
+            elif setting == "autoCEC":
+                batch.setAutoCEC(target, value)
+            elif setting == "cecDelay":
+                batch.setCECDelay(target, value)
+            elif setting == "mute":
+                batch.setMuteStatus(target, value)
+            else:
+                batch.setIR_SC(value)
+            changed.append((setting, target))
+        return batch, changed
+
+    def _forgetSettings(self, fields: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Drop cached values of settings fields so reading them asks the device
+        """
+        if self.state is None:
+            return
+        for setting, target in fields:
+            verb = _SETTING_STATE_VERBS.get(setting)
+            if verb is not None:
+                self.state.invalidate((verb, target))
+
+    def _settingsReport(
+        self,
+        settings: MatrixSettings,
+        changed: List[Tuple[str, Any]],
+        verified: Dict[Tuple[str, Any], Any],
+        commands: List[str],
+        startRoundTrips: int,
+    ) -> SettingsReport:
+        """
+        @param settings: Settings that were applied
+        @param changed: Fields set commands were sent for
+        @param verified: Value of each changed field read back from the device
+        @param commands: Commands that were sent
+        @param startRoundTrips: roundTrips before the current values were read
+        @return: Report of every field
+        """
+        statuses = {}
+        for key, value in settings.fields().items():
+            if key not in changed:
+                statuses[key] = UNCHANGED
+            elif verified.get(key) == value:
+                statuses[key] = APPLIED
+            else:
+                statuses[key] = FAILED
+        return SettingsReport(
+            settings, statuses, commands, self.roundTrips - startRoundTrips
+        )
+
+    def _settingsSteps(
+        self, settings: MatrixSettings
+    ) -> Generator[Tuple[Any, Any], Any, SettingsReport]:
+        """
+        Steps of applySettings(), see _runSteps()
+        """
+        _LOGGER.debug("Applying settings %s...", settings)
+        startRoundTrips = self.roundTrips
+        fields = settings.fields()
+        current = yield self._settingsReads(fields)
+        writes, changed = self._settingsWrites(fields, current)
+        commands = writes.commands
+        verified = {}
+        if changed:
+            try:
+                yield writes, None
+            except (DeviceErrorReply, CommandTimeout) as exc:
+                # Later commands in the batch may still have been applied, the
+                # transport is back in step with the device before raising
+                _LOGGER.warning("%s, reading back what was applied", exc)
+            self._forgetSettings(changed)
+            verified = yield self._settingsReads(changed)
+        return self._settingsReport(
+            settings, changed, verified, commands, startRoundTrips
+        )
+
+
+class HDMIMatrixSerial(AVAccessSerial, HDMIMatrixApplyMixin, HDMIMatrixBase):
+    """
+    General class for AV Access HDMI Matrix devices
+    """
+
+    def __init__(
+        self,
+        url: str,
+        device: str,
+        cacheTTL: Optional[float] = None,
+        lazy: bool = False,
+        identityCache: Optional[DeviceIdentityCache] = None,
+        verifyIdentity: bool = True,
+        instrumentation: Optional[Instrumentation] = None,
+        reconnectAttempts: int = RECONNECT_ATTEMPTS,
+        retryAttempts: int = RETRY_ATTEMPTS,
+        registry: ProfileRegistry = DEVICE_PROFILES,
+        apiVersion: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize the AVAccess device for connecting over serial
+        @param cacheTTL: Seconds to serve state from memory, None to always read the device
+        @param lazy: Don't open the port or ask for the API version until first use
+        @param identityCache: Known API versions, skips GET VER for cached devices
+        @param verifyIdentity: Confirm a cached API version in a background thread
+        @param instrumentation: Receives per-command timings and counts
+        @param reconnectAttempts: Times to reopen a dropped connection, 0 to raise
+        @param retryAttempts: Times to resend commands whose reply was cut short
+            when they are safe to send again, 0 to raise
+        @param registry: Device profiles to load the device config from
+        @param apiVersion: API version the device already reported (ex: to
+            probe()), skips GET VER and the identity cache
+        """
+        _LOGGER.debug("Creating HDMI Matrix %s...", device)
+        super().__init__(url, lazy, instrumentation, reconnectAttempts, retryAttempts)
+
+        # Background poller, if one is running
+        self._poller = None
+
+        # Begin device setup
+        self.url = url
+        self.model = device
+        self.identityCache = identityCache
+        self.registry = registry
+
+        if apiVersion is not None:
+            self._setupDevice(device, apiVersion)
+        elif identityCache is not None:
+            apiVersion = identityCache.get(url, device)
+            if apiVersion is not None:
+                try:
+                    self._setupDevice(device, apiVersion)
+                except ValueError:
+                    _LOGGER.debug(
+                        "Cached version %s is unknown, asking device", apiVersion
+                    )
+                    identityCache.remove(url, device)
+                    apiVersion = None
+                else:
+                    if verifyIdentity:
+                        threading.Thread(
+                            target=self._verifyIdentityInBackground,
+                            name="pyavaccess-verify-{}".format(device),
+                            daemon=True,
+                        ).start()
+        if apiVersion is None and not lazy:
+            self._identify()
+
+        if cacheTTL is not None:
+            self.enableCache(cacheTTL)
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached while the device config is not loaded yet (lazy mode)
+        if name in _CONFIG_ATTRIBUTES and "_lock" in self.__dict__:
+            # Threads using the matrix first wait for one of them to identify it
+            with self._lock:
+                if name not in self.__dict__ and not self.__dict__.get("_identifying"):
+                    self._identify()
+                if name in self.__dict__:
+                    return self.__dict__[name]
+        raise AttributeError(
+            "'{}' object has no attribute '{}'".format(type(self).__name__, name)
+        )
+
+    def _identify(self) -> None:
+        """
+        Ask the device for its API version and load the matching device config
+        The port lock is held throughout, so no other thread sees a partial config
+        """
+        with self._lock:
+            self._identifying = True
+            try:
+                apiVersion = self.getVer()
+                self._setupDevice(self.model, apiVersion)
+            finally:
+                self._identifying = False
+
+        if self.identityCache is not None:
+            self.identityCache.set(self.url, self.model, apiVersion)
+
+    def verifyIdentity(self) -> bool:
+        """
+        Check the device still reports the API version its config was loaded for
+        A changed version reloads the device config and updates the identity cache
+        @return: True if the version was unchanged
+        """
+        apiVersion = self.getVer()
+        if apiVersion == self.apiVersion:
+            return True
+
+        _LOGGER.warning(
+            "%s reported %s instead of %s, reloading config",
+            self.url,
+            apiVersion,
+            self.apiVersion,
+        )
+        self._setupDevice(self.model, apiVersion)
+        if self.identityCache is not None:
+            self.identityCache.set(self.url, self.model, apiVersion)
+        return False
+
+    def _verifyIdentityInBackground(self) -> None:
+        try:
+            self.verifyIdentity()
+        except Exception as exc:
+            _LOGGER.warning("Could not verify identity of %s: %s", self.url, exc)
+
+    def startListening(self) -> "MatrixListener":
+        """
+        Read the port from a background thread and report unsolicited state changes
+        (ex: a route changed from the front panel) to subscribed callbacks
+        The listener stops if the connection drops, the next command reconnects
+        and listening can be started again
+        @return: Running listener, call subscribe() on it to receive MatrixEvents
+        """
+        if self._listener is None:
+            from .listener import MatrixListener
+
+            MatrixListener(self).start()
+        return self._listener
+
+    def stopListening(self) -> None:
+        """
+        Stop the background reader started by startListening()
+        """
+        if self._listener is not None:
+            self._listener.stop()
+
+    def startPolling(
+        self, intervals: Optional[Dict[str, float]] = None
+    ) -> "MatrixPoller":
+        """
+        Poll the device from a background thread and report only what changed
+        Each category backs off while it stays the same and speeds up after a
+        local set, reads a recent reply already answered are skipped
+        @param intervals: Seconds between polls of each category, see POLL_INTERVALS
+        @return: Running poller, call subscribe() on it to receive MatrixEvents
+        """
+        if self._poller is None:
+            from .poller import MatrixPoller
+
+            MatrixPoller(self, intervals).start()
+        return self._poller
+
+    def stopPolling(self) -> None:
+        """
+        Stop the background poller started by startPolling()
+        """
+        if self._poller is not None:
+            self._poller.stop()
+
+    def commandQueue(self) -> "HDMIMatrixQueue":
+        """
+        Start a worker thread that serialises commands from many threads
+        @return: Queue with the same getters and setters, returning futures
+        """
+        from .command_queue import HDMIMatrixQueue
+
+        return HDMIMatrixQueue(self)
+
+    def coalescing(self, window: float = 0.1) -> "HDMIMatrixCoalescer":
+        """
+        Collapse rapid-fire writes to the same target into the latest one
+        @param window: Seconds a write waits for newer writes to the same target
+        @return: Coalescer with the same getters and setters, returning futures
+        """
+        from .coalesce import HDMIMatrixCoalescer
+
+        return HDMIMatrixCoalescer(self, window)
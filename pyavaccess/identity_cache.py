@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DeviceIdentityCache:
+    """
+    On-disk record of the API version each known device reported
+
+    Entries are keyed by (url, model). A matrix built with a cached identity
+    loads its device config without sending GET VER first.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        @param path: JSON file to keep the cache in, created on first write
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._versions: Dict[str, str] = {}
+        try:
+            with open(path, encoding="utf-8") as cacheFile:
+                self._versions = json.load(cacheFile)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            _LOGGER.warning("Ignoring unreadable device identity cache %s", path)
+
+    @staticmethod
+    def _key(url: str, model: str) -> str:
+        return "{}|{}".format(url, model.upper())
+
+    def get(self, url: str, model: str) -> Optional[str]:
+        """
+        @param url: Port url or device name
+        @param model: Device name
+        @return: Cached API version string, or None if the device is unknown
+        """
+        return self._versions.get(self._key(url, model))
+
+    def set(self, url: str, model: str, apiVersion: str) -> None:
+        """
+        Remember the API version of a device and save the cache
+        @param url: Port url or device name
+        @param model: Device name
+        @param apiVersion: API version string in format "VER #.#.#"
+        """
+        key = self._key(url, model)
+        with self._lock:
+            if self._versions.get(key) == apiVersion:
+                return
+            self._versions[key] = apiVersion
+            self._save()
+
+    def remove(self, url: str, model: str) -> None:
+        """
+        Forget a device and save the cache
+        @param url: Port url or device name
+        @param model: Device name
+        """
+        with self._lock:
+            if self._versions.pop(self._key(url, model), None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        # Write to a temporary file first so a crash never leaves a partial cache
+        tmpPath = "{}.tmp".format(self.path)
+        with open(tmpPath, "w", encoding="utf-8") as cacheFile:
+            json.dump(self._versions, cacheFile, indent=2, sort_keys=True)
+        os.replace(tmpPath, self.path)
@@ -0,0 +1,416 @@
+import logging
+import queue
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+import serial
+
+from .avaccess_serial import commandTimeout, encodeCommands
+from .command import AVAccessCommand
+from .exceptions import (
+    AVAccessError,
+    CommandTimeout,
+    DeadlineExceeded,
+    DeviceErrorReply,
+)
+from .reply_parser import parseReply
+
+if TYPE_CHECKING:
+    from .hdmi_matrix import HDMIMatrixSerial
+
+_LOGGER = logging.getLogger(__name__)
+
+# How often the reader thread checks whether it should stop
+READ_INTERVAL = 0.1
+
+# Reply verbs that report a state change and the event kind they carry
+STATUS_KINDS = {
+    "MP": "mapping",
+    "SW": "mapping",
+    "MUTE": "mute",
+    "AUTOCEC_FN": "autoCEC",
+    "AUTOCEC_D": "cecDelay",
+    "EDID": "edid",
+}
+# Cached state key verb for each event kind, see MatrixState
+STATE_VERBS = {
+    "mapping": "MP",
+    "mute": "MUTE",
+    "autoCEC": "AUTOCEC_FN",
+    "cecDelay": "AUTOCEC_D",
+    "edid": "EDID",
+}
+
+
+def replyStates(deviceOutput: str, outputs: int) -> List[Tuple[str, Any, Any]]:
+    """
+    @param deviceOutput: Reply or unsolicited lines from the device
+    @param outputs: Number of outputs on the device, a switch to "all" sets each one
+    @return: (event kind, target, value) of every state value the lines carry
+    """
+    states = []
+    for verb, values in parseReply(deviceOutput).items():
+        kind = STATUS_KINDS.get(verb)
+        if kind is None:
+            continue
+        for target, value in values.items():
+            if target == "all" and kind == "mapping":
+                states.extend((kind, outNum, value) for outNum in range(1, outputs + 1))
+            else:
+                states.append((kind, target, value))
+    return states
+
+
+@dataclass(frozen=True)
+class MatrixEvent:
+    """
+    State change reported by the device without being asked
+    """
+
+    __slots__ = ("kind", "target", "value", "line")
+
+    # "mapping", "mute", "autoCEC", "cecDelay", "edid" or "other"
+    kind: str
+    # Output number, audio output name or input number, None for "other"
+    target: Any
+    # New value: input number, bool or int, the raw line for "other"
+    value: Any
+    # Line as received from the device, the whole reply for polled changes
+    line: str
+
+
+class _PendingReply:
+    """
+    Lines collected for a batch of commands waiting on the device
+    """
+
+    def __init__(self, commands: List[AVAccessCommand], timed: bool = False) -> None:
+        """
+        @param commands: Commands whose replies are collected
+        @param timed: Record when each reply started and finished
+        """
+        self.commands = commands
+        self.replies: List[List[str]] = [[] for _ in commands]
+        self.index = 0
+        self.done = threading.Event()
+        # Error line the device sent instead of the current reply
+        self.error: Optional[str] = None
+        # Why the reader stopped before the replies were complete
+        self.exception: Optional[Exception] = None
+        self.timed = timed
+        self.startedAt: List[float] = []
+        self.finishedAt: List[float] = []
+
+    def accepts(self, line: str) -> bool:
+        """
+        @return: True if the line belongs to the reply currently being read,
+            a change to another output is unsolicited even with the same verb
+        """
+        command = self.commands[self.index]
+        replyVerb = command.replyVerb
+        if replyVerb is None:
+            return True
+        if not line.startswith(replyVerb):
+            return False
+        target = command.replyTarget
+        return target is None or target in line.split()
+
+    def add(self, line: str) -> None:
+        reply = self.replies[self.index]
+        if self.timed and not reply:
+            self.startedAt.append(time.perf_counter())
+        reply.append(line)
+        if len(reply) >= self.commands[self.index].lineCount:
+            if self.timed:
+                self.finishedAt.append(time.perf_counter())
+            self.index += 1
+            if self.index >= len(self.commands):
+                self.done.set()
+
+    def fail(self, line: str) -> None:
+        """
+        Stop waiting because the device rejected the current command
+        """
+        self.error = line
+        self.done.set()
+
+    def abort(self, exc: Exception) -> None:
+        """
+        Stop waiting because the port can no longer be read
+        """
+        self.exception = exc
+        self.done.set()
+
+
+class MatrixListener:
+    """
+    Background reader that owns a matrix's port
+
+    Every line the device sends is read by one thread. Lines that answer a
+    command are handed to the caller waiting on it, anything else is parsed
+    into MatrixEvents for the subscribed callbacks and written through to the
+    matrix's state cache.
+
+    Callbacks run one event at a time on a separate dispatch thread, so they
+    may send commands to the matrix while the reader collects the replies.
+
+    Replies are split on any line ending, so blank lines are not counted.
+    """
+
+    def __init__(
+        self, matrix: "HDMIMatrixSerial", timeout: Optional[float] = None
+    ) -> None:
+        """
+        @param matrix: Matrix whose port is read
+        @param timeout: Seconds to wait for the replies to a batch of commands,
+            None to give each command the default of its verb
+        """
+        self._matrix = matrix
+        self.timeout = timeout
+        self._callbacks: List[Callable[[MatrixEvent], None]] = []
+        self._pending: Optional[_PendingReply] = None
+        self._pendingLock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Events waiting for the callbacks, None stops the dispatch thread
+        self._events: "queue.Queue[Optional[MatrixEvent]]" = queue.Queue()
+        self._dispatcher: Optional[threading.Thread] = None
+        # Error that stopped the reader thread, None while it is reading
+        self.error: Optional[Exception] = None
+        self._buffer = bytearray()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """
+        Start reading the port in a background thread
+        """
+        if self.running:
+            return
+        port = self._matrix._port
+        with self._matrix._lock:
+            if not port.is_open:
+                port.open()
+            self._savedTimeout = port.timeout
+            port.timeout = READ_INTERVAL
+            self._stopping.clear()
+            self.error = None
+            self._thread = threading.Thread(
+                target=self._read,
+                name="pyavaccess-listener-{}".format(self._matrix.model),
+                daemon=True,
+            )
+            # Attached before the thread runs, so running implies attached
+            self._matrix._listener = self
+            self._thread.start()
+        if self._dispatcher is None or not self._dispatcher.is_alive():
+            self._dispatcher = threading.Thread(
+                target=self._dispatch,
+                name="pyavaccess-events-{}".format(self._matrix.model),
+                daemon=True,
+            )
+            self._dispatcher.start()
+
+    def stop(self) -> None:
+        """
+        Stop the reader thread and go back to reading replies in the caller's thread
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        with self._matrix._lock:
+            self._detach()
+        # Events already read are still delivered
+        dispatcher, self._dispatcher = self._dispatcher, None
+        if dispatcher is not None:
+            self._events.put(None)
+            # A callback may stop the listener, its own thread ends after it
+            if dispatcher is not threading.current_thread():
+                dispatcher.join()
+
+    def _detach(self) -> None:
+        """
+        Hand the port back to the matrix, called with the port lock held
+        """
+        if self._matrix._listener is self:
+            self._matrix._listener = None
+            self._matrix._port.timeout = self._savedTimeout
+
+    def subscribe(self, callback: Callable[[MatrixEvent], None]) -> Callable[[], None]:
+        """
+        @param callback: Called from the dispatch thread with every MatrixEvent
+        @return: Function that unsubscribes the callback
+        """
+        self._callbacks.append(callback)
+        return lambda: self._callbacks.remove(callback)
+
+    def exchange(
+        self, commands: List[AVAccessCommand], batchDeadline: Optional[float] = None
+    ) -> List[str]:
+        """
+        Send commands and wait for the reader thread to collect their replies
+        Called by the matrix with its port lock held
+        @param commands: Commands to send
+        @param batchDeadline: time.monotonic() value the caller must have an answer by
+        @return: Response from the device for each command
+        """
+        if threading.current_thread() is self._thread:
+            # Only this thread can collect the replies, waiting would time out
+            raise AVAccessError("Commands can't be sent from the listener's reader")
+        instrumentation = self._matrix.instrumentation
+        pending = _PendingReply(commands, instrumentation.enabled)
+        with self._pendingLock:
+            if self.error is not None:
+                # The reader died, the matrix reads the port itself again
+                self._detach()
+                raise self.error
+            self._pending = pending
+
+        encoded = encodeCommands(commands)
+        encodedCmds = b"".join(encoded)
+        sentAt = time.perf_counter() if pending.timed else 0.0
+        _LOGGER.debug('Sending "%s"...', encodedCmds)
+        self._matrix._port.write(encodedCmds)
+        self._matrix._port.flush()
+        self._matrix.roundTrips += 1
+
+        if self.timeout is None:
+            timeout = sum(commandTimeout(command) for command in commands)
+        else:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        if batchDeadline is not None and batchDeadline < deadline:
+            deadline = batchDeadline
+
+        finished = pending.done.wait(max(deadline - time.monotonic(), 0))
+        with self._pendingLock:
+            self._pending = None
+        if pending.exception is not None:
+            self._detach()
+            raise pending.exception
+        if pending.error is not None:
+            raise DeviceErrorReply(commands[pending.index].cmdStr, pending.error)
+        if not finished:
+            instrumentation.observeTimeout(commands[pending.index].verb)
+            if deadline is batchDeadline:
+                raise DeadlineExceeded(
+                    "Batch of {} commands did not finish in time".format(len(commands))
+                )
+            # Usually only reached by invalid command
+            raise CommandTimeout(
+                "Connection timed out! Last received lines {}".format(pending.replies)
+            )
+        replies = ["\r\n".join(lines) for lines in pending.replies]
+        if pending.timed:
+            for command, encodedCmd, reply, startedAt, finishedAt in zip(
+                commands, encoded, replies, pending.startedAt, pending.finishedAt
+            ):
+                # Line endings are not kept, count them back in
+                instrumentation.observeCommand(
+                    command.verb,
+                    startedAt - sentAt,
+                    finishedAt - sentAt,
+                    len(encodedCmd),
+                    len(reply) + 2,
+                )
+        return replies
+
+    def _read(self) -> None:
+        port = self._matrix._port
+        while not self._stopping.is_set():
+            try:
+                chunk = port.read(port.in_waiting or 1)
+            except serial.SerialException as exc:
+                _LOGGER.warning(
+                    "Listener stopped reading %s: %s", self._matrix.url, exc
+                )
+                self._abort(exc)
+                return
+            if chunk:
+                self._buffer += chunk
+                for line in self._splitLines():
+                    self._handleLine(line)
+
+    def _abort(self, exc: serial.SerialException) -> None:
+        """
+        Fail the exchange waiting on the dead reader and hand the port back, so
+        the matrix can reconnect on the next command
+        """
+        with self._pendingLock:
+            self.error = exc
+            if self._pending is not None:
+                self._pending.abort(exc)
+        with self._matrix._lock:
+            self._detach()
+
+    def _splitLines(self) -> List[str]:
+        """
+        Take every complete line out of the buffer
+        Both \\r\\n and \\n\\r endings are accepted
+        """
+        parts = re.split(rb"[\r\n]+", bytes(self._buffer))
+        # The last part has no line ending yet
+        self._buffer = bytearray(parts.pop())
+        return [
+            part.decode("ascii", "replace").strip() for part in parts if part.strip()
+        ]
+
+    def _handleLine(self, line: str) -> None:
+        with self._pendingLock:
+            pending = self._pending
+            if pending is not None and not pending.done.is_set():
+                if pending.accepts(line):
+                    pending.add(line)
+                    return
+                errorPattern = self._matrix.errorReplyPattern
+                if errorPattern is not None and errorPattern.match(
+                    line.encode("ascii", "replace")
+                ):
+                    pending.fail(line)
+                    return
+
+        _LOGGER.debug('Received unsolicited "%s"', line)
+        for event in self._parseEvents(line):
+            self._recordEvent(event)
+            self._events.put(event)
+
+    def _dispatch(self) -> None:
+        """
+        Hand each event to the callbacks, off the reader thread
+        """
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            for callback in list(self._callbacks):
+                try:
+                    callback(event)
+                except Exception:
+                    _LOGGER.exception("Error in matrix event callback")
+
+    def _parseEvents(self, line: str) -> List[MatrixEvent]:
+        """
+        @param line: Unsolicited line from the device
+        @return: Events carried by the line
+        """
+        events = [
+            MatrixEvent(kind, target, value, line)
+            for kind, target, value in replyStates(line, self._matrix.outputs)
+        ]
+        return events or [MatrixEvent("other", None, line, line)]
+
+    def _recordEvent(self, event: MatrixEvent) -> None:
+        """
+        Write an event through to the matrix's state cache
+        """
+        state = self._matrix.state
+        if state is None or event.kind == "other":
+            return
+        state.set((STATE_VERBS[event.kind], event.target), event.value)
@@ -0,0 +1,317 @@
+import bisect
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from .command import AVAccessCommand
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Instrumentation:
+    """
+    Receives timings and counts from the serial transports
+
+    This base class ignores everything. Transports check enabled before
+    reading the clock, so leaving the default in place costs nothing on the
+    hot path. Subclass it to feed your own metrics or tracing system.
+
+    Durations are in seconds and measured from just before the write. In a
+    batch every command shares that start, so later commands include the time
+    spent waiting on the replies before them.
+    """
+
+    # Transports only time commands when this is True
+    enabled = False
+
+    def observeCommand(
+        self,
+        verb: str,
+        firstByte: Optional[float],
+        total: float,
+        bytesOut: int,
+        bytesIn: int,
+    ) -> None:
+        """
+        Called once the full reply to a command has been read
+        @param verb: Command name without its arguments (ex: "GET MP")
+        @param firstByte: Seconds until the first byte of the reply, None if unknown
+        @param total: Seconds until the reply was complete
+        @param bytesOut: Bytes written for the command
+        @param bytesIn: Bytes read for the reply
+        """
+
+    def observeParse(self, verb: str, seconds: float) -> None:
+        """
+        Called after a reply has been parsed
+        @param verb: Command name without its arguments
+        @param seconds: Time spent in the command's parser
+        """
+
+    def observeTimeout(self, verb: str) -> None:
+        """
+        Called when the device did not finish replying to a command in time
+        @param verb: Command name without its arguments
+        """
+
+    def observeRetry(self, verb: str) -> None:
+        """
+        Called when a command is sent again after failing
+        @param verb: Command name without its arguments
+        """
+
+
+NO_INSTRUMENTATION = Instrumentation()
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram in the Prometheus style
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """
+        @param bounds: Sorted upper bounds of the buckets, +Inf is implied
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        @return: (upper bound, observations at or below it) for every bucket
+        """
+        buckets = []
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            buckets.append((bound, seen))
+        return buckets
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"buckets": self.cumulative(), "sum": self.sum, "count": self.count}
+
+
+class _VerbMetrics:
+    """
+    Counters and histograms for one command verb
+    """
+
+    __slots__ = (
+        "commands",
+        "timeouts",
+        "retries",
+        "bytesOut",
+        "bytesIn",
+        "total",
+        "firstByte",
+        "parse",
+    )
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.commands = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.bytesOut = 0
+        self.bytesIn = 0
+        self.total = Histogram(bounds)
+        self.firstByte = Histogram(bounds)
+        self.parse = Histogram(bounds)
+
+
+class MetricsRecorder(Instrumentation):
+    """
+    Instrumentation that keeps counters and latency histograms per command verb
+
+    One recorder can be shared by several matrices. Read it with snapshot(),
+    or serve exportPrometheus() from a /metrics endpoint. An OpenTelemetry
+    observable callback can read the same snapshot.
+
+    Usage:
+        metrics = MetricsRecorder()
+        av = HDMIMatrixSerial("/dev/ttyUSB0", "4KMX42-H2A", instrumentation=metrics)
+        av.getMappings()
+        print(metrics.snapshot()["GET MP"]["commands"])
+    """
+
+    enabled = True
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """
+        @param buckets: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._verbs: Dict[str, _VerbMetrics] = {}
+
+    def _metrics(self, verb: str) -> _VerbMetrics:
+        metrics = self._verbs.get(verb)
+        if metrics is None:
+            metrics = self._verbs[verb] = _VerbMetrics(self.buckets)
+        return metrics
+
+    def observeCommand(
+        self,
+        verb: str,
+        firstByte: Optional[float],
+        total: float,
+        bytesOut: int,
+        bytesIn: int,
+    ) -> None:
+        with self._lock:
+            metrics = self._metrics(verb)
+            metrics.commands += 1
+            metrics.bytesOut += bytesOut
+            metrics.bytesIn += bytesIn
+            metrics.total.observe(total)
+            if firstByte is not None:
+                metrics.firstByte.observe(firstByte)
+
+    def observeParse(self, verb: str, seconds: float) -> None:
+        with self._lock:
+            self._metrics(verb).parse.observe(seconds)
+
+    def observeTimeout(self, verb: str) -> None:
+        with self._lock:
+            self._metrics(verb).timeouts += 1
+
+    def observeRetry(self, verb: str) -> None:
+        with self._lock:
+            self._metrics(verb).retries += 1
+
+    def reset(self) -> None:
+        """
+        Forget everything recorded so far
+        """
+        with self._lock:
+            self._verbs.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        @return: Counters and histograms keyed by command verb,
+            ex: {"GET MP": {"commands": 2, "timeouts": 0, ..., "total": {...}}}
+        """
+        with self._lock:
+            return {
+                verb: {
+                    "commands": metrics.commands,
+                    "timeouts": metrics.timeouts,
+                    "retries": metrics.retries,
+                    "bytesOut": metrics.bytesOut,
+                    "bytesIn": metrics.bytesIn,
+                    "total": metrics.total.snapshot(),
+                    "firstByte": metrics.firstByte.snapshot(),
+                    "parse": metrics.parse.snapshot(),
+                }
+                for verb, metrics in self._verbs.items()
+            }
+
+    def exportPrometheus(self, prefix: str = "pyavaccess") -> str:
+        """
+        @param prefix: Prepended to every metric name
+        @return: Metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines: List[str] = []
+
+        counters = (
+            ("commands", "commands_total", "Commands answered by the device"),
+            (
+                "timeouts",
+                "timeouts_total",
+                "Commands the device did not answer in time",
+            ),
+            ("retries", "retries_total", "Commands sent again after failing"),
+            ("bytesOut", "bytes_sent_total", "Bytes written to the device"),
+            ("bytesIn", "bytes_received_total", "Bytes read from the device"),
+        )
+        for key, name, description in counters:
+            lines.append("# HELP {}_{} {}".format(prefix, name, description))
+            lines.append("# TYPE {}_{} counter".format(prefix, name))
+            for verb, metrics in snapshot.items():
+                lines.append(
+                    '{}_{}{{verb="{}"}} {}'.format(prefix, name, verb, metrics[key])
+                )
+
+        histograms = (
+            ("total", "command_seconds", "Time until the full reply was read"),
+            ("firstByte", "first_byte_seconds", "Time until the reply started"),
+            ("parse", "parse_seconds", "Time spent parsing the reply"),
+        )
+        for key, name, description in histograms:
+            lines.append("# HELP {}_{} {}".format(prefix, name, description))
+            lines.append("# TYPE {}_{} histogram".format(prefix, name))
+            for verb, metrics in snapshot.items():
+                histogram = metrics[key]
+                for bound, count in histogram["buckets"]:
+                    lines.append(
+                        '{}_{}_bucket{{verb="{}",le="{}"}} {}'.format(
+                            prefix, name, verb, _formatBound(bound), count
+                        )
+                    )
+                lines.append(
+                    '{}_{}_sum{{verb="{}"}} {}'.format(
+                        prefix, name, verb, histogram["sum"]
+                    )
+                )
+                lines.append(
+                    '{}_{}_count{{verb="{}"}} {}'.format(
+                        prefix, name, verb, histogram["count"]
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _formatBound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def parseReplies(
+    instrumentation: Instrumentation,
+    commands: List["AVAccessCommand"],
+    deviceOutputs: List[str],
+) -> List[Any]:
+    """
+    Parse the reply to each command, timing the parsers if instrumentation is on
+    @param instrumentation: Receives the parse times
+    @param commands: Commands that were sent
+    @param deviceOutputs: Stripped reply from the device for each command
+    @return: Parsed reply for each command
+    """
+    if not instrumentation.enabled:
+        return [
+            command.parse(deviceOutput)
+            for command, deviceOutput in zip(commands, deviceOutputs)
+        ]
+
+    parsed = []
+    for command, deviceOutput in zip(commands, deviceOutputs):
+        started = time.perf_counter()
+        parsed.append(command.parse(deviceOutput))
+        instrumentation.observeParse(command.verb, time.perf_counter() - started)
+    return parsed
@@ -0,0 +1,328 @@
+import logging
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import serial
+
+from .command import AVAccessCommand
+from .exceptions import AVAccessError
+from .listener import STATE_VERBS, MatrixEvent
+
+if TYPE_CHECKING:
+    from .batch import HDMIMatrixBatch
+    from .hdmi_matrix import HDMIMatrixSerial
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds between polls of each state category while it keeps changing
+POLL_INTERVALS = {
+    "mapping": 2.0,
+    "mute": 5.0,
+    "autoCEC": 30.0,
+    "cecDelay": 30.0,
+    "edid": 60.0,
+}
+# Each unchanged poll doubles the interval, up to this many times the base
+MAX_BACKOFF = 8
+# Seconds between polls of a category for a while after a local set touched it
+BOOST_INTERVAL = 0.5
+BOOST_DURATION = 5.0
+
+# Event kind of each cached state key verb, see MatrixState
+STATE_KINDS = {verb: kind for kind, verb in STATE_VERBS.items()}
+
+# Queues the reads that refresh every target of a category
+_POLL_READS: Dict[str, Callable[["HDMIMatrixBatch"], None]] = {
+    "mapping": lambda batch: batch.getMappings(),
+    "mute": lambda batch: batch.getAllMuteStatus(),
+    "edid": lambda batch: batch.getAllInputEDIDStatus(),
+    "autoCEC": lambda batch: [
+        batch.getAutoCECStatus(outNum) for outNum in range(1, batch.outputs + 1)
+    ],
+    "cecDelay": lambda batch: [
+        batch.getCECDelay(outNum) for outNum in range(1, batch.outputs + 1)
+    ],
+}
+
+
+class _ReplyRecorder:
+    """
+    Stands in for MatrixState when a command writes its reply through
+    Collects the values instead of caching them, see AVAccessCommand.writeState
+    """
+
+    def __init__(self) -> None:
+        self.values: List[Tuple[Hashable, Any]] = []
+        self.invalidated = False
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.values.append((key, value))
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        self.invalidated = True
+
+
+class MatrixPoller:
+    """
+    Background poller that reports only the state that changed
+
+    Each category (routing, mute, auto CEC, CEC delay, EDID) is read at its
+    own interval, all categories that are due share one batch. A category
+    that reads the same twice is polled half as often, up to MAX_BACKOFF
+    times its interval, and goes back to its interval once it changes. A
+    local set speeds up polling of the categories it touched for a while.
+
+    Every reply the matrix receives is watched, not only the poller's own,
+    so a category a recent command already read in full is not polled
+    again, and changes made by local sets reach subscribers as well.
+    Subscribers get a MatrixEvent per changed value, the first read of a
+    value only fills in values.
+    """
+
+    def __init__(
+        self,
+        matrix: "HDMIMatrixSerial",
+        intervals: Optional[Dict[str, float]] = None,
+        maxBackoff: float = MAX_BACKOFF,
+        boostInterval: float = BOOST_INTERVAL,
+        boostDuration: float = BOOST_DURATION,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        @param matrix: Matrix to poll
+        @param intervals: Seconds between polls of each category (see
+            POLL_INTERVALS), categories left out are not polled
+        @param maxBackoff: Largest multiple of its interval a category backs off to
+        @param boostInterval: Seconds between polls after a local set
+        @param boostDuration: Seconds polling stays fast after a local set
+        @param clock: Monotonic time source
+        """
+        if intervals is None:
+            intervals = POLL_INTERVALS
+        for kind in intervals:
+            if kind not in _POLL_READS:
+                raise ValueError("Unknown poll category {}!".format(kind))
+        self._matrix = matrix
+        self.intervals = dict(intervals)
+        self.maxBackoff = maxBackoff
+        self.boostInterval = boostInterval
+        self.boostDuration = boostDuration
+        self._clock = clock
+        # Last known value of every target {(kind, target): value}
+        self.values: Dict[Tuple[str, Any], Any] = {}
+        # Number of poll batches sent
+        self.polls = 0
+        self._callbacks: List[Callable[[MatrixEvent], None]] = []
+        self._lock = threading.Lock()
+        self._current = dict(self.intervals)
+        self._seenAt: Dict[Tuple[str, Any], float] = {}
+        self._polledAt: Dict[str, float] = {}
+        self._boostUntil: Dict[str, float] = {}
+        self._changed: Set[str] = set()
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """
+        Watch the matrix's replies and poll it from a background thread
+        """
+        if self.running:
+            return
+        self._watch()
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="pyavaccess-poller-{}".format(self._matrix.model),
+            daemon=True,
+        )
+        self._thread.start()
+        self._matrix._poller = self
+
+    def stop(self) -> None:
+        """
+        Stop polling and watching the matrix's replies
+        """
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._unwatch()
+        self._matrix._poller = None
+
+    def subscribe(self, callback: Callable[[MatrixEvent], None]) -> Callable[[], None]:
+        """
+        @param callback: Called with a MatrixEvent for every value that changed
+        @return: Function that unsubscribes the callback
+        """
+        self._callbacks.append(callback)
+        return lambda: self._callbacks.remove(callback)
+
+    def _watch(self) -> None:
+        if self._observe not in self._matrix._replyObservers:
+            self._matrix._replyObservers.append(self._observe)
+
+    def _unwatch(self) -> None:
+        if self._observe in self._matrix._replyObservers:
+            self._matrix._replyObservers.remove(self._observe)
+
+    """ Scheduling Methods """
+
+    def _targets(self, kind: str) -> Iterable[Any]:
+        if kind == "mute":
+            return self._matrix.audioOutputs
+        if kind == "edid":
+            return range(1, self._matrix.inputs + 1)
+        return range(1, self._matrix.outputs + 1)
+
+    def _interval(self, kind: str, now: float) -> float:
+        if now < self._boostUntil.get(kind, float("-inf")):
+            return min(self.boostInterval, self._current[kind])
+        return self._current[kind]
+
+    def _answeredAt(self, kind: str) -> float:
+        """
+        @return: When every target of the category was last read, by any command
+        """
+        return min(
+            self._seenAt.get((kind, target), float("-inf"))
+            for target in self._targets(kind)
+        )
+
+    def _dueAt(self, kind: str, now: float) -> float:
+        polledAt = self._polledAt.get(kind, float("-inf"))
+        return max(polledAt, self._answeredAt(kind)) + self._interval(kind, now)
+
+    def nextPollIn(self) -> float:
+        """
+        @return: Seconds until the next category is due, 0 if one is due now
+        """
+        now = self._clock()
+        with self._lock:
+            dueAt = min(self._dueAt(kind, now) for kind in self.intervals)
+        return max(dueAt - now, 0.0)
+
+    def poll(self) -> List[str]:
+        """
+        Read every category that is due in one batch
+        Called by the background thread, can also be called directly
+        @return: Categories that were read
+        """
+        self._watch()
+        now = self._clock()
+        with self._lock:
+            due = []
+            for kind in self.intervals:
+                # Also not due while a recent reply answered everything it reads
+                if self._dueAt(kind, now) > now:
+                    continue
+                due.append(kind)
+                self._polledAt[kind] = now
+        if not due:
+            return []
+
+        # Polls look for changes made elsewhere, cached values can't show them
+        batch = self._matrix.batch(bypassCache=True)
+        for kind in due:
+            _POLL_READS[kind](batch)
+        _LOGGER.debug("Polling %s...", due)
+        self.polls += 1
+        batch.execute()
+
+        with self._lock:
+            for kind in due:
+                # Changes seen since the last poll count, local sets included
+                if kind in self._changed:
+                    self._changed.discard(kind)
+                    self._current[kind] = self.intervals[kind]
+                else:
+                    self._current[kind] = min(
+                        self._current[kind] * 2,
+                        self.intervals[kind] * self.maxBackoff,
+                    )
+        return due
+
+    def _run(self) -> None:
+        try:
+            while not self._stopping.is_set():
+                try:
+                    self.poll()
+                except (AVAccessError, serial.SerialException) as exc:
+                    _LOGGER.warning("Could not poll %s: %s", self._matrix.url, exc)
+                except Exception:
+                    # Ex: a reply that could not be parsed, the next poll may do
+                    _LOGGER.exception("Error polling %s", self._matrix.url)
+                self._wake.wait(self.nextPollIn())
+                self._wake.clear()
+        finally:
+            # Don't leave a dead poller for startPolling() to hand back
+            if not self._stopping.is_set() and self._matrix._poller is self:
+                self._unwatch()
+                self._matrix._poller = None
+
+    """ Change Detection Methods """
+
+    def _observe(
+        self, commands: List[AVAccessCommand], deviceOutputs: List[str], results: list
+    ) -> None:
+        """
+        Compare every reply the matrix receives with the last known values
+        """
+        now = self._clock()
+        events = []
+        boosted = False
+        with self._lock:
+            for command, deviceOutput, result in zip(commands, deviceOutputs, results):
+                if command.writeState is None:
+                    continue
+                recorder = _ReplyRecorder()
+                command.writeState(recorder, result)
+                if recorder.invalidated:
+                    # Ex: after a reboot, read everything again
+                    self._seenAt.clear()
+                    self._polledAt.clear()
+                    boosted = True
+                for (verb, target), value in recorder.values:
+                    kind = STATE_KINDS.get(verb)
+                    if kind is None:
+                        continue
+                    key = (kind, target)
+                    self._seenAt[key] = now
+                    if key not in self.values:
+                        # Nothing to compare with yet, don't back off
+                        self._changed.add(kind)
+                    elif self.values[key] != value:
+                        events.append(MatrixEvent(kind, target, value, deviceOutput))
+                        self._changed.add(kind)
+                    self.values[key] = value
+                    if not command.isQuery and kind in self.intervals:
+                        self._boostUntil[kind] = now + self.boostDuration
+                        boosted = True
+
+        if boosted:
+            # Let the background thread pick up the shorter interval
+            self._wake.set()
+        for event in events:
+            for callback in list(self._callbacks):
+                try:
+                    callback(event)
+                except Exception:
+                    _LOGGER.exception("Error in matrix poll callback")
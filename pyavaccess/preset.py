@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from .snapshot import MatrixSnapshot
+
+
+@dataclass(frozen=True)
+class MatrixPreset:
+    """
+    Desired routing, mute and CEC settings of a matrix, ex: a room layout
+
+    Only the outputs and settings listed are changed when the preset is
+    applied, everything else is left as it is.
+    """
+
+    # Input to map to each output {out: in}
+    routing: Dict[int, int] = field(default_factory=dict)
+    # Whether each audio output should be muted {name: muted}
+    mute: Dict[str, bool] = field(default_factory=dict)
+    # Whether CEC auto power should be on for each output {out: on}
+    autoCEC: Dict[int, bool] = field(default_factory=dict)
+    # CEC power delay of each output in minutes {out: delay}
+    cecDelay: Dict[int, int] = field(default_factory=dict)
+
+    @classmethod
+    def fromSnapshot(cls, snapshot: MatrixSnapshot) -> "MatrixPreset":
+        """
+        @param snapshot: Device state to save
+        @return: Preset that brings a matrix back to the snapshot's settings
+        """
+        return cls(
+            routing=dict(snapshot.routing),
+            mute=dict(snapshot.mute),
+            autoCEC=dict(snapshot.autoCEC),
+            cecDelay=dict(snapshot.cecDelay),
+        )
+
+
+@dataclass(frozen=True)
+class PresetResult:
+    """
+    Outcome of applying a preset
+    """
+
+    __slots__ = ("preset", "applied", "commands", "roundTrips")
+
+    # Preset that was applied
+    preset: MatrixPreset
+    # Values for everything in the preset, as confirmed by the device replies
+    applied: MatrixPreset
+    # Commands sent to reach the preset, empty if nothing had to change
+    commands: List[str]
+    # Number of writes that waited on the device, reads included
+    roundTrips: int
+
+    @property
+    def ok(self) -> bool:
+        """
+        @return: True if the device confirmed every setting of the preset
+        """
+        return self.applied == self.preset
+
+
+def planRouting(
+    target: Dict[int, int], current: Dict[int, int]
+) -> Tuple[Optional[int], Dict[int, int]]:
+    """
+    Find the fewest SET SW commands that turn the current routing into the target
+    @param target: Input wanted on some or all outputs {out: in}
+    @param current: Input currently mapped to every output {out: in}
+    @return: Input to map to all outputs first, or None, and the single
+        outputs to map after that {out: in}
+    """
+    changed = {
+        outNum: inNum
+        for outNum, inNum in target.items()
+        if current.get(outNum) != inNum
+    }
+    if not changed:
+        return None, {}
+
+    # Outputs outside the target keep their input, so "all" must restore them
+    desired = dict(current)
+    desired.update(target)
+
+    bestAll: Optional[int] = None
+    bestSingles = changed
+    for inNum in sorted(set(changed.values())):
+        singles = {
+            outNum: wanted for outNum, wanted in desired.items() if wanted != inNum
+        }
+        if 1 + len(singles) < len(bestSingles) + (bestAll is not None):
+            bestAll, bestSingles = inNum, singles
+    return bestAll, bestSingles
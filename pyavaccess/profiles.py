@@ -0,0 +1,331 @@
+import itertools
+import json
+import logging
+import operator
+import os
+import re
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Profiles shipped with the library, one JSON file per model
+PROFILE_DIR = os.path.join(os.path.dirname(__file__), "config", "profiles")
+
+PATTERN_VERSION = re.compile(r"(?:VER )?(\d+(?:\.\d+)*)$")
+PATTERN_SPECIFIER = re.compile(r"(>=|<=|==|>|<)\s*(\d+(?:\.\d+)*)$")
+
+_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+def parseVersion(version: str) -> Tuple[int, ...]:
+    """
+    @param version: API version, with or without the "VER " prefix (ex: "VER 1.0.2")
+    @return: Version numbers (ex: (1, 0, 2))
+    """
+    match = PATTERN_VERSION.match(version.strip())
+    if not match:
+        raise ValueError("Version {!r} is not in format VER #.#.#".format(version))
+    return tuple(int(number) for number in match.group(1).split("."))
+
+
+def _compare(version: Tuple[int, ...], specifier: str) -> bool:
+    """
+    @param version: Parsed device version
+    @param specifier: Comparison against a version (ex: ">=1.0.2")
+    @return: True if the version satisfies the specifier
+    """
+    match = PATTERN_SPECIFIER.match(specifier.strip())
+    if not match:
+        raise ValueError("Version specifier {!r} is not valid".format(specifier))
+    bound = parseVersion(match.group(2))
+    # Missing numbers count as 0, so "<1.1" is the same as "<1.1.0"
+    width = max(len(version), len(bound))
+    padded = version + (0,) * (width - len(version))
+    bound += (0,) * (width - len(bound))
+    return _OPERATORS[match.group(1)](padded, bound)
+
+
+# Words of a command template that stand for an argument, and how to write it
+_PLACEHOLDERS: Dict[str, Callable[[Any], str]] = {
+    "inX": "in{}".format,
+    "outY": "out{}".format,
+    "prm": str,
+    "audioout": str,
+    "on/off": lambda state: "on" if state else "off",
+    "min": str,
+    "modeX": "mode{}".format,
+}
+
+
+def _render(tokens: Sequence[str], args: Sequence[Any]) -> str:
+    """
+    @param tokens: Words of a command template
+    @param args: Argument of each placeholder, in order
+    @return: Command string without line ending
+    """
+    values = iter(args)
+    return " ".join(
+        _PLACEHOLDERS[token](next(values)) if token in _PLACEHOLDERS else token
+        for token in tokens
+    )
+
+
+class DeviceProfile:
+    """
+    Port counts, audio outputs and command set of one device model
+
+    Commands are the lines the device lists for "help", with placeholders for
+    their arguments (ex: "SET SW inX outY"). Each maps to the number of lines
+    the device replies with: a number, or the name of the port count it
+    scales with ("inputs", "outputs", "audioOutputs" or "commands").
+
+    Error replies are the start of lines the device sends instead of a reply
+    when it rejects a command. Only list lines the device is known to send,
+    without any a rejected command just times out.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        versions: Sequence[str],
+        inputCount: int,
+        outputCount: int,
+        audioOutputs: Sequence[str],
+        EDIDParamCount: int,
+        maxDelayInMin: int,
+        irModeCount: int,
+        commands: Dict[str, Union[int, str]],
+        errorReplies: Sequence[str] = (),
+    ) -> None:
+        """
+        @param model: Device name (ex: "4KMX42-H2A")
+        @param versions: Specifiers every supported API version must meet,
+            ex: [">=1.0.2", "<1.1"]
+        @param commands: Reply line count of each command template
+        @param errorReplies: Start of the lines the device rejects commands with
+        """
+        self.model = model.upper()
+        self.versions = tuple(versions)
+        self.inputCount = inputCount
+        self.outputCount = outputCount
+        self.audioOutputs = list(audioOutputs)
+        self.EDIDParamCount = EDIDParamCount
+        self.maxDelayInMin = maxDelayInMin
+        self.irModeCount = irModeCount
+        self.commands = list(commands)
+        self.errorReplies = tuple(errorReplies)
+        # Error line at the start of a reply, after any leftover line ending bytes
+        self.errorReplyPattern: Optional[Pattern[bytes]] = None
+        if self.errorReplies:
+            self.errorReplyPattern = re.compile(
+                rb"[\r\n]*(?:"
+                + b"|".join(
+                    re.escape(prefix.encode("ascii")) for prefix in self.errorReplies
+                )
+                + rb")"
+            )
+
+        counts = {
+            "inputs": inputCount,
+            "outputs": outputCount,
+            "audioOutputs": len(self.audioOutputs),
+            "commands": len(self.commands),
+        }
+        self._replyLines: Dict[str, int] = {}
+        for template, lines in commands.items():
+            if isinstance(lines, str):
+                if lines not in counts:
+                    raise ValueError(
+                        "Unknown reply line count {!r} for {!r}".format(lines, template)
+                    )
+                lines = counts[lines]
+            self._replyLines[template] = lines
+        self._encodings: Optional[Dict[Tuple[Any, ...], Tuple[str, bytes]]] = None
+
+    @classmethod
+    def fromFile(cls, path: str) -> "DeviceProfile":
+        """
+        @param path: JSON file describing the profile
+        @return: The loaded profile
+        """
+        with open(path, encoding="utf-8") as profileFile:
+            return cls(**json.load(profileFile))
+
+    @property
+    def commandCount(self) -> int:
+        """
+        @return: Number of lines in the reply to "help"
+        """
+        return len(self.commands)
+
+    def matches(self, model: str, apiVersion: str) -> bool:
+        """
+        @param model: Device name, any case
+        @param apiVersion: API version string in format "VER #.#.#"
+        @return: True if the profile describes this model and version
+        """
+        if model.upper() != self.model:
+            return False
+        version = parseVersion(apiVersion)
+        return all(_compare(version, specifier) for specifier in self.versions)
+
+    def replyLines(self, template: str) -> int:
+        """
+        @param template: Command template (ex: "GET MP all")
+        @return: Number of lines the device replies with
+        """
+        return self._replyLines[template]
+
+    def _arguments(self, token: str) -> Sequence[Any]:
+        """
+        @param token: Placeholder of a command template, see _PLACEHOLDERS
+        @return: Every argument the placeholder can take on this device
+        """
+        if token == "inX":
+            return range(1, self.inputCount + 1)
+        if token == "outY":
+            return range(1, self.outputCount + 1)
+        if token == "prm":
+            return range(1, self.EDIDParamCount + 1)
+        if token == "audioout":
+            return self.audioOutputs
+        if token == "on/off":
+            return (True, False)
+        if token == "min":
+            return range(1, self.maxDelayInMin + 1)
+        return range(1, self.irModeCount + 1)
+
+    @property
+    def encodings(self) -> Dict[Tuple[Any, ...], Tuple[str, bytes]]:
+        """
+        Every command the device accepts, formatted and encoded once on first use
+        @return: (command string, bytes sent over the wire) keyed by the
+            template followed by its arguments, ex: ("SET SW inX outY", 3, 1)
+        """
+        if self._encodings is None:
+            encodings = {}
+            for template in self.commands:
+                tokens = template.split(" ")
+                options = [
+                    self._arguments(token) for token in tokens if token in _PLACEHOLDERS
+                ]
+                for args in itertools.product(*options):
+                    cmdStr = _render(tokens, args)
+                    encodings[(template,) + args] = (
+                        cmdStr,
+                        (cmdStr + "\r\n").encode("ascii"),
+                    )
+            _LOGGER.debug(
+                "Compiled %s command encodings for %s", len(encodings), self.model
+            )
+            self._encodings = encodings
+        return self._encodings
+
+    def command(self, template: str, *args: Any) -> Tuple[str, bytes]:
+        """
+        @param template: Command template (ex: "SET SW inX outY")
+        @param args: Argument of each placeholder, in order (ex: 3, 1)
+        @return: Command string and the bytes sent over the wire, precompiled
+            for every command the device accepts
+        """
+        compiled = self.encodings.get((template,) + args)
+        if compiled is None:
+            # Not listed by the device, let it reply as it does to unknown commands
+            cmdStr = _render(template.split(" "), args)
+            compiled = (cmdStr, (cmdStr + "\r\n").encode("ascii"))
+        return compiled
+
+    def __repr__(self) -> str:
+        return "DeviceProfile({!r}, versions={!r})".format(self.model, self.versions)
+
+
+class ProfileRegistry:
+    """
+    Device profiles loaded from JSON files, searched by model and API version
+
+    Profiles added later take precedence, so a profile loaded from your own
+    directory overrides the one shipped for the same model and version.
+
+    Usage:
+        DEVICE_PROFILES.loadDirectory("/etc/pyavaccess/profiles")
+        av = HDMIMatrixSerial("/dev/ttyUSB0", "8KMX88-H2A")
+    """
+
+    def __init__(self) -> None:
+        self._profiles: List[DeviceProfile] = []
+        # Profile found for each (model, apiVersion), batches look them up often
+        self._found: Dict[Tuple[str, str], DeviceProfile] = {}
+
+    def add(self, profile: DeviceProfile) -> None:
+        self._profiles.append(profile)
+        self._found.clear()
+
+    def load(self, path: str) -> DeviceProfile:
+        """
+        @param path: JSON file describing a profile
+        @return: The loaded profile
+        """
+        _LOGGER.debug("Loading device profile %s...", path)
+        profile = DeviceProfile.fromFile(path)
+        self.add(profile)
+        return profile
+
+    def loadDirectory(self, path: str) -> None:
+        """
+        @param path: Directory of profile JSON files
+        """
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                self.load(os.path.join(path, name))
+
+    def find(self, model: str, apiVersion: str) -> DeviceProfile:
+        """
+        @param model: Device name, any case
+        @param apiVersion: API version string in format "VER #.#.#"
+        @return: Latest added profile matching the model and version
+        """
+        key = (model.upper(), apiVersion)
+        found = self._found.get(key)
+        if found is not None:
+            return found
+        for profile in reversed(self._profiles):
+            if profile.matches(model, apiVersion):
+                self._found[key] = profile
+                return profile
+        raise ValueError(
+            "No device profile for {} version {}".format(model, apiVersion)
+        )
+
+    def models(self, apiVersion: str) -> List[str]:
+        """
+        @param apiVersion: API version string in format "VER #.#.#"
+        @return: Device names with a profile for the version
+        """
+        models = []
+        for profile in self._profiles:
+            if profile.model not in models and profile.matches(
+                profile.model, apiVersion
+            ):
+                models.append(profile.model)
+        return models
+
+
+# Registry used by every matrix, loaded with the shipped profiles
+DEVICE_PROFILES = ProfileRegistry()
+DEVICE_PROFILES.loadDirectory(PROFILE_DIR)
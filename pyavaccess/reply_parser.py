@@ -0,0 +1,170 @@
+import functools
+import re
+from typing import Any, Callable, Dict, Pattern, Tuple
+
+# Key used for replies that carry a single value
+SINGLE = None
+
+# Distinct routing replies kept parsed, polling sees the same few over and over
+ROUTING_CACHE_SIZE = 256
+
+# First word of every reply line
+PATTERN_VERB = re.compile(r"^([A-Z_]+) ", re.MULTILINE)
+
+_ON_OFF = {"on": True, "off": False}
+
+
+def _portKey(field: str) -> Any:
+    """
+    @param field: Port number or "all"
+    """
+    return field if field == "all" else int(field)
+
+
+def _pairs(
+    pattern: Pattern[str],
+    keyType: Callable[[str], Any],
+    valueType: Callable[[str], Any],
+) -> Callable[[str], Dict[Any, Any]]:
+    """
+    @param pattern: Matches (target, value) on every line of the reply
+    @param keyType: Converts the target
+    @param valueType: Converts the value
+    @return: Parser turning a whole reply into {target: value}
+    """
+
+    def parse(deviceOutput: str) -> Dict[Any, Any]:
+        return {
+            keyType(key): valueType(value)
+            for key, value in pattern.findall(deviceOutput)
+        }
+
+    return parse
+
+
+def _routing(pattern: Pattern[str]) -> Callable[[str], Dict[Any, int]]:
+    """
+    @param pattern: Matches (input, output) on every line of the reply
+    @return: Parser turning a whole reply into {out: in}, out may be "all"
+    """
+
+    def parse(deviceOutput: str) -> Dict[Any, int]:
+        return {
+            _portKey(outField): int(inField)
+            for inField, outField in pattern.findall(deviceOutput)
+        }
+
+    return parse
+
+
+def _single(pattern: Pattern[str]) -> Callable[[str], Dict[Any, int]]:
+    """
+    @param pattern: Matches the number on a reply line without a target
+    @return: Parser turning the reply into {SINGLE: value}
+    """
+
+    def parse(deviceOutput: str) -> Dict[Any, int]:
+        return {SINGLE: int(value) for value in pattern.findall(deviceOutput)}
+
+    return parse
+
+
+# Routing reply lines, each match is (input, output number or "all")
+ROUTING_PATTERNS: Dict[str, Pattern[str]] = {
+    "MP": re.compile(r"^MP in(\d+) out(\d+)[ \t\r]*$", re.MULTILINE),
+    "SW": re.compile(r"^SW in(\d+) (?:out)?(\d+|all)[ \t\r]*$", re.MULTILINE),
+}
+
+# Parser for each reply verb, every one reads the whole reply with a single regex
+# pass and converts the captured fields straight to typed values
+REPLY_TABLE: Dict[str, Callable[[str], Dict[Any, Any]]] = {
+    "MP": _routing(ROUTING_PATTERNS["MP"]),
+    "SW": _routing(ROUTING_PATTERNS["SW"]),
+    "MUTE": _pairs(
+        re.compile(r"^MUTE (\S+) (on|off)[ \t\r]*$", re.MULTILINE),
+        str,
+        _ON_OFF.__getitem__,
+    ),
+    "EDID": _pairs(re.compile(r"^EDID in(\d+) (\d+)[ \t\r]*$", re.MULTILINE), int, int),
+    "AUTOCEC_FN": _pairs(
+        re.compile(r"^AUTOCEC_FN out(\d+) (on|off)[ \t\r]*$", re.MULTILINE),
+        int,
+        _ON_OFF.__getitem__,
+    ),
+    "AUTOCEC_D": _pairs(
+        re.compile(r"^AUTOCEC_D out(\d+) (\d+)[ \t\r]*$", re.MULTILINE), int, int
+    ),
+    "CEC_PWR": _pairs(
+        re.compile(r"^CEC_PWR (?:out)?(\d+|all) (on|off)[ \t\r]*$", re.MULTILINE),
+        _portKey,
+        _ON_OFF.__getitem__,
+    ),
+    "IR_SC": _single(re.compile(r"^IR_SC mode(\d+)[ \t\r]*$", re.MULTILINE)),
+}
+
+
+def parseValues(deviceOutput: str, verb: str) -> Dict[Any, Any]:
+    """
+    @param deviceOutput: Reply from the device (ex: "MP in1 out1\\r\\nMP in3 out2")
+    @param verb: Reply verb to read (ex: "MP")
+    @return: Typed value of every target in the reply (ex: {1: 1, 2: 3})
+    """
+    return REPLY_TABLE[verb](deviceOutput)
+
+
+def parseValue(deviceOutput: str, verb: str, key: Any = SINGLE) -> Any:
+    """
+    @param deviceOutput: Reply from the device
+    @param verb: Reply verb to read (ex: "AUTOCEC_D")
+    @param key: Target to read (ex: 2 for out2), SINGLE for replies without one
+    @return: The typed value for the target
+    """
+    values = REPLY_TABLE[verb](deviceOutput)
+    if key not in values:
+        raise ValueError(
+            "Reply {!r} has no {} value for {}".format(deviceOutput, verb, key)
+        )
+    return values[key]
+
+
+@functools.lru_cache(maxsize=ROUTING_CACHE_SIZE)
+def parseRoutingInputs(
+    deviceOutput: str, verb: str, outputs: int, inputs: int
+) -> Tuple[int, ...]:
+    """
+    @param deviceOutput: Routing reply (ex: "MP in1 out1\\r\\nMP in3 out2")
+    @param verb: Reply verb, "MP" for reads or "SW" for switches
+    @param outputs: Number of outputs on the device
+    @param inputs: Number of inputs on the device
+    @return: Input mapped to each output in order, 0 where the reply doesn't
+        say (ex: (1, 3))
+    """
+    mapped = [0] * outputs
+    for inField, outField in ROUTING_PATTERNS[verb].findall(deviceOutput):
+        inNum = int(inField)
+        if not 1 <= inNum <= inputs:
+            raise ValueError("Input number {} is out of bounds!".format(inNum))
+        if outField == "all":
+            mapped = [inNum] * outputs
+            continue
+        outNum = int(outField)
+        if not 1 <= outNum <= outputs:
+            raise ValueError("Output number {} is out of bounds!".format(outNum))
+        mapped[outNum - 1] = inNum
+    return tuple(mapped)
+
+
+def parseReply(deviceOutput: str) -> Dict[str, Dict[Any, Any]]:
+    """
+    Parse every known line of a reply, whatever its verb
+    @param deviceOutput: Reply or unsolicited lines from the device
+    @return: Typed values by reply verb and target (ex: {"MP": {1: 1, 2: 3}})
+    """
+    values = {}
+    for verb in set(PATTERN_VERB.findall(deviceOutput)):
+        parse = REPLY_TABLE.get(verb)
+        if parse is not None:
+            parsed = parse(deviceOutput)
+            if parsed:
+                values[verb] = parsed
+    return values
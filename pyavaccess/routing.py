@@ -0,0 +1,164 @@
+from array import array
+from collections.abc import Mapping
+from typing import Iterator, List, Optional, Sequence
+
+
+class RoutingTable(Mapping):
+    """
+    Input mapped to each output, stored in a fixed-size array
+
+    Behaves like a read-only {out: in} dict of the outputs whose input is
+    known, so it compares equal to the dicts routing calls used to return.
+    Lookups and updates are O(1), equality between tables compares the
+    arrays directly.
+
+    Usage:
+        routing = av.getMappings()
+        routing[1]  # input shown on output 1
+        routing.outputsFor(3)  # outputs showing input 3
+        routing.diff(previous)  # outputs whose input changed
+    """
+
+    __slots__ = ("outputs", "inputs", "_inputs", "_frozen")
+
+    def __init__(
+        self, outputs: int, inputs: int, values: Optional[Mapping] = None
+    ) -> None:
+        """
+        @param outputs: Number of outputs on the device
+        @param inputs: Number of inputs on the device
+        @param values: Known routing to start from {out: in}
+        """
+        self.outputs = outputs
+        self.inputs = inputs
+        # 0 marks an output whose input is not known
+        self._inputs = array("B" if inputs < 256 else "H", bytes(outputs))
+        self._frozen = False
+        if values:
+            for outNum, inNum in values.items():
+                self[outNum] = inNum
+
+    def _index(self, outNum: int) -> int:
+        if not 1 <= outNum <= self.outputs:
+            raise KeyError(outNum)
+        return outNum - 1
+
+    def __getitem__(self, outNum: int) -> int:
+        try:
+            inNum = self._inputs[self._index(outNum)]
+        except TypeError:
+            raise KeyError(outNum)
+        if not inNum:
+            raise KeyError(outNum)
+        return inNum
+
+    def __setitem__(self, outNum: int, inNum: int) -> None:
+        if self._frozen:
+            raise TypeError("Routing table snapshots can't be changed")
+        if not 1 <= outNum <= self.outputs:
+            raise ValueError("Output number {} is out of bounds!".format(outNum))
+        if not 1 <= inNum <= self.inputs:
+            raise ValueError("Input number {} is out of bounds!".format(inNum))
+        self._inputs[outNum - 1] = inNum
+
+    def __iter__(self) -> Iterator[int]:
+        for index, inNum in enumerate(self._inputs):
+            if inNum:
+                yield index + 1
+
+    def __len__(self) -> int:
+        return self.outputs - self._inputs.count(0)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RoutingTable):
+            return self.outputs == other.outputs and self._inputs == other._inputs
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        if not self._frozen:
+            raise TypeError("Only routing table snapshots can be hashed")
+        return hash((self.outputs, self._inputs.tobytes()))
+
+    def __repr__(self) -> str:
+        return "RoutingTable({!r})".format(dict(self.items()))
+
+    @property
+    def complete(self) -> bool:
+        """
+        @return: True if the input of every output is known
+        """
+        return 0 not in self._inputs
+
+    def fill(self, inNum: int) -> None:
+        """
+        Map one input to every output, ex: after "SET SW in3 all"
+        @param inNum: Input number
+        """
+        if self._frozen:
+            raise TypeError("Routing table snapshots can't be changed")
+        if not 1 <= inNum <= self.inputs:
+            raise ValueError("Input number {} is out of bounds!".format(inNum))
+        self._inputs = array(self._inputs.typecode, [inNum]) * self.outputs
+
+    def outputsFor(self, inNum: int) -> List[int]:
+        """
+        @param inNum: Input number
+        @return: Outputs showing the input
+        """
+        return [index + 1 for index, known in enumerate(self._inputs) if known == inNum]
+
+    def diff(self, other: Mapping) -> List[int]:
+        """
+        @param other: Routing to compare with, ex: an earlier snapshot
+        @return: Outputs whose input differs between the two, in order
+        """
+        if isinstance(other, RoutingTable) and other.outputs == self.outputs:
+            if self._inputs == other._inputs:
+                return []
+            return [
+                index + 1
+                for index, (mine, theirs) in enumerate(zip(self._inputs, other._inputs))
+                if mine != theirs
+            ]
+        return [
+            outNum
+            for outNum in range(1, self.outputs + 1)
+            if self.get(outNum) != other.get(outNum)
+        ]
+
+    @classmethod
+    def _fromInputs(
+        cls, outputs: int, inputs: int, mapped: Sequence[int]
+    ) -> "RoutingTable":
+        """
+        @param mapped: Input of each output in order, 0 where not known,
+            already checked against the port counts
+        """
+        table = cls.__new__(cls)
+        table.outputs = outputs
+        table.inputs = inputs
+        table._inputs = array("B" if inputs < 256 else "H", mapped)
+        table._frozen = False
+        return table
+
+    def _clone(self, frozen: bool) -> "RoutingTable":
+        table = RoutingTable.__new__(RoutingTable)
+        table.outputs = self.outputs
+        table.inputs = self.inputs
+        table._inputs = array(self._inputs.typecode, self._inputs)
+        table._frozen = frozen
+        return table
+
+    def snapshot(self) -> "RoutingTable":
+        """
+        @return: Frozen copy that can't be changed and can be hashed
+        """
+        return self if self._frozen else self._clone(True)
+
+    def copy(self) -> "RoutingTable":
+        """
+        @return: Copy that can be changed, even of a snapshot
+        """
+        return self._clone(False)
@@ -0,0 +1,113 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+# Outcome of each field in a SettingsReport
+APPLIED = "applied"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+# Settings keyed by port number, JSON documents give their keys as strings
+_NUMBERED_SETTINGS = ("edid", "autoCEC", "cecDelay")
+
+
+@dataclass(frozen=True)
+class MatrixSettings:
+    """
+    Desired configuration of a matrix, ex: when provisioning a new device
+
+    Only the fields listed are checked and changed, everything else is left
+    as it is.
+    """
+
+    # EDID param number of each input {in: prm}
+    edid: Dict[int, int] = field(default_factory=dict)
+    # Whether CEC auto power should be on for each output {out: on}
+    autoCEC: Dict[int, bool] = field(default_factory=dict)
+    # CEC power delay of each output in minutes {out: delay}
+    cecDelay: Dict[int, int] = field(default_factory=dict)
+    # Whether each audio output should be muted {name: muted}
+    mute: Dict[str, bool] = field(default_factory=dict)
+    # IR system code mode, None to leave it
+    irMode: Optional[int] = None
+
+    @classmethod
+    def fromDict(cls, document: Mapping[str, Any]) -> "MatrixSettings":
+        """
+        @param document: Settings as loaded from JSON, ex:
+            {"edid": {"1": 3}, "mute": {"audioout1": true}, "irMode": 2}
+        @return: Settings with port numbers as ints
+        """
+        unknown = set(document) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise ValueError("Unknown settings {}!".format(sorted(unknown)))
+        values = dict(document)
+        for setting in _NUMBERED_SETTINGS:
+            if setting in values:
+                values[setting] = {
+                    int(target): value for target, value in values[setting].items()
+                }
+        return cls(**values)
+
+    def fields(self) -> Dict[Tuple[str, Any], Any]:
+        """
+        @return: Every value to set, keyed by (setting, target), the target of
+            irMode is None
+        """
+        values: Dict[Tuple[str, Any], Any] = {}
+        for setting in ("edid", "autoCEC", "cecDelay", "mute"):
+            for target, value in getattr(self, setting).items():
+                values[(setting, target)] = value
+        if self.irMode is not None:
+            values[("irMode", None)] = self.irMode
+        return values
+
+
+@dataclass(frozen=True)
+class SettingsReport:
+    """
+    Outcome of applying settings, field by field
+    """
+
+    __slots__ = ("settings", "fields", "commands", "roundTrips")
+
+    # Settings that were applied
+    settings: MatrixSettings
+    # APPLIED, UNCHANGED or FAILED for each field {(setting, target): status}
+    fields: Dict[Tuple[str, Any], str]
+    # Commands sent, empty if nothing had to change
+    commands: List[str]
+    # Number of writes that waited on the device, reads included
+    roundTrips: int
+
+    def _withStatus(self, status: str) -> List[Tuple[str, Any]]:
+        return [
+            key for key, fieldStatus in self.fields.items() if fieldStatus == status
+        ]
+
+    @property
+    def applied(self) -> List[Tuple[str, Any]]:
+        """
+        @return: Fields that were changed and read back with the new value
+        """
+        return self._withStatus(APPLIED)
+
+    @property
+    def unchanged(self) -> List[Tuple[str, Any]]:
+        """
+        @return: Fields that already had the wanted value
+        """
+        return self._withStatus(UNCHANGED)
+
+    @property
+    def failed(self) -> List[Tuple[str, Any]]:
+        """
+        @return: Fields that were rejected or read back with another value
+        """
+        return self._withStatus(FAILED)
+
+    @property
+    def ok(self) -> bool:
+        """
+        @return: True if every field has the wanted value
+        """
+        return not self.failed
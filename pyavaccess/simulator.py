@@ -0,0 +1,269 @@
+import logging
+import re
+from typing import Callable, Dict, List, Optional
+
+from .profiles import DEVICE_PROFILES
+
+_LOGGER = logging.getLogger(__name__)
+
+# Sent for invalid commands when errorReplies is on
+ERROR_REPLY = "Command Error"
+
+EOL = b"\r\n"
+# GET VER is the only reply ending with \n\r
+DEVICE_EOL = b"\n\r"
+
+PATTERN_NUMBERED = re.compile(r"(in|out|mode)(\d+)$")
+
+
+class MatrixSimulator:
+    """
+    Protocol model of an AV Access HDMI matrix
+
+    handle() takes one command line from the host and returns the reply the
+    device would send, terminators included. Invalid commands get no reply,
+    like the real device. The port counts and "help" lines come from the
+    device profile.
+    """
+
+    def __init__(
+        self, model: str = "4KMX42-H2A", apiVersion: str = "VER 1.0.2"
+    ) -> None:
+        """
+        @param model: Device name with a profile
+        @param apiVersion: API version string in format "VER #.#.#"
+        """
+        self.model = model.upper()
+        self.apiVersion = apiVersion
+        profile = DEVICE_PROFILES.find(self.model, apiVersion)
+        self.inputs = profile.inputCount
+        self.outputs = profile.outputCount
+        self.audioOutputs = list(profile.audioOutputs)
+        self.prmEDIDCount = profile.EDIDParamCount
+        self.maxDelay = profile.maxDelayInMin
+        self.irModeCount = profile.irModeCount
+        # Commands listed by "help", one line each
+        self.helpLines = list(profile.commands)
+        # Called with unsolicited reply lines, set by the port
+        self.emit: Optional[Callable[[List[bytes]], None]] = None
+        # Answer invalid commands with ERROR_REPLY instead of ignoring them
+        self.errorReplies = False
+        self.factoryReset()
+
+    def factoryReset(self) -> None:
+        """
+        Put every setting back to its default
+        """
+        self.routing: Dict[int, int] = {
+            outNum: min(outNum, self.inputs) for outNum in range(1, self.outputs + 1)
+        }
+        self.edid: Dict[int, int] = {inNum: 1 for inNum in range(1, self.inputs + 1)}
+        self.mute: Dict[str, bool] = {name: False for name in self.audioOutputs}
+        self.autoCEC: Dict[int, bool] = {
+            outNum: False for outNum in range(1, self.outputs + 1)
+        }
+        self.cecDelay: Dict[int, int] = {
+            outNum: 1 for outNum in range(1, self.outputs + 1)
+        }
+        self.cecPower: Dict[int, bool] = {
+            outNum: True for outNum in range(1, self.outputs + 1)
+        }
+        self.irMode = 1
+
+    """ Front Panel Methods """
+
+    def frontPanelSwitch(self, inNum: int, outNum: int) -> None:
+        """
+        Change a route as if from the front panel or IR remote
+        The device reports the change without being asked
+        """
+        self.routing[outNum] = inNum
+        self._emit([self._line("SW in{} out{}".format(inNum, outNum))])
+
+    def _emit(self, lines: List[bytes]) -> None:
+        if self.emit is not None:
+            self.emit(lines)
+
+    """ Command Handling """
+
+    def handle(self, line: str) -> List[bytes]:
+        """
+        @param line: Command line from the host without line ending
+        @return: Reply lines with terminators, empty if the command is invalid
+            and errorReplies is off
+        """
+        fields = line.split()
+        try:
+            reply = self._dispatch(fields)
+        except (ValueError, KeyError, IndexError):
+            reply = None
+        if reply is None:
+            _LOGGER.debug('Simulator rejecting invalid command "%s"', line)
+            if self.errorReplies:
+                return [self._line(ERROR_REPLY)]
+            return []
+        return reply
+
+    @staticmethod
+    def _line(text: str) -> bytes:
+        return text.encode("ascii") + EOL
+
+    def _number(self, field: str, prefix: str, count: int) -> int:
+        match = PATTERN_NUMBERED.match(field)
+        if not match or match.group(1) != prefix:
+            raise ValueError(field)
+        number = int(match.group(2))
+        if number < 1 or number > count:
+            raise ValueError(field)
+        return number
+
+    @staticmethod
+    def _onOff(field: str) -> bool:
+        if field not in ("on", "off"):
+            raise ValueError(field)
+        return field == "on"
+
+    def _dispatch(self, fields: List[str]) -> Optional[List[bytes]]:
+        if fields == ["help"]:
+            return [self._line(text) for text in self.helpLines]
+        if fields == ["GET", "VER"]:
+            return [self.apiVersion.encode("ascii") + DEVICE_EOL]
+        if fields == ["RESET"]:
+            self.factoryReset()
+            return [self._line("RESET")]
+        if fields == ["REBOOT"]:
+            return [self._line("REBOOT")]
+        if fields == ["GET", "IR_SC"]:
+            return [self._line("IR_SC mode{}".format(self.irMode))]
+        if len(fields) < 3 or fields[0] not in ("GET", "SET"):
+            return None
+
+        action, name, args = fields[0], fields[1], fields[2:]
+        handler = getattr(self, "_{}_{}".format(action.lower(), name.lower()), None)
+        if handler is None:
+            return None
+        return handler(args)
+
+    """ Routing """
+
+    def _get_mp(self, args: List[str]) -> List[bytes]:
+        if args == ["all"]:
+            outNums = list(self.routing)
+        else:
+            (outField,) = args
+            outNums = [self._number(outField, "out", self.outputs)]
+        return [
+            self._line("MP in{} out{}".format(self.routing[outNum], outNum))
+            for outNum in outNums
+        ]
+
+    def _set_sw(self, args: List[str]) -> List[bytes]:
+        inField, outField = args
+        inNum = self._number(inField, "in", self.inputs)
+        if outField == "all":
+            for outNum in self.routing:
+                self.routing[outNum] = inNum
+            return [self._line("SW in{} all".format(inNum))]
+        outNum = self._number(outField, "out", self.outputs)
+        self.routing[outNum] = inNum
+        return [self._line("SW in{} out{}".format(inNum, outNum))]
+
+    """ EDID """
+
+    def _edidLines(self, inNums: List[int]) -> List[bytes]:
+        return [
+            self._line("EDID in{} {}".format(inNum, self.edid[inNum]))
+            for inNum in inNums
+        ]
+
+    def _get_edid(self, args: List[str]) -> List[bytes]:
+        (inField,) = args
+        if inField == "all":
+            return self._edidLines(list(self.edid))
+        return self._edidLines([self._number(inField, "in", self.inputs)])
+
+    def _set_edid(self, args: List[str]) -> List[bytes]:
+        inField, prmField = args
+        prmNum = int(prmField)
+        if prmNum < 1 or prmNum > self.prmEDIDCount:
+            raise ValueError(prmField)
+        inNums = (
+            list(self.edid)
+            if inField == "all"
+            else [self._number(inField, "in", self.inputs)]
+        )
+        for inNum in inNums:
+            self.edid[inNum] = prmNum
+        return self._edidLines(inNums)
+
+    """ Audio """
+
+    def _muteLines(self, names: List[str]) -> List[bytes]:
+        return [
+            self._line("MUTE {} {}".format(name, "on" if self.mute[name] else "off"))
+            for name in names
+        ]
+
+    def _get_mute(self, args: List[str]) -> List[bytes]:
+        (name,) = args
+        if name == "all":
+            return self._muteLines(self.audioOutputs)
+        if name not in self.mute:
+            raise ValueError(name)
+        return self._muteLines([name])
+
+    def _set_mute(self, args: List[str]) -> List[bytes]:
+        name, stateField = args
+        state = self._onOff(stateField)
+        names = self.audioOutputs if name == "all" else [name]
+        for audioOut in names:
+            if audioOut not in self.mute:
+                raise ValueError(audioOut)
+            self.mute[audioOut] = state
+        return self._muteLines(names)
+
+    """ CEC """
+
+    def _get_autocec_fn(self, args: List[str]) -> List[bytes]:
+        (outField,) = args
+        outNum = self._number(outField, "out", self.outputs)
+        state = "on" if self.autoCEC[outNum] else "off"
+        return [self._line("AUTOCEC_FN out{} {}".format(outNum, state))]
+
+    def _set_autocec_fn(self, args: List[str]) -> List[bytes]:
+        outField, stateField = args
+        outNum = self._number(outField, "out", self.outputs)
+        self.autoCEC[outNum] = self._onOff(stateField)
+        return [self._line("AUTOCEC_FN out{} {}".format(outNum, stateField))]
+
+    def _get_autocec_d(self, args: List[str]) -> List[bytes]:
+        (outField,) = args
+        outNum = self._number(outField, "out", self.outputs)
+        return [self._line("AUTOCEC_D out{} {}".format(outNum, self.cecDelay[outNum]))]
+
+    def _set_autocec_d(self, args: List[str]) -> List[bytes]:
+        outField, delayField = args
+        outNum = self._number(outField, "out", self.outputs)
+        delay = int(delayField)
+        if delay < 1 or delay > self.maxDelay:
+            raise ValueError(delayField)
+        self.cecDelay[outNum] = delay
+        return [self._line("AUTOCEC_D out{} {}".format(outNum, delay))]
+
+    def _set_cec_pwr(self, args: List[str]) -> List[bytes]:
+        outField, stateField = args
+        state = self._onOff(stateField)
+        if outField == "all":
+            for outNum in self.cecPower:
+                self.cecPower[outNum] = state
+            return [self._line("CEC_PWR all {}".format(stateField))]
+        outNum = self._number(outField, "out", self.outputs)
+        self.cecPower[outNum] = state
+        return [self._line("CEC_PWR out{} {}".format(outNum, stateField))]
+
+    """ IR """
+
+    def _set_ir_sc(self, args: List[str]) -> List[bytes]:
+        (modeField,) = args
+        self.irMode = self._number(modeField, "mode", self.irModeCount)
+        return [self._line("IR_SC mode{}".format(self.irMode))]
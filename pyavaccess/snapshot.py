@@ -0,0 +1,36 @@
+from dataclasses import dataclass
+from typing import Dict
+
+from .routing import RoutingTable
+
+
+@dataclass(frozen=True)
+class MatrixSnapshot:
+    """
+    Full state of an HDMI matrix, read in as few round trips as possible
+    """
+
+    __slots__ = (
+        "routing",
+        "mute",
+        "edid",
+        "autoCEC",
+        "cecDelay",
+        "elapsed",
+        "roundTrips",
+    )
+
+    # Input mapped to each output, frozen, reads like {out: in}
+    routing: RoutingTable
+    # Whether each audio output is muted {name: muted}
+    mute: Dict[str, bool]
+    # EDID param of each input {in: prm}
+    edid: Dict[int, int]
+    # Whether CEC auto power is on for each output {out: on}
+    autoCEC: Dict[int, bool]
+    # CEC power delay of each output in minutes {out: delay}
+    cecDelay: Dict[int, int]
+    # Seconds spent reading the snapshot
+    elapsed: float
+    # Number of writes that waited on the device, 0 if served from cache
+    roundTrips: int
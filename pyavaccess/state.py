@@ -0,0 +1,106 @@
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .command import AVAccessCommand
+
+# Returned when a value is not cached or has expired
+MISSING = object()
+
+
+class MatrixState:
+    """
+    Last known device state, filled from command replies
+
+    Values are keyed by (reply verb, target), ex: ("MP", 1) for the input
+    mapped to output 1 or ("MUTE", "audioout1") for whether audioout1 is muted.
+    """
+
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        @param ttl: Seconds a value is served from memory before reading it again
+        @param clock: Monotonic time source
+        """
+        self.ttl = ttl
+        self._clock = clock
+        self._values: Dict[Hashable, Tuple[Any, float]] = {}
+
+    def get(self, key: Hashable) -> Any:
+        """
+        @param key: State key
+        @return: The cached value, or MISSING if unknown or expired
+        """
+        entry = self._values.get(key)
+        if entry is None or self._clock() - entry[1] > self.ttl:
+            return MISSING
+        return entry[0]
+
+    def getMany(self, keys: Iterable[Hashable]) -> Any:
+        """
+        @param keys: State keys
+        @return: List of cached values, or MISSING if any of them is unknown or expired
+        """
+        values = []
+        for key in keys:
+            value = self.get(key)
+            if value is MISSING:
+                return MISSING
+            values.append(value)
+        return values
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        @param key: State key
+        @param value: Value reported by the device
+        """
+        self._values[key] = (value, self._clock())
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """
+        Forget a cached value
+        @param key: State key, or None to forget everything
+        """
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
+
+
+def lookupCommands(
+    state: Optional[MatrixState], commands: List[AVAccessCommand]
+) -> List[Any]:
+    """
+    Answer commands from the cache where possible
+    Reads queued after a set that writes to the cache are always sent, the
+    cached value is from before the set and may be about to change
+    @param state: Cached device state, or None if caching is off
+    @param commands: Commands about to be sent
+    @return: Cached result for each command, or MISSING if it must be sent
+    """
+    if state is None:
+        return [MISSING] * len(commands)
+    results = []
+    written = False
+    for command in commands:
+        if command.readState is None or written:
+            results.append(MISSING)
+        else:
+            results.append(command.readState(state))
+        if command.writeState is not None and not command.isQuery:
+            written = True
+    return results
+
+
+def recordCommands(
+    state: Optional[MatrixState], commands: List[AVAccessCommand], results: List[Any]
+) -> None:
+    """
+    Write the parsed replies of sent commands through to the cache
+    @param state: Cached device state, or None if caching is off
+    @param commands: Commands that were sent
+    @param results: Parsed result of each command
+    """
+    if state is None:
+        return
+    for command, result in zip(commands, results):
+        if command.writeState is not None:
+            command.writeState(state, result)
@@ -0,0 +1 @@
+# pyserial url handlers, registered in serial.protocol_handler_packages on import of pyavaccess
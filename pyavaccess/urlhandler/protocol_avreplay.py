@@ -0,0 +1,165 @@
+"""
+pyserial url handler playing back a traffic capture, see pyavaccess.capture
+
+    avreplay://<capture file>[?option=value&...]
+
+Each write is matched with the next write in the capture and answered with
+the bytes the device sent after it, at the same delay. Writes past the end
+of the capture get no reply, like a device that went away. Where the capture
+has the port closed and reopened, ex: a reconnect, reads fail once the bytes
+sent before it are used up, and reopening the port carries on from there.
+Use an absolute path with three slashes: avreplay:///var/log/matrix.avcap
+
+Options:
+    speed       Playback speed, 2 replies twice as fast, 0 replies as fast as
+                possible (default 1)
+    strict      Raise an error when a write differs from the captured one
+                (default 1)
+"""
+
+import time
+import urllib.parse as urlparse
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Tuple
+
+from serial.serialutil import PortNotOpenError, SerialException
+
+from ..capture import CLOSED, OPENED, READ, WRITTEN, readCapture
+from . import protocol_avsim
+
+# Bytes read after a write and their delay in seconds
+_Reads = List[Tuple[float, bytes]]
+
+
+@dataclass
+class _Exchange:
+    """
+    One write in the capture and what followed it
+    """
+
+    written: bytes
+    reads: _Reads
+    # Reads after the port was closed and reopened, None if it stayed open
+    reopenReads: Optional[_Reads] = None
+
+
+class Serial(protocol_avsim.Serial):
+    """
+    Serial port answering from a capture instead of a device
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.speed = 1.0
+        self.strict = True
+        # Reads before the first write, then each write and the reads it got
+        self._opening: _Reads = []
+        self._exchanges: Deque[_Exchange] = deque()
+        # Reads after the port is reopened, set once the capture has it closed
+        self._reopenReads: Optional[_Reads] = None
+        self._path = ""
+        super().__init__(*args, **kwargs)
+
+    def open(self) -> None:
+        super().open()
+        reads = self._reopenReads
+        if reads is None:
+            # Play the capture from the start
+            try:
+                self._load(self._path)
+            except (OSError, ValueError) as exc:
+                self.close()
+                raise SerialException("Could not load capture: {}".format(exc))
+            reads = self._opening
+        self._reopenReads = None
+        self._queueReads(reads)
+
+    def from_url(self, url: str) -> None:
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "avreplay":
+            raise SerialException(
+                'expected a string in the form "avreplay://<file>[?option=value]"'
+            )
+        options = {
+            option: values[0]
+            for option, values in urlparse.parse_qs(parts.query, True).items()
+        }
+        try:
+            self.speed = float(options.pop("speed", 1))
+            if self.speed < 0:
+                raise ValueError("speed must not be negative")
+            self.strict = options.pop("strict", "1") not in ("0", "false", "")
+        except ValueError as exc:
+            raise SerialException("Invalid avreplay option: {}".format(exc))
+        if options:
+            raise SerialException(
+                "Unknown avreplay options: {}".format(sorted(options))
+            )
+
+        self._path = urlparse.unquote(parts.netloc + parts.path)
+
+    def _load(self, path: str) -> None:
+        self._opening = []
+        self._exchanges.clear()
+        reads = self._opening
+        exchange: Optional[_Exchange] = None
+        writtenAt = 0.0
+        portClosed = False
+        for record in readCapture(path):
+            if record.kind == WRITTEN:
+                reads = []
+                exchange = _Exchange(record.data, reads)
+                self._exchanges.append(exchange)
+                writtenAt = record.at
+            elif record.kind == READ:
+                reads.append((max(record.at - writtenAt, 0.0), record.data))
+            elif record.kind == CLOSED:
+                # The port closing has its url, the end of a session has none
+                portClosed = bool(record.data)
+            elif record.kind == OPENED:
+                if portClosed and exchange is not None:
+                    reads = exchange.reopenReads = []
+                portClosed = False
+                # Times restart with every capture session and reopened port
+                writtenAt = record.at
+
+    def _queueReads(self, reads: _Reads) -> None:
+        """
+        Schedule captured reads relative to now, scaled by the playback speed
+        """
+        with self._cond:
+            now = time.monotonic()
+            # Replies still on their way from the last write come first
+            readyAt = max(now, self._rx[-1][0]) if self._rx else now
+            for delay, data in reads:
+                if self.speed:
+                    readyAt = max(readyAt, now + delay / self.speed)
+                self._rx.append((readyAt, data))
+            self._cond.notify_all()
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytes(data)
+        with self._cond:
+            if not self._exchanges:
+                return len(data)
+            exchange = self._exchanges.popleft()
+        if self.strict and data != exchange.written:
+            raise SerialException(
+                "Capture has {!r} written next, not {!r}".format(
+                    exchange.written, data
+                )
+            )
+        self._queueReads(exchange.reads)
+        self._reopenReads = exchange.reopenReads
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        if self._reopenReads is not None:
+            # Only the bytes sent before the capture has the port closed
+            with self._cond:
+                size = min(size, sum(len(data) for readyAt, data in self._rx))
+            if not size:
+                raise SerialException("Capture has the port closed here")
+        return super().read(size)
@@ -0,0 +1,203 @@
+"""
+pyserial url handler for the in-process AV Access matrix simulator
+
+    avsim://4kmx42[?option=value&...]
+
+Options:
+    version         API version reported by GET VER (default 1.0.2)
+    latency_ms      Delay before each reply line is available (default 0)
+    byte_us         Extra delay per reply byte (default 0)
+    drop            Probability of dropping each reply byte (default 0)
+    timeout         Probability of ignoring a command entirely (default 0)
+    errors          Reply to invalid commands with an error line instead of
+                    ignoring them like the 4KMX42-H2A does (default 0)
+    seed            Seed for the fault injection random numbers
+"""
+
+import random
+import threading
+import time
+import urllib.parse as urlparse
+from collections import deque
+from typing import Deque, List, Tuple
+
+from serial.serialutil import PortNotOpenError, SerialBase, SerialException
+
+from ..profiles import DEVICE_PROFILES
+from ..simulator import MatrixSimulator
+
+
+def _findModel(name: str, apiVersion: str) -> str:
+    """
+    @param name: Full or leading part of a device name (ex: "4kmx42")
+    @return: Device name with a profile for the version
+    """
+    try:
+        models = DEVICE_PROFILES.models(apiVersion)
+    except ValueError:
+        models = []
+    if not models:
+        raise SerialException("Unknown simulator version {!r}".format(apiVersion))
+    name = name.upper()
+    for model in models:
+        if model == name or model.startswith(name):
+            return model
+    raise SerialException("Unknown simulator model {!r}".format(name))
+
+
+class Serial(SerialBase):
+    """
+    Serial port backed by a MatrixSimulator instead of a device
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.simulator = None
+        self._cond = threading.Condition()
+        # Reply bytes and the time they reach the host
+        self._rx: Deque[Tuple[float, bytes]] = deque()
+        self._tx = bytearray()
+        # Time the device finishes sending its last queued reply
+        self._busyUntil = 0.0
+        self.lineLatency = 0.0
+        self.byteLatency = 0.0
+        self.dropRate = 0.0
+        self.timeoutRate = 0.0
+        self._random = random.Random()
+        super().__init__(*args, **kwargs)
+
+    def open(self) -> None:
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self.from_url(self._port)
+        self.is_open = True
+        self.reset_input_buffer()
+
+    def close(self) -> None:
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+        super().close()
+
+    def _reconfigure_port(self) -> None:
+        # Line settings have no effect on the simulator
+        pass
+
+    def from_url(self, url: str) -> None:
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "avsim":
+            raise SerialException(
+                'expected a string in the form "avsim://<model>[?option=value]"'
+            )
+        options = {
+            option: values[0]
+            for option, values in urlparse.parse_qs(parts.query, True).items()
+        }
+        try:
+            apiVersion = "VER {}".format(options.pop("version", "1.0.2"))
+            model = _findModel(parts.netloc or "4KMX42", apiVersion)
+            self.lineLatency = float(options.pop("latency_ms", 0)) / 1000
+            self.byteLatency = float(options.pop("byte_us", 0)) / 1000000
+            self.dropRate = float(options.pop("drop", 0))
+            self.timeoutRate = float(options.pop("timeout", 0))
+            errorReplies = options.pop("errors", "0") not in ("0", "false", "")
+            if "seed" in options:
+                self._random.seed(int(options.pop("seed")))
+        except ValueError as exc:
+            raise SerialException("Invalid avsim option: {}".format(exc))
+        if options:
+            raise SerialException("Unknown avsim options: {}".format(sorted(options)))
+
+        self.simulator = MatrixSimulator(model, apiVersion)
+        self.simulator.errorReplies = errorReplies
+        self.simulator.emit = self._queueReply
+
+    """ Device Side """
+
+    def _queueReply(self, lines: List[bytes]) -> None:
+        """
+        Schedule reply lines to reach the host after the configured latency
+        """
+        with self._cond:
+            readyAt = max(time.monotonic(), self._busyUntil)
+            for line in lines:
+                if self.dropRate:
+                    line = bytes(
+                        byte for byte in line if self._random.random() >= self.dropRate
+                    )
+                readyAt += self.lineLatency + self.byteLatency * len(line)
+                self._rx.append((readyAt, line))
+            self._busyUntil = readyAt
+            self._cond.notify_all()
+
+    def _readyBytes(self) -> int:
+        now = time.monotonic()
+        return sum(len(data) for readyAt, data in self._rx if readyAt <= now)
+
+    """ Host Side """
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            return self._readyBytes()
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise PortNotOpenError()
+        deadline = None if self._timeout is None else time.monotonic() + self._timeout
+        data = bytearray()
+        with self._cond:
+            while len(data) < size:
+                now = time.monotonic()
+                # Move every byte that has arrived into the result
+                while self._rx and self._rx[0][0] <= now and len(data) < size:
+                    readyAt, chunk = self._rx.popleft()
+                    take = size - len(data)
+                    data += chunk[:take]
+                    if len(chunk) > take:
+                        self._rx.appendleft((readyAt, chunk[take:]))
+                if len(data) >= size or not self.is_open:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+
+                # Sleep until the next byte arrives or the timeout passes
+                wait = None if deadline is None else deadline - now
+                if self._rx:
+                    untilReady = self._rx[0][0] - now
+                    wait = untilReady if wait is None else min(wait, untilReady)
+                self._cond.wait(wait)
+        return bytes(data)
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise PortNotOpenError()
+        data = bytes(data)
+        self._tx += data
+        while b"\r\n" in self._tx:
+            line, _, rest = bytes(self._tx).partition(b"\r\n")
+            self._tx = bytearray(rest)
+            if self.timeoutRate and self._random.random() < self.timeoutRate:
+                continue
+            self._queueReply(self.simulator.handle(line.decode("ascii", "replace")))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        # Replies still on their way are not affected, like a real port
+        if not self.is_open:
+            raise PortNotOpenError()
+        with self._cond:
+            now = time.monotonic()
+            while self._rx and self._rx[0][0] <= now:
+                self._rx.popleft()
+
+    def reset_output_buffer(self) -> None:
+        if not self.is_open:
+            raise PortNotOpenError()
+        self._tx.clear()
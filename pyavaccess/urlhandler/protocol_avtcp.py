@@ -0,0 +1,130 @@
+"""
+pyserial url handler for AV Access devices behind serial-to-Ethernet gateways
+
+    avtcp://<host>:<port>[?option=value&...]
+
+Works like socket://, tuned for short command/reply traffic: Nagle's
+algorithm is off so each command leaves immediately, and TCP keepalive is on
+so a half-open connection to a gateway that went away raises an error
+instead of hanging until the command times out. Closing does not pause, the
+matrix backs off between reconnect attempts itself.
+
+Options:
+    keepalive           Seconds of silence before the first keepalive probe,
+                        0 turns keepalive off (default 10)
+    keepalive_interval  Seconds between unanswered probes (default 5)
+    keepalive_count     Unanswered probes before the connection is dropped
+                        (default 3)
+    connect_timeout     Seconds to wait for the gateway to accept the
+                        connection (default 5)
+"""
+
+import socket
+import urllib.parse as urlparse
+from typing import Tuple
+
+from serial.serialutil import SerialException
+from serial.urlhandler import protocol_socket
+
+KEEPALIVE_IDLE = 10
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+CONNECT_TIMEOUT = 5
+
+
+class Serial(protocol_socket.Serial):
+    """
+    TCP connection to a serial gateway with low latency and dead peer detection
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.keepaliveIdle = KEEPALIVE_IDLE
+        self.keepaliveInterval = KEEPALIVE_INTERVAL
+        self.keepaliveCount = KEEPALIVE_COUNT
+        self.connectTimeout = CONNECT_TIMEOUT
+        super().__init__(*args, **kwargs)
+
+    def open(self) -> None:
+        self.logger = None
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        address = self.from_url(self.portstr)
+        try:
+            self._socket = socket.create_connection(
+                address, timeout=self.connectTimeout
+            )
+        except OSError as exc:
+            self._socket = None
+            raise SerialException(
+                "Could not open port {}: {}".format(self.portstr, exc)
+            )
+        self._configureSocket(self._socket)
+        # Reads and writes go through select, like socket://
+        self._socket.setblocking(False)
+        self.is_open = True
+        self.reset_input_buffer()
+        self.reset_output_buffer()
+
+    def _configureSocket(self, sock: socket.socket) -> None:
+        """
+        Turn off Nagle's algorithm and turn on keepalive probes
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if not self.keepaliveIdle:
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Probe timing options differ between platforms, set the ones we have
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepaliveIdle)
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, self.keepaliveIdle
+            )
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, self.keepaliveInterval
+            )
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, self.keepaliveCount)
+
+    def close(self) -> None:
+        if self.is_open:
+            if self._socket:
+                try:
+                    self._socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                self._socket.close()
+                self._socket = None
+            self.is_open = False
+
+    def from_url(self, url: str) -> Tuple[str, int]:
+        """
+        @param url: avtcp://<host>:<port>[?option=value&...]
+        @return: (host, port) to connect to
+        """
+        parts = urlparse.urlsplit(url)
+        if parts.scheme != "avtcp":
+            raise SerialException(
+                'expected a string in the form "avtcp://<host>:<port>[?option=value]"'
+            )
+        options = {
+            option: values[0]
+            for option, values in urlparse.parse_qs(parts.query, True).items()
+        }
+        try:
+            self.keepaliveIdle = int(options.pop("keepalive", KEEPALIVE_IDLE))
+            self.keepaliveInterval = int(
+                options.pop("keepalive_interval", KEEPALIVE_INTERVAL)
+            )
+            self.keepaliveCount = int(options.pop("keepalive_count", KEEPALIVE_COUNT))
+            self.connectTimeout = float(options.pop("connect_timeout", CONNECT_TIMEOUT))
+            if parts.hostname is None or parts.port is None:
+                raise ValueError("host and port are required")
+        except ValueError as exc:
+            raise SerialException("Invalid avtcp url {!r}: {}".format(url, exc))
+        if options:
+            raise SerialException("Unknown avtcp options: {}".format(sorted(options)))
+        return parts.hostname, parts.port
@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+from typing import List
+
+import pytest
+
+from pyavaccess.profiles import PROFILE_DIR, DeviceProfile, ProfileRegistry
+from pyavaccess.simulator import ERROR_REPLY
+
+# Canned replies from a 4KMX42-H2A, keyed by command
+REPLIES = {
+    b"GET VER": b"VER 1.0.2\n\r",
+    b"GET MP all": b"MP in1 out1\r\nMP in3 out2\r\n",
+    b"GET MP out1": b"MP in1 out1\r\n",
+    b"SET SW in4 out1": b"SW in4 out1\r\n",
+    b"SET SW in2 all": b"SW in2 all\r\n",
+    b"GET MUTE audioout1": b"MUTE audioout1 off\r\n",
+    b"SET MUTE audioout1 on": b"MUTE audioout1 on\r\n",
+    b"GET MUTE all": (
+        b"MUTE hdmiaudioout1 off\r\nMUTE hdmiaudioout2 off\r\n"
+        b"MUTE audioout1 on\r\nMUTE spdifaudioout2 off\r\n"
+    ),
+    b"GET EDID all": b"EDID in1 1\r\nEDID in2 1\r\nEDID in3 4\r\nEDID in4 1\r\n",
+    b"GET AUTOCEC_FN out1": b"AUTOCEC_FN out1 off\r\n",
+    b"GET AUTOCEC_FN out2": b"AUTOCEC_FN out2 on\r\n",
+    b"GET AUTOCEC_D out1": b"AUTOCEC_D out1 2\r\n",
+    b"GET AUTOCEC_D out2": b"AUTOCEC_D out2 15\r\n",
+    b"REBOOT": b"REBOOT\r\n",
+}
+
+
+class PtyDevice:
+    """
+    Pseudo terminal standing in for the serial port of a device
+    """
+
+    def __init__(self) -> None:
+        self._master, self._slave = os.openpty()
+        self.url = os.ttyname(self._slave)
+        # Every command line the device received, in order
+        self.received: List[bytes] = []
+        threading.Thread(target=self._serveReplies, daemon=True).start()
+
+    def _serveReplies(self) -> None:
+        """
+        Answer commands written to the pty like the device would
+        """
+        pending = b""
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            pending += data
+            while b"\r\n" in pending:
+                line, pending = pending.split(b"\r\n", 1)
+                self.received.append(line)
+                if line in REPLIES:
+                    os.write(self._master, REPLIES[line])
+
+    def emit(self, data: bytes) -> None:
+        """
+        Send bytes to the host without being asked, ex: a front panel change
+        """
+        os.write(self._master, data)
+
+    def close(self) -> None:
+        os.close(self._slave)
+        os.close(self._master)
+
+
+@pytest.fixture
+def ptyDevice():
+    """
+    Fake device behind a pseudo terminal, no device required
+    """
+    device = PtyDevice()
+    yield device
+    device.close()
+
+
+@pytest.fixture
+def ptyUrl(ptyDevice):
+    """
+    Url of the fake device's port
+    """
+    return ptyDevice.url
+
+
+@pytest.fixture
+def errorProfiles():
+    """
+    Profiles where the 4KMX42-H2A rejects commands with the simulator's error
+    line, the shipped profile declares no error replies
+    """
+    with open(os.path.join(PROFILE_DIR, "4kmx42-h2a.json"), encoding="utf-8") as file:
+        config = json.load(file)
+    registry = ProfileRegistry()
+    registry.add(DeviceProfile(**{**config, "errorReplies": [ERROR_REPLY]}))
+    return registry
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+import serial
+
+from pyavaccess import AsyncHDMIMatrix, MetricsRecorder
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_asyncCommands(ptyUrl):
+    """
+    Test getters and setters are awaitable and parsed like the blocking client
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(ptyUrl, AV_DEVICE) as matrix:
+            assert matrix.apiVersion == "VER 1.0.2"
+            assert await matrix.getMappings() == {1: 1, 2: 3}
+            assert await matrix.mapOutput(1, 4) == {1: 4}
+
+    asyncio.run(run())
+
+
+def test_asyncTimeoutCancels(ptyUrl):
+    """
+    Test an unanswered command times out without blocking the loop
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(ptyUrl, AV_DEVICE, timeout=0.2) as matrix:
+            with pytest.raises(ValueError):
+                matrix.getMapping(matrix.outputs + 1)
+            with pytest.raises(serial.SerialTimeoutException):
+                await matrix.getIR_SC()
+
+    asyncio.run(run())
+
+
+def test_asyncRecovery():
+    """
+    Test a reply cut short is retried and a dropped connection reopened like
+    the blocking client does, and each exchange is seen by the observers
+    """
+    metrics = MetricsRecorder()
+    observed = []
+
+    async def run():
+        matrix = AsyncHDMIMatrix(SIM_URL, AV_DEVICE, instrumentation=metrics)
+        async with matrix:
+            matrix._replyObservers.append(
+                lambda commands, outputs, parsed: observed.append(parsed)
+            )
+            simulator = matrix._port.simulator
+            handle = simulator.handle
+            received = []
+
+            def noisyHandle(line):
+                received.append(line)
+                if line == "GET MP all" and received.count(line) == 1:
+                    return [b"MP in1 out1\r\n", b"MP in2 o"]
+                return handle(line)
+
+            simulator.handle = noisyHandle
+            reply = await matrix._SendData("GET MP all", lineCount=2, timeout=0.1)
+            assert reply == "MP in1 out1\r\nMP in2 out2"
+            assert received == ["GET MP all", "GET VER", "GET MP all"]
+
+            port = matrix._port
+            write = port.write
+
+            def droppingWrite(data):
+                port.write = write
+                raise serial.SerialException("Device went away")
+
+            port.write = droppingWrite
+            assert await matrix.mapOutput(1, 3) == {1: 3}
+            assert port.is_open
+
+    asyncio.run(run())
+    assert metrics.snapshot()["GET MP"]["retries"] == 1
+    assert metrics.snapshot()["SET SW"]["retries"] == 1
+    assert observed == [[{1: 3}]]
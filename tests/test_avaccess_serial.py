@@ -0,0 +1,44 @@
+from pyavaccess.avaccess_serial import AVAccessSerial, _ReplyFramer
+
+# loop:// echoes everything written back to the reader, no device required
+LOOP_URL = "loop://"
+
+
+def test_framerSplitTerminator():
+    """
+    Test a terminator split across two chunks is still counted
+    """
+    framer = _ReplyFramer()
+    framer.begin(lineCount=2)
+    framer.feed(b"MP in1 out1\r")
+    assert framer.poll() is None
+    framer.feed(b"\nMP in2 out2\r")
+    assert framer.poll() is None
+    framer.feed(b"\nleftover")
+    assert framer.poll() == b"MP in1 out1\r\nMP in2 out2\r\n"
+
+    # Bytes past the reply stay buffered for the next one
+    framer.begin()
+    framer.feed(b"\r\n")
+    assert framer.poll() == b"leftover\r\n"
+
+
+def test_framerDeviceEOL():
+    """
+    Test replies terminated with \\n\\r (ex: GET VER)
+    """
+    framer = _ReplyFramer()
+    framer.begin(useDeviceEOL=True)
+    framer.feed(b"VER 1.0.2\r\n")
+    assert framer.poll() is None
+    framer.feed(b"\n\r")
+    assert framer.poll() == b"VER 1.0.2\r\n\n\r"
+
+
+def test_sendDataChunked():
+    """
+    Test a reply is read back over a loopback port
+    """
+    port = AVAccessSerial(LOOP_URL)
+    # The loopback echoes the command line itself as the first line
+    assert port._SendData("help", lineCount=1) == "help"
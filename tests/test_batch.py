@@ -0,0 +1,42 @@
+import asyncio
+
+from pyavaccess import AsyncHDMIMatrix, HDMIMatrixSerial
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_batchResultsInOrder(ptyUrl):
+    """
+    Test queued commands come back parsed and in the order they were queued
+    """
+    matrix = HDMIMatrixSerial(ptyUrl, AV_DEVICE)
+
+    with matrix.batch() as batch:
+        assert batch.getMapping(1) == 0
+        assert batch.getMuteStatus("audioout1") == 1
+        assert batch.getAutoCECStatus(2) == 2
+        assert batch.getMappings() == 3
+
+    assert batch.results == [
+        1,
+        False,
+        True,
+        {1: 1, 2: 3},
+    ]
+    # The queue is emptied once sent
+    assert len(batch) == 0
+
+
+def test_asyncBatch(ptyUrl):
+    """
+    Test a batch on the asyncio client
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(ptyUrl, AV_DEVICE) as matrix:
+            batch = matrix.batch()
+            batch.getMappings()
+            batch.mapOutput(1, 4)
+            return await batch.execute()
+
+    assert asyncio.run(run()) == [{1: 1, 2: 3}, {1: 4}]
@@ -0,0 +1,152 @@
+import os
+import queue
+import time
+
+import pytest
+import serial
+
+from pyavaccess import (
+    CommandTimeout,
+    DeviceErrorReply,
+    HDMIMatrixSerial,
+    MatrixPoller,
+    MatrixPreset,
+    MatrixSettings,
+)
+from pyavaccess.broker import HDMIMatrixClient, MatrixBroker
+from pyavaccess.command import AVAccessCommand
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+@pytest.fixture
+def broker(tmp_path, errorProfiles):
+    matrix = HDMIMatrixSerial(
+        "avsim://4kmx42?errors=1", AV_DEVICE, registry=errorProfiles
+    )
+    broker = MatrixBroker(matrix, str(tmp_path / "matrix.sock"))
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+def test_clientSameMethods(broker):
+    """
+    Test the client has the matrix's getters, setters, batches, snapshots,
+    presets and settings, behind a socket only its owner can open
+    """
+    assert os.stat(broker.path).st_mode & 0o777 == 0o600
+    with HDMIMatrixClient(broker.path) as av:
+        assert av.model == AV_DEVICE
+        assert av.apiVersion == "VER 1.0.2"
+        assert av.getMappings() == {1: 1, 2: 2}
+        assert av.mapOutput(2, 4) == {2: 4}
+        assert av.setMuteStatus("audioout1", True) is True
+        with av.batch() as batch:
+            batch.getMapping(2)
+            batch.getCECDelay(1)
+        assert batch.results == [4, 1]
+        assert av.snapshot().routing == {1: 1, 2: 4}
+        assert av.applyPreset(MatrixPreset(routing={1: 3})).commands == [
+            "SET SW in3 out1"
+        ]
+        assert av.applySettings(MatrixSettings(irMode=2)).applied == [("irMode", None)]
+
+        with pytest.raises(ValueError):
+            av.mapOutput(3, 1)
+        with pytest.raises(DeviceErrorReply):
+            av._Run(AVAccessCommand("GET MP out9"))
+
+
+def test_brokerCachesReads(broker):
+    """
+    Test fresh reads are answered from the matrix's state cache, and client
+    writes update it and reach the matrix's poller
+    """
+    first = HDMIMatrixClient(broker.path)
+    second = HDMIMatrixClient(broker.path)
+    matrix = broker.matrix
+    poller = MatrixPoller(matrix, {"mapping": 60.0})
+    events = []
+    poller.subscribe(events.append)
+    poller.poll()
+    startRoundTrips = matrix.roundTrips
+
+    assert first.getMappings() == {1: 1, 2: 2}
+    assert second.getMappings() == {1: 1, 2: 2}
+    assert matrix.roundTrips == startRoundTrips + 1
+
+    second.mapAllOutputs(3)
+    assert matrix.getMappings() == {1: 3, 2: 3}
+    assert [(event.target, event.value) for event in events] == [(1, 3), (2, 3)]
+    assert matrix.roundTrips == startRoundTrips + 2
+    # The earlier reply no longer matches the cache, the device is read again
+    assert first.getMappings() == {1: 3, 2: 3}
+    assert matrix.roundTrips == startRoundTrips + 3
+
+    matrix.mapOutput(2, 4)
+    assert first.getMapping(2) == 4
+    assert matrix.roundTrips == startRoundTrips + 5
+    first.close()
+    second.close()
+
+
+def test_clientEvents(broker):
+    """
+    Test state changes from the device are pushed to subscribed clients
+    """
+    events = queue.Queue()
+    with HDMIMatrixClient(broker.path) as av:
+        av.subscribe(events.put)
+        broker.matrix._port.simulator.frontPanelSwitch(3, 1)
+
+        event = events.get(timeout=5)
+        assert (event.kind, event.target, event.value) == ("mapping", 1, 3)
+        assert av.getMapping(1) == 3
+
+
+def test_brokerRestartsListener(broker):
+    """
+    Test the broker starts listening again after the connection drops
+    """
+    matrix = broker.matrix
+    listener = matrix._listener
+    port = matrix._port
+    read = port.read
+
+    def failingRead(size=1):
+        port.read = read
+        raise serial.SerialException("Gateway went away")
+
+    startRoundTrips = matrix.roundTrips
+    port.read = failingRead
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if matrix.roundTrips > startRoundTrips and listener.running:
+            break
+        time.sleep(0.01)
+    assert matrix._listener is listener
+
+    events = queue.Queue()
+    with HDMIMatrixClient(broker.path) as av:
+        av.subscribe(events.put)
+        port.simulator.frontPanelSwitch(4, 2)
+        event = events.get(timeout=5)
+        assert (event.kind, event.target, event.value) == ("mapping", 2, 4)
+
+
+def test_clientTimesOut(broker, monkeypatch):
+    """
+    Test a client gives up on a broker that doesn't answer and reconnects
+    for the next request
+    """
+    run = broker.run
+    monkeypatch.setattr(broker, "run", lambda *args: time.sleep(1) or run(*args))
+    with HDMIMatrixClient(broker.path, timeout=0.2) as av:
+        started = time.monotonic()
+        with pytest.raises(CommandTimeout):
+            av.getMappings()
+        assert time.monotonic() - started < 0.9
+
+        monkeypatch.setattr(broker, "run", run)
+        assert av.getMappings() == {1: 1, 2: 2}
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+import serial
+
+from pyavaccess import HDMIMatrixSerial
+from pyavaccess.capture import CLOSED, OPENED, READ, WRITTEN, readCapture
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def recordSession(path: str) -> HDMIMatrixSerial:
+    """
+    Capture a short session with a slow simulated device
+    """
+    matrix = HDMIMatrixSerial("avsim://4kmx42?latency_ms=20", AV_DEVICE, lazy=True)
+    matrix.startCapture(path)
+    assert matrix.getMappings() == {1: 1, 2: 2}
+    assert matrix.mapOutput(1, 3) == {1: 3}
+    matrix.stopCapture()
+    return matrix
+
+
+def test_captureAndReplay(tmp_path):
+    """
+    Test a capture holds the traffic and plays back with or without its timing
+    """
+    path = str(tmp_path / "session.avcap")
+    recordSession(path)
+
+    records = list(readCapture(path))
+    assert records[0].kind == OPENED
+    assert records[0].data == b"avsim://4kmx42?latency_ms=20"
+    assert records[-1].kind == CLOSED
+    written = [record.data for record in records if record.kind == WRITTEN]
+    assert written == [b"GET VER\r\n", b"GET MP all\r\n", b"SET SW in3 out1\r\n"]
+    # GET VER is answered with the device's \n\r line ending
+    replies = b"".join(record.data for record in records if record.kind == READ)
+    assert replies.startswith(b"VER 1.0.2\n\r")
+
+    for speed, slowest in (("1", 0.04), ("0", 0.0)):
+        replay = HDMIMatrixSerial(
+            "avreplay://{}?speed={}".format(path, speed), AV_DEVICE
+        )
+        assert replay.apiVersion == "VER 1.0.2"
+        started = time.monotonic()
+        assert replay.getMappings() == {1: 1, 2: 2}
+        assert time.monotonic() - started >= slowest
+        assert replay.mapOutput(1, 3) == {1: 3}
+
+    # A capture cut short ends at the last complete record
+    with open(path, "rb+") as file:
+        file.truncate(file.seek(0, 2) - 1)
+    assert list(readCapture(path)) == records[:-1]
+
+
+def test_replayRejectsOtherTraffic(tmp_path):
+    """
+    Test strict replay refuses writes that differ from the capture
+    """
+    path = str(tmp_path / "session.avcap")
+    recordSession(path)
+
+    replay = HDMIMatrixSerial(
+        "avreplay://{}?speed=0".format(path), AV_DEVICE, reconnectAttempts=0
+    )
+    with pytest.raises(serial.SerialException):
+        replay.mapOutput(2, 4)
+
+    loose = HDMIMatrixSerial("avreplay://{}?speed=0&strict=0".format(path), AV_DEVICE)
+    # Without strict, each write gets the next captured reply whatever it is
+    reply = loose._SendData("GET MP out1", lineCount=2)
+    assert reply == "MP in1 out1\r\nMP in2 out2"
+
+
+def test_captureReconnect(tmp_path, caplog):
+    """
+    Test a reconnect is logged with the port's url and recorded, so the
+    replay drops the connection at the same point and stays in step
+    """
+    path = str(tmp_path / "session.avcap")
+    matrix = HDMIMatrixSerial("avsim://4kmx42", AV_DEVICE, lazy=True)
+    matrix.startCapture(path)
+    assert matrix._port.port == "avsim://4kmx42"
+    assert matrix.getMappings() == {1: 1, 2: 2}
+    port = matrix._port._wrapped
+    write = port.write
+
+    def droppingWrite(data):
+        # The connection drops under the capture, once
+        port.write = write
+        raise serial.SerialException("Device went away")
+
+    port.write = droppingWrite
+    assert matrix.mapOutput(1, 3) == {1: 3}
+    assert matrix.getMapping(1) == 3
+    matrix.stopCapture()
+    assert "Lost connection to avsim://4kmx42" in caplog.text
+
+    # The lazy port opens after the session starts, then the dropped write
+    # is followed by the port closing, opening and the write sent again
+    kinds = b"".join(record.kind for record in readCapture(path))
+    assert kinds.startswith(OPENED + OPENED + WRITTEN)
+    assert WRITTEN + CLOSED + OPENED + WRITTEN in kinds
+
+    replay = HDMIMatrixSerial("avreplay://{}?speed=0".format(path), AV_DEVICE)
+    assert replay.getMappings() == {1: 1, 2: 2}
+    assert replay.mapOutput(1, 3) == {1: 3}
+    assert replay.getMapping(1) == 3
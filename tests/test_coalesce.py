@@ -0,0 +1,62 @@
+from concurrent.futures import Future
+
+from pyavaccess import HDMIMatrixSerial, MetricsRecorder
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_coalesceSameTarget():
+    """
+    Test writes to the same target collapse to the latest value
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, instrumentation=metrics)
+
+    with matrix.coalescing(window=10) as avWrites:
+        mappings = [avWrites.mapOutput(1, inNum) for inNum in (2, 3, 4)]
+        delays = [avWrites.setCECDelay(2, delay) for delay in range(1, 31)]
+        avWrites.mapOutput(2, 1)
+        assert isinstance(mappings[0], Future)
+        assert not mappings[0].done()
+
+    # Every caller gets the reply to the value that was sent
+    assert [future.result(timeout=5) for future in mappings] == [{1: 4}] * 3
+    assert {future.result(timeout=5) for future in delays} == {30}
+    assert avWrites.coalesced == 31
+    assert metrics.snapshot()["SET SW"]["commands"] == 2
+    assert metrics.snapshot()["SET AUTOCEC_D"]["commands"] == 1
+    assert matrix.getMappings() == {1: 4, 2: 1}
+
+
+def test_coalesceWindowAndReads():
+    """
+    Test pending writes are sent when the window ends or before a read
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+
+    with matrix.coalescing(window=0.05) as avWrites:
+        muted = avWrites.setMuteStatus("audioout1", True)
+        assert muted.result(timeout=5) is True
+
+        avWrites.mapAllOutputs(3)
+        mapping = avWrites.mapOutput(1, 2)
+        startRoundTrips = matrix.roundTrips
+        # The read goes out with the pending writes, after them
+        assert avWrites.getMappings().result(timeout=5) == {1: 2, 2: 3}
+        assert mapping.result(timeout=5) == {1: 2}
+        assert matrix.roundTrips == startRoundTrips + 1
+
+
+def test_coalesceReadsSeePendingWrites():
+    """
+    Test a read sent with pending writes returns their result, not the value
+    cached before them
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, cacheTTL=60)
+    matrix.mapAllOutputs(4)
+
+    with matrix.coalescing(window=10) as avWrites:
+        mapping = avWrites.mapOutput(1, 2)
+        assert avWrites.getMappings().result(timeout=5) == {1: 2, 2: 4}
+        assert mapping.result(timeout=5) == {1: 2}
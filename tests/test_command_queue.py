@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import Future
+
+from pyavaccess import HDMIMatrixSerial
+from pyavaccess.command_queue import PRIORITY_CONTROL
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_queueReturnsFutures(ptyDevice):
+    """
+    Test getters, setters and batches return futures resolved by the worker
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE)
+
+    with matrix.commandQueue() as avQueue:
+        mapping = avQueue.getMapping(1)
+        assert isinstance(mapping, Future)
+        assert mapping.result(timeout=5) == 1
+        assert avQueue.snapshot().result(timeout=5).routing == {1: 1, 2: 3}
+
+
+def test_queueSharedBetweenThreads(ptyDevice):
+    """
+    Test many threads can share one queue without losing replies
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE)
+    results = []
+
+    with matrix.commandQueue() as avQueue:
+
+        def poll():
+            for _ in range(5):
+                results.append(avQueue.getMappings().result(timeout=5))
+
+        threads = [threading.Thread(target=poll) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert results == [{1: 1, 2: 3}] * 20
+
+
+def test_controlJumpsPolling(ptyDevice):
+    """
+    Test control commands are sent ahead of queued reads
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE)
+
+    with matrix.commandQueue() as avQueue:
+        # Hold the port so everything below waits in the queue
+        with matrix._lock:
+            first = avQueue.getMapping(1)
+            polls = [avQueue.getMappings() for _ in range(3)]
+            control = avQueue.mapOutput(1, 4)
+            urgentRead = avQueue.withPriority(PRIORITY_CONTROL).getMuteStatus(
+                "audioout1"
+            )
+        for future in [first, control, urgentRead] + polls:
+            future.result(timeout=5)
+
+    received = ptyDevice.received
+    lastUrgent = max(
+        received.index(b"SET SW in4 out1"), received.index(b"GET MUTE audioout1")
+    )
+    # Reads queued before the control commands are only sent after them
+    assert lastUrgent < received.index(b"GET MP all")
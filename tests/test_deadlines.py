@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import pytest
+
+from pyavaccess import (
+    AsyncHDMIMatrix,
+    CommandTimeout,
+    DeadlineExceeded,
+    DeviceErrorReply,
+    HDMIMatrixSerial,
+    MetricsRecorder,
+)
+from pyavaccess.avaccess_serial import (
+    COMMAND_TIMEOUT,
+    SLOW_COMMAND_TIMEOUT,
+    commandTimeout,
+)
+from pyavaccess.command import AVAccessCommand
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_commandTimeoutDefaults():
+    """
+    Test queries get a short deadline and slow commands a long one
+    """
+    assert commandTimeout(AVAccessCommand("GET MP all", 2)) == COMMAND_TIMEOUT
+    assert commandTimeout(AVAccessCommand("help", 24)) == SLOW_COMMAND_TIMEOUT
+    assert commandTimeout(AVAccessCommand("REBOOT")) == SLOW_COMMAND_TIMEOUT
+    assert commandTimeout(AVAccessCommand("GET VER", timeout=0.5)) == 0.5
+
+
+def test_errorReplyRaisesImmediately(errorProfiles):
+    """
+    Test an error line from the device is raised without waiting for the deadline
+    """
+    matrix = HDMIMatrixSerial(SIM_URL + "?errors=1", AV_DEVICE, registry=errorProfiles)
+    started = time.perf_counter()
+    with pytest.raises(DeviceErrorReply) as excInfo:
+        matrix._SendData("GET MP out9", lineCount=2, timeout=5)
+    assert time.perf_counter() - started < 1
+    assert excInfo.value.reply == "Command Error"
+    assert excInfo.value.command == "GET MP out9"
+
+    # The next command is not confused by the error
+    assert matrix.getMapping(1) == 1
+
+    matrix.startListening()
+    try:
+        with pytest.raises(DeviceErrorReply):
+            matrix._SendData("GET MP out9", timeout=5)
+        assert matrix.getMapping(2) == 2
+    finally:
+        matrix.stopListening()
+
+
+def test_batchDeadline():
+    """
+    Test a batch stops at its overall deadline even though every command is in budget
+    """
+    matrix = HDMIMatrixSerial(SIM_URL + "?latency_ms=50", AV_DEVICE)
+    batch = matrix.batch(timeout=0.12)
+    for outNum in (1, 2, 1, 2):
+        batch.getMapping(outNum)
+
+    started = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        batch.execute()
+    assert time.perf_counter() - started < 0.5
+
+    # Let the late replies arrive so they are cleared before the next command
+    time.sleep(0.3)
+
+    # A deadline that is long enough does not get in the way
+    assert matrix.snapshot(timeout=5).routing == {1: 1, 2: 2}
+
+    with pytest.raises(CommandTimeout):
+        matrix._SendData("GET MP out9", timeout=0.05)
+
+
+def test_asyncErrorsAndDeadlines(errorProfiles):
+    """
+    Test the asyncio client raises the same typed exceptions
+    """
+
+    async def run() -> None:
+        matrix = AsyncHDMIMatrix(
+            SIM_URL + "?errors=1", AV_DEVICE, registry=errorProfiles
+        )
+        async with matrix:
+            with pytest.raises(DeviceErrorReply):
+                await matrix._SendData("GET MP out9", lineCount=2)
+            assert await matrix.getMapping(1) == 1
+
+        async with AsyncHDMIMatrix(SIM_URL + "?latency_ms=50", AV_DEVICE) as matrix:
+            batch = matrix.batch(timeout=0.12)
+            for outNum in (1, 2, 1, 2):
+                batch.getMapping(outNum)
+            with pytest.raises(DeadlineExceeded):
+                await batch.execute()
+
+    asyncio.run(run())
+
+
+def test_retryAfterPartialReply():
+    """
+    Test a reply cut short is resynchronised and retried when the command is
+    safe to send again, and raised otherwise
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, instrumentation=metrics)
+    simulator = matrix._port.simulator
+    handle = simulator.handle
+    received = []
+    lateBytes = []
+    # First reply to each command and the bytes that arrive after its deadline
+    cutShort = {
+        "GET MP all": ([b"MP in1 out1\r\n", b"MP in2 o"], b"ut2\r\n"),
+        "RESET": ([b"RES"], b"ET\r\n"),
+    }
+
+    def noisyHandle(line):
+        received.append(line)
+        if line in cutShort and received.count(line) == 1:
+            reply, late = cutShort[line]
+            lateBytes.append(late)
+            return reply
+        late = [lateBytes.pop()] if lateBytes else []
+        return late + handle(line)
+
+    simulator.handle = noisyHandle
+    assert matrix._SendData("GET MP all", lineCount=2, timeout=0.1) == (
+        "MP in1 out1\r\nMP in2 out2"
+    )
+    assert received == ["GET MP all", "GET VER", "GET MP all"]
+    assert metrics.snapshot()["GET MP"]["retries"] == 1
+    assert matrix.getMapping(2) == 2
+
+    with pytest.raises(CommandTimeout) as excInfo:
+        matrix._SendData("RESET", timeout=0.1)
+    assert excInfo.value.received == b"RES"
+    assert received[-1] == "RESET"
+
+    assert AVAccessCommand("SET SW in1 all").isRetrySafe
+    assert AVAccessCommand("GET MP all").isRetrySafe
+    assert not AVAccessCommand("REBOOT").isRetrySafe
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+from pyavaccess import HDMIMatrixSerial, discoverMatrices
+from pyavaccess.discovery import expandUrls, probe
+from pyavaccess.profiles import PROFILE_DIR, DeviceProfile, ProfileRegistry
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_discoverProbesInParallel():
+    """
+    Test only ports with a known matrix are returned, ready to use, and
+    silent ports cost one probe timeout in total
+    """
+    silent = ["avsim://4kmx42?timeout=1&seed={}".format(seed) for seed in range(3)]
+    started = time.monotonic()
+    matrices = discoverMatrices(
+        ["avsim://4kmx42", "avsim://4kmx42?version=9.9"] + silent,
+        serialPorts=False,
+        timeout=0.3,
+    )
+    assert time.monotonic() - started < 0.8
+
+    assert list(matrices) == ["avsim://4kmx42"]
+    matrix = matrices["avsim://4kmx42"]
+    assert (matrix.model, matrix.apiVersion) == (AV_DEVICE, "VER 1.0.2")
+    assert matrix.getMappings() == {1: 1, 2: 2}
+    # The probe's GET VER is not sent again
+    assert matrix.roundTrips == 1
+
+
+def test_probeTellsModelsApart():
+    """
+    Test help decides between models sharing an API version, and url ranges
+    """
+    with open(os.path.join(PROFILE_DIR, "4kmx42-h2a.json"), encoding="utf-8") as file:
+        data = json.load(file)
+    registry = ProfileRegistry()
+    registry.add(DeviceProfile(**data))
+    data["model"] = "4KMX42-LITE"
+    del data["commands"]["GET IR_SC"]
+    registry.add(DeviceProfile(**data))
+
+    assert probe("avsim://4kmx42", registry=registry) == (AV_DEVICE, "VER 1.0.2")
+    assert expandUrls(["socket://10.0.0.8-10:4001", "/dev/ttyUSB0"]) == [
+        "socket://10.0.0.8:4001",
+        "socket://10.0.0.9:4001",
+        "socket://10.0.0.10:4001",
+        "/dev/ttyUSB0",
+    ]
+
+
+def test_discoverUsesGivenRegistry(monkeypatch):
+    """
+    Test a custom registry identifies the matrices and configures them once
+    """
+    with open(os.path.join(PROFILE_DIR, "4kmx42-h2a.json"), encoding="utf-8") as file:
+        data = json.load(file)
+    data["model"] = "OFFICE-MATRIX"
+    registry = ProfileRegistry()
+    registry.add(DeviceProfile(**data))
+
+    setups = []
+    setupDevice = HDMIMatrixSerial._setupDevice
+
+    def countSetups(matrix, device, apiVersion):
+        setups.append(device)
+        setupDevice(matrix, device, apiVersion)
+
+    monkeypatch.setattr(HDMIMatrixSerial, "_setupDevice", countSetups)
+    matrices = discoverMatrices(["avsim://4kmx42"], serialPorts=False, registry=registry)
+
+    matrix = matrices["avsim://4kmx42"]
+    assert setups == ["OFFICE-MATRIX"]
+    assert matrix.profile is registry.find("OFFICE-MATRIX", "VER 1.0.2")
+    assert matrix.batch().profile is matrix.profile
+    assert matrix.getMappings() == {1: 1, 2: 2}
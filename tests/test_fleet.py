@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from conftest import PtyDevice
+
+from pyavaccess import AsyncHDMIMatrix, AsyncMatrixFleet, HDMIMatrixSerial, MatrixFleet
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+@pytest.fixture
+def ptyDevices():
+    """
+    Several fake devices, one per matrix in the fleet
+    """
+    devices = [PtyDevice() for _ in range(3)]
+    yield devices
+    for device in devices:
+        device.close()
+
+
+def test_fleetCollectsResultsAndErrors(ptyDevices):
+    """
+    Test every device is driven and a failing device does not stop the others
+    """
+    fleet = MatrixFleet()
+    for index, device in enumerate(ptyDevices):
+        fleet.add(index, HDMIMatrixSerial(device.url, AV_DEVICE))
+
+    result = fleet.mapAllOutputs(2)
+    assert result.ok
+    assert result.results == {index: {1: 2, 2: 2} for index in range(3)}
+
+    result = fleet.run(lambda matrix: matrix.mapOutput(3, 1))
+    assert not result.ok
+    assert set(result.errors) == {0, 1, 2}
+    assert all(isinstance(exc, ValueError) for exc in result.errors.values())
+
+
+def test_asyncFleet(ptyDevices):
+    """
+    Test the asyncio fleet fans out across matrices
+    """
+
+    async def run():
+        fleet = AsyncMatrixFleet(maxConcurrency=2)
+        for index, device in enumerate(ptyDevices):
+            matrix = AsyncHDMIMatrix(device.url, AV_DEVICE)
+            await matrix.connect()
+            fleet.add(index, matrix)
+        return await fleet.snapshot()
+
+    result = asyncio.run(run())
+    assert result.ok
+    routings = [snapshot.routing for snapshot in result.results.values()]
+    assert routings == [{1: 1, 2: 3}] * 3
@@ -0,0 +1,60 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyavaccess import DeviceIdentityCache, HDMIMatrixSerial
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_lazyConnect(ptyDevice):
+    """
+    Test nothing is sent until the matrix is first used
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE, lazy=True)
+    assert ptyDevice.received == []
+
+    assert matrix.getMapping(1) == 1
+    assert matrix.apiVersion == "VER 1.0.2"
+    assert ptyDevice.received == [b"GET VER", b"GET MP out1"]
+
+
+def test_identityCacheSkipsVersionCheck(ptyDevice, tmp_path):
+    """
+    Test a cached device is built without any serial traffic
+    """
+    cachePath = str(tmp_path / "identities.json")
+    identityCache = DeviceIdentityCache(cachePath)
+    HDMIMatrixSerial(ptyDevice.url, AV_DEVICE, identityCache=identityCache)
+    with open(cachePath) as cacheFile:
+        assert list(json.load(cacheFile).values()) == ["VER 1.0.2"]
+
+    matrix = HDMIMatrixSerial(
+        ptyDevice.url,
+        AV_DEVICE,
+        lazy=True,
+        identityCache=DeviceIdentityCache(cachePath),
+        verifyIdentity=False,
+    )
+    assert matrix.outputs == 2
+    assert ptyDevice.received == [b"GET VER"]
+
+    assert matrix.verifyIdentity()
+
+
+def test_lazyConnectFromManyThreads():
+    """
+    Test threads first using a lazy matrix at the same time wait for one
+    GET VER instead of seeing a half loaded config
+    """
+    matrix = HDMIMatrixSerial("avsim://4kmx42?latency_ms=20", AV_DEVICE, lazy=True)
+    barrier = threading.Barrier(8)
+
+    def firstUse():
+        barrier.wait()
+        return matrix.getMapping(2)
+
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(firstUse) for _ in range(8)]
+        assert [future.result(timeout=5) for future in futures] == [2] * 8
+    assert matrix.roundTrips == 9
@@ -0,0 +1,84 @@
+import queue
+
+from pyavaccess import HDMIMatrixSerial
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_unsolicitedLinesBecomeEvents(ptyDevice):
+    """
+    Test front panel changes reach subscribers and update the cache
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE, cacheTTL=60)
+    events = queue.Queue()
+    matrix.startListening().subscribe(events.put)
+
+    try:
+        ptyDevice.emit(b"SW in3 out2\r\nMUTE audioout1 on\r\n")
+        mapping = events.get(timeout=5)
+        assert (mapping.kind, mapping.target, mapping.value) == ("mapping", 2, 3)
+        mute = events.get(timeout=5)
+        assert (mute.kind, mute.target, mute.value) == ("mute", "audioout1", True)
+
+        # Cached state was updated without polling
+        assert matrix.getMapping(2) == 3
+        assert ptyDevice.received == [b"GET VER"]
+
+        # Command replies still go to the caller
+        assert matrix.getMappings() == {1: 1, 2: 3}
+        assert matrix.mapOutput(1, 4) == {1: 4}
+        assert matrix.getVer() == "VER 1.0.2"
+        assert events.empty()
+    finally:
+        matrix.stopListening()
+
+    assert matrix.getVer() == "VER 1.0.2"
+
+
+def test_unsolicitedLineWhileSetPending():
+    """
+    Test a front panel change to another output that arrives before the
+    reply to a set is an event, not the reply
+    """
+    matrix = HDMIMatrixSerial("avsim://4kmx42", AV_DEVICE)
+    handle = matrix._port.simulator.handle
+
+    def frontPanelHandle(line):
+        if line == "SET SW in4 out1":
+            return [b"SW in3 out2\r\n"] + handle(line)
+        return handle(line)
+
+    matrix._port.simulator.handle = frontPanelHandle
+    events = queue.Queue()
+    matrix.startListening().subscribe(events.put)
+    try:
+        assert matrix.mapOutput(1, 4) == {1: 4}
+        event = events.get(timeout=5)
+        assert (event.kind, event.target, event.value) == ("mapping", 2, 3)
+    finally:
+        matrix.stopListening()
+
+
+def test_callbacksCanSendCommands():
+    """
+    Test a callback reading the matrix gets its reply instead of stalling the
+    reader thread that collects it
+    """
+    matrix = HDMIMatrixSerial("avsim://4kmx42", AV_DEVICE)
+    handle = matrix._port.simulator.handle
+
+    def frontPanelHandle(line):
+        if line == "SET SW in4 out1":
+            return [b"SW in3 out2\r\n"] + handle(line)
+        return handle(line)
+
+    matrix._port.simulator.handle = frontPanelHandle
+    mappings = queue.Queue()
+    listener = matrix.startListening()
+    listener.subscribe(lambda event: mappings.put(matrix.getMappings()))
+    try:
+        assert matrix.mapOutput(1, 4) == {1: 4}
+        assert mappings.get(timeout=5) == {1: 4, 2: 2}
+    finally:
+        matrix.stopListening()
+    assert listener._dispatcher is None
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import serial
+
+from pyavaccess import AsyncHDMIMatrix, HDMIMatrixSerial, MetricsRecorder
+from pyavaccess.metrics import NO_INSTRUMENTATION
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_metricsRecordedPerVerb():
+    """
+    Test latency, byte counts and parse times are recorded per command verb
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(
+        SIM_URL + "?latency_ms=5", AV_DEVICE, instrumentation=metrics
+    )
+    matrix.getMappings()
+    matrix.mapOutput(1, 3)
+
+    snapshot = metrics.snapshot()
+    assert set(snapshot) == {"GET VER", "GET MP", "SET SW"}
+    mappings = snapshot["GET MP"]
+    assert mappings["commands"] == 1
+    assert mappings["bytesOut"] == len(b"GET MP all\r\n")
+    assert mappings["bytesIn"] == len(b"MP in1 out1\r\nMP in2 out2\r\n")
+    assert mappings["total"]["count"] == mappings["firstByte"]["count"] == 1
+    assert 0.005 <= mappings["firstByte"]["sum"] <= mappings["total"]["sum"]
+    assert mappings["parse"]["count"] == 1
+    assert mappings["total"]["buckets"][-1] == (float("inf"), 1)
+
+
+def test_metricsCountTimeouts():
+    """
+    Test a command the device ignores is counted as a timeout
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, instrumentation=metrics)
+    with pytest.raises(serial.SerialTimeoutException):
+        matrix._SendData("GET MP out9", timeout=0.1)
+    assert metrics.snapshot()["GET MP"]["timeouts"] == 1
+
+
+def test_metricsPrometheusExport():
+    """
+    Test the Prometheus text export contains counters and histograms
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, instrumentation=metrics)
+    matrix.getMapping(1)
+
+    text = metrics.exportPrometheus()
+    assert "# TYPE pyavaccess_commands_total counter" in text
+    assert 'pyavaccess_commands_total{verb="GET MP"} 1' in text
+    assert 'pyavaccess_command_seconds_bucket{verb="GET MP",le="+Inf"} 1' in text
+    assert 'pyavaccess_parse_seconds_count{verb="GET MP"} 1' in text
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_metricsDefaultIsNoOp():
+    """
+    Test matrices are not timed unless instrumentation is given
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    assert matrix.instrumentation is NO_INSTRUMENTATION
+    assert not matrix.instrumentation.enabled
+    assert matrix.getMapping(1) == 1
+
+
+def test_metricsListenerAndAsync():
+    """
+    Test commands answered through a listener or the asyncio transport are recorded
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, instrumentation=metrics)
+    listener = matrix.startListening()
+    try:
+        matrix.getMappings()
+    finally:
+        listener.stop()
+    listened = metrics.snapshot()["GET MP"]
+    assert listened["commands"] == 1
+    assert listened["bytesIn"] == len(b"MP in1 out1\r\nMP in2 out2\r\n")
+
+    asyncMetrics = MetricsRecorder()
+
+    async def run() -> None:
+        async with AsyncHDMIMatrix(
+            SIM_URL, AV_DEVICE, instrumentation=asyncMetrics
+        ) as av:
+            await av.getMappings()
+
+    asyncio.run(run())
+    assert asyncMetrics.snapshot()["GET MP"]["firstByte"]["count"] == 1
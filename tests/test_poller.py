@@ -0,0 +1,164 @@
+import queue
+
+import pytest
+
+from pyavaccess import HDMIMatrixSerial, MatrixPoller
+from pyavaccess.hdmi_matrix import HDMIMatrixBase
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_pollerBacksOffAndEmitsChanges():
+    """
+    Test unchanged categories are polled less often and only changed values
+    reach subscribers
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    simulator = matrix._port.simulator
+    clock = FakeClock()
+    poller = MatrixPoller(matrix, {"mapping": 1.0, "mute": 4.0}, clock=clock)
+    events = []
+    poller.subscribe(events.append)
+
+    # The first poll only fills in the known values
+    assert poller.poll() == ["mapping", "mute"]
+    assert poller.values[("mapping", 2)] == 2
+    assert poller.values[("mute", "audioout1")] is False
+    assert events == []
+
+    # Nothing changed, the interval doubles
+    clock.now = 1.0
+    assert poller.poll() == ["mapping"]
+    clock.now = 2.0
+    assert poller.poll() == []
+    assert poller.nextPollIn() == pytest.approx(1.0)
+
+    simulator.routing[1] = 3
+    simulator.mute["audioout1"] = True
+    clock.now = 4.0
+    assert poller.poll() == ["mapping", "mute"]
+    assert [(event.kind, event.target, event.value) for event in events] == [
+        ("mapping", 1, 3),
+        ("mute", "audioout1", True),
+    ]
+    # A change puts the category back to its interval
+    assert poller.nextPollIn() == pytest.approx(1.0)
+
+
+def test_pollerReadsPastTheCache():
+    """
+    Test polls read the device while the matrix caches state, so changes made
+    elsewhere are seen before the cache expires
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, cacheTTL=60)
+    simulator = matrix._port.simulator
+    clock = FakeClock()
+    poller = MatrixPoller(matrix, {"mapping": 1.0}, clock=clock)
+    events = []
+    poller.subscribe(events.append)
+
+    assert poller.poll() == ["mapping"]
+    simulator.routing[2] = 4
+    roundTrips = matrix.roundTrips
+    clock.now = 1.0
+    assert poller.poll() == ["mapping"]
+    assert matrix.roundTrips == roundTrips + 1
+    assert [(event.kind, event.target, event.value) for event in events] == [
+        ("mapping", 2, 4)
+    ]
+    # The change resets the interval instead of backing off
+    assert poller.nextPollIn() == pytest.approx(1.0)
+    # The poll's reply refreshed the cache for everyone else
+    assert matrix.getMappings() == {1: 1, 2: 4}
+    assert matrix.roundTrips == roundTrips + 1
+
+
+def test_pollerFollowsLocalCommands():
+    """
+    Test replies to other commands skip polls and local sets speed polling up
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    clock = FakeClock()
+    poller = MatrixPoller(
+        matrix, {"mapping": 8.0}, boostInterval=0.5, boostDuration=5.0, clock=clock
+    )
+    events = queue.Queue()
+    poller.subscribe(events.put)
+    poller.poll()
+
+    # A full read by the application answers the next poll
+    clock.now = 7.0
+    matrix.getMappings()
+    clock.now = 8.0
+    assert poller.poll() == []
+    assert poller.nextPollIn() == pytest.approx(7.0)
+
+    # Local sets are reported and poll the category again soon
+    matrix.mapOutput(2, 4)
+    event = events.get_nowait()
+    assert (event.kind, event.target, event.value) == ("mapping", 2, 4)
+    assert poller.nextPollIn() == pytest.approx(0.0)
+    assert poller.poll() == ["mapping"]
+    assert poller.nextPollIn() == pytest.approx(0.5)
+
+    # Back to the normal interval once the boost is over, then backing off
+    clock.now = 14.0
+    assert poller.poll() == []
+    clock.now = 16.0
+    roundTrips = matrix.roundTrips
+    assert poller.poll() == ["mapping"]
+    assert matrix.roundTrips == roundTrips + 1
+    assert poller.nextPollIn() == pytest.approx(16.0)
+
+
+def test_startPolling():
+    """
+    Test the background thread polls and stops
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    poller = matrix.startPolling({"mapping": 0.05})
+    events = queue.Queue()
+    poller.subscribe(events.put)
+    try:
+        assert matrix.startPolling() is poller
+        matrix._port.simulator.routing[1] = 4
+        event = events.get(timeout=5)
+        assert (event.kind, event.target, event.value) == ("mapping", 1, 4)
+    finally:
+        matrix.stopPolling()
+    assert not poller.running
+    assert matrix._replyObservers == []
+
+
+def test_pollerSurvivesBadReplies(monkeypatch):
+    """
+    Test a reply that can't be parsed doesn't stop the background thread
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    parseRouting = HDMIMatrixBase._parseRouting
+    parsed = queue.Queue()
+
+    def failingParse(self, deviceOutput, verb="MP"):
+        parsed.put(deviceOutput)
+        if parsed.qsize() == 1:
+            raise ValueError("Unexpected reply {!r}".format(deviceOutput))
+        return parseRouting(self, deviceOutput, verb)
+
+    monkeypatch.setattr(HDMIMatrixBase, "_parseRouting", failingParse)
+    poller = matrix.startPolling({"mapping": 0.01})
+    try:
+        parsed.get(timeout=5)
+        parsed.get(timeout=5)
+        assert poller.running
+        assert matrix.startPolling() is poller
+    finally:
+        matrix.stopPolling()
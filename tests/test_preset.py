@@ -0,0 +1,93 @@
+import asyncio
+
+from pyavaccess import AsyncHDMIMatrix, HDMIMatrixSerial, MatrixPreset
+from pyavaccess.preset import planRouting
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_planRouting():
+    """
+    Test the smallest set of SET SW commands is chosen
+    """
+    current = {1: 1, 2: 2, 3: 3, 4: 4}
+    assert planRouting({1: 1, 2: 2}, current) == (None, {})
+    assert planRouting({1: 2}, current) == (None, {1: 2})
+    assert planRouting({1: 3, 2: 3, 4: 3}, current) == (3, {})
+    # Output 4 is outside the target and must get its input back after "all"
+    assert planRouting({1: 3, 2: 3}, {1: 1, 2: 2, 3: 3, 4: 4}) == (None, {1: 3, 2: 3})
+    assert planRouting({1: 2, 3: 2, 4: 2}, current) == (2, {})
+    assert planRouting({1: 2, 2: 1, 3: 2, 4: 2}, current) == (2, {2: 1})
+
+
+def test_applyPresetMinimalDiff():
+    """
+    Test only the differences are sent and the replies confirm the result
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+
+    result = matrix.applyPreset(MatrixPreset(routing={1: 3, 2: 3}))
+    assert result.commands == ["SET SW in3 all"]
+    assert result.applied.routing == {1: 3, 2: 3}
+    assert result.ok
+    assert result.roundTrips == 2
+
+    result = matrix.applyPreset(MatrixPreset(routing={1: 4, 2: 3}))
+    assert result.commands == ["SET SW in4 out1"]
+    assert result.ok
+    assert matrix.getMappings() == {1: 4, 2: 3}
+
+    # Nothing to change costs only the read
+    result = matrix.applyPreset(MatrixPreset(routing={1: 4, 2: 3}))
+    assert result.commands == []
+    assert result.ok
+    assert result.roundTrips == 1
+
+
+def test_applyPresetMuteAndCEC():
+    """
+    Test mute and CEC settings are applied with the routing
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, cacheTTL=60)
+    preset = MatrixPreset(
+        routing={2: 1},
+        mute={"audioout1": True, "hdmiaudioout1": False},
+        autoCEC={1: True},
+        cecDelay={1: 1, 2: 20},
+    )
+
+    result = matrix.applyPreset(preset)
+    assert result.commands == [
+        "SET SW in1 out2",
+        "SET MUTE audioout1 on",
+        "SET AUTOCEC_FN out1 on",
+        "SET AUTOCEC_D out2 20",
+    ]
+    assert result.applied == preset
+    assert result.roundTrips == 2
+
+    # The replies were written through, so the cache answers the next read
+    result = matrix.applyPreset(preset)
+    assert result.commands == []
+    assert result.roundTrips == 0
+
+    matrix.disableCache()
+    assert MatrixPreset.fromSnapshot(matrix.snapshot()).routing == {1: 1, 2: 1}
+    assert matrix.getCECDelay(2) == 20
+
+
+def test_asyncApplyPreset():
+    """
+    Test the asyncio client applies presets the same way
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(SIM_URL, AV_DEVICE) as matrix:
+            return await matrix.applyPreset(
+                MatrixPreset(routing={1: 2, 2: 2}, mute={"audioout1": True})
+            )
+
+    result = asyncio.run(run())
+    assert result.commands == ["SET SW in2 out1", "SET MUTE audioout1 on"]
+    assert result.ok
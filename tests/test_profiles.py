@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from pyavaccess import DeviceErrorReply, HDMIMatrixSerial
+from pyavaccess.avaccess_serial import encodeCommand
+from pyavaccess.profiles import DEVICE_PROFILES, ProfileRegistry
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_profileVersionRanges():
+    """
+    Test profiles are matched by model and API version range
+    """
+    assert DEVICE_PROFILES.find("4kmx42-h2a", "VER 1.0.2").inputCount == 4
+    assert DEVICE_PROFILES.find(AV_DEVICE, "VER 1.0.9").outputCount == 2
+    with pytest.raises(ValueError):
+        DEVICE_PROFILES.find(AV_DEVICE, "VER 1.0.1")
+    with pytest.raises(ValueError):
+        DEVICE_PROFILES.find(AV_DEVICE, "VER 1.1")
+    with pytest.raises(ValueError):
+        DEVICE_PROFILES.find("4KMX44-H2A", "VER 1.0.2")
+    with pytest.raises(ValueError):
+        DEVICE_PROFILES.find(AV_DEVICE, "garbage")
+
+
+def test_profileFromFile(tmp_path):
+    """
+    Test a new model is described by a data file alone
+    """
+    path = tmp_path / "8kmx88.json"
+    path.write_text(
+        json.dumps(
+            {
+                "model": "8KMX88-H2A",
+                "versions": [">=2.0"],
+                "inputCount": 8,
+                "outputCount": 8,
+                "audioOutputs": ["audioout1"],
+                "EDIDParamCount": 3,
+                "maxDelayInMin": 10,
+                "irModeCount": 1,
+                "commands": {
+                    "help": "commands",
+                    "SET SW inX outY": 1,
+                    "GET MP all": "outputs",
+                },
+            }
+        )
+    )
+    registry = ProfileRegistry()
+    registry.load(str(path))
+
+    profile = registry.find("8kmx88-h2a", "VER 2.3.1")
+    assert profile.commandCount == 3
+    assert profile.replyLines("help") == 3
+    assert profile.replyLines("GET MP all") == 8
+    assert len(profile.encodings) == 1 + 64 + 1
+    assert profile.encodings[("SET SW inX outY", 8, 3)] == (
+        "SET SW in8 out3",
+        b"SET SW in8 out3\r\n",
+    )
+    assert profile.command("SET SW inX outY", 9, 3) == (
+        "SET SW in9 out3",
+        b"SET SW in9 out3\r\n",
+    )
+    assert registry.models("VER 2.0.0") == ["8KMX88-H2A"]
+    assert registry.models("VER 1.0.2") == []
+
+
+def test_profileErrorReplies(errorProfiles):
+    """
+    Test only the error lines a profile declares end a reply early, the
+    shipped profile declares none
+    """
+    assert DEVICE_PROFILES.find(AV_DEVICE, "VER 1.0.2").errorReplies == ()
+    matrix = HDMIMatrixSerial(SIM_URL + "?errors=1", AV_DEVICE)
+    assert matrix.errorReplyPattern is None
+    assert matrix._SendData("GET MP out9", timeout=1) == "Command Error"
+
+    matrix = HDMIMatrixSerial(SIM_URL + "?errors=1", AV_DEVICE, registry=errorProfiles)
+    with pytest.raises(DeviceErrorReply):
+        matrix._SendData("GET MP out9", timeout=1)
+
+
+def test_precompiledEncodings():
+    """
+    Test every command a matrix builds is precompiled for its device, so the
+    send path neither formats nor encodes
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    batch = matrix.batch()
+    batch.mapOutput(2, 4)
+    batch.mapAllOutputs(3)
+    batch.setMuteStatus("spdifaudioout2", True)
+    batch.setCECDelay(1, 30)
+    batch.setInputEDIDStatus(4, 11)
+    batch.setIR_SC(2)
+    batch.getAllMuteStatus()
+    assert "SET MUTE spdifaudioout2 on" in batch.commands
+    for command in batch._commands:
+        assert command.encoded == encodeCommand(command.cmdStr)
+    assert matrix.getAPI().split("\r\n") == matrix.profile.commands
@@ -0,0 +1,66 @@
+import pytest
+
+from pyavaccess import HDMIMatrixSerial
+from pyavaccess.reply_parser import (
+    parseReply,
+    parseRoutingInputs,
+    parseValue,
+    parseValues,
+)
+
+
+def test_parseReplyTypesEveryVerb():
+    """
+    Test each reply verb is turned into typed values in one pass
+    """
+    reply = (
+        "MP in1 out1\r\nMP in3 out2\r\n"
+        "MUTE audioout1 on\r\n"
+        "EDID in2 5\r\n"
+        "AUTOCEC_FN out1 off\r\n"
+        "AUTOCEC_D out2 15\r\n"
+        "CEC_PWR all on\r\n"
+        "IR_SC mode2\r\n"
+        "help\r\n"
+    )
+    assert parseReply(reply) == {
+        "MP": {1: 1, 2: 3},
+        "MUTE": {"audioout1": True},
+        "EDID": {2: 5},
+        "AUTOCEC_FN": {1: False},
+        "AUTOCEC_D": {2: 15},
+        "CEC_PWR": {"all": True},
+        "IR_SC": {None: 2},
+    }
+    assert parseValues("SW in3 all", "SW") == {"all": 3}
+    assert parseValue("IR_SC mode1", "IR_SC") == 1
+
+
+def test_parseValueRejectsUnexpectedReplies():
+    """
+    Test replies without the requested value or with bad fields raise ValueError
+    """
+    with pytest.raises(ValueError):
+        parseValue("MP in1 out1", "MP", 2)
+    with pytest.raises(ValueError):
+        parseValue("MUTE audioout1 maybe", "MUTE", "audioout1")
+
+
+def test_parseRoutingInputsIsCachedPerReply():
+    """
+    Test routing replies are parsed once while every caller gets its own table
+    """
+    parseRoutingInputs.cache_clear()
+    matrix = HDMIMatrixSerial("avsim://4kmx42", "4KMX42-H2A")
+    first = matrix._parseRouting("MP in1 out1\r\nMP in3 out2")
+    second = matrix._parseRouting("MP in1 out1\r\nMP in3 out2")
+    assert first == second == {1: 1, 2: 3}
+    assert parseRoutingInputs.cache_info().hits == 1
+    first[1] = 4
+    assert second[1] == 1
+    assert matrix._parseRouting("SW in3 all", "SW") == {1: 3, 2: 3}
+    assert parseRoutingInputs("MP in2 out1", "MP", 2, 4) == (2, 0)
+    with pytest.raises(ValueError):
+        parseRoutingInputs("MP in5 out1", "MP", 2, 4)
+    with pytest.raises(ValueError):
+        parseRoutingInputs("MP in1 out3", "MP", 2, 4)
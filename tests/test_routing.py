@@ -0,0 +1,62 @@
+import pytest
+
+from pyavaccess import HDMIMatrixSerial, RoutingTable
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_routingTable():
+    """
+    Test lookups, updates, diffs and inverse lookups
+    """
+    routing = RoutingTable(4, 8, {1: 2, 2: 2})
+    assert routing[1] == 2
+    assert routing.get(3) is None
+    assert len(routing) == 2
+    assert not routing.complete
+    assert routing == {1: 2, 2: 2}
+    with pytest.raises(ValueError):
+        routing[5] = 1
+    with pytest.raises(ValueError):
+        routing[1] = 9
+
+    routing.fill(5)
+    assert routing.complete
+    routing[3] = 7
+    assert routing.outputsFor(5) == [1, 2, 4]
+    assert routing.outputsFor(1) == []
+
+    previous = routing.snapshot()
+    routing[2] = 1
+    assert routing.diff(previous) == [2]
+    assert routing.diff({1: 5, 2: 1, 3: 7}) == [4]
+    assert previous.diff(previous.copy()) == []
+
+    with pytest.raises(TypeError):
+        previous[1] = 1
+    assert hash(previous) == hash(previous.copy().snapshot())
+    assert previous != routing
+
+
+def test_routingApisReturnTables():
+    """
+    Test every routing call returns a RoutingTable keyed by output number
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    mappings = matrix.getMappings()
+    assert isinstance(mappings, RoutingTable)
+    assert mappings == {1: 1, 2: 2}
+
+    switched = matrix.mapOutput(2, 4)
+    assert isinstance(switched, RoutingTable)
+    assert dict(switched) == {2: 4}
+
+    allOutputs = matrix.mapAllOutputs(3)
+    assert allOutputs.complete and allOutputs.outputsFor(3) == [1, 2]
+    assert allOutputs.diff(mappings) == [1, 2]
+
+    snapshot = matrix.snapshot()
+    assert snapshot.routing == allOutputs
+    with pytest.raises(TypeError):
+        snapshot.routing[1] = 1
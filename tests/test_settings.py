@@ -0,0 +1,168 @@
+import asyncio
+
+from pyavaccess import AsyncHDMIMatrix, HDMIMatrixSerial, MatrixSettings
+from pyavaccess.settings import APPLIED, UNCHANGED
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+SETTINGS = {
+    "edid": {"1": 1, "2": 5, "3": 7},
+    "autoCEC": {"1": True},
+    "cecDelay": {"2": 1},
+    "mute": {"audioout1": True},
+    "irMode": 2,
+}
+
+
+def test_applySettings():
+    """
+    Test only differing fields are sent, in one batch, and verified with
+    "all" reads where the device has them
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE, cacheTTL=60)
+    settings = MatrixSettings.fromDict(SETTINGS)
+    assert settings.edid == {1: 1, 2: 5, 3: 7}
+
+    report = matrix.applySettings(settings)
+    assert report.commands == [
+        "SET EDID in2 5",
+        "SET EDID in3 7",
+        "SET AUTOCEC_FN out1 on",
+        "SET MUTE audioout1 on",
+        "SET IR_SC mode2",
+    ]
+    assert report.roundTrips == 3
+    assert report.ok
+    assert report.fields[("edid", 1)] == UNCHANGED
+    assert report.fields[("cecDelay", 2)] == UNCHANGED
+    assert report.fields[("irMode", None)] == APPLIED
+    assert len(report.applied) == 5
+
+    # Everything is in place, only the read is left
+    report = matrix.applySettings(settings)
+    assert report.commands == []
+    assert report.roundTrips == 1
+    assert len(report.unchanged) == 7
+
+
+def test_applySettingsReportsFailures(errorProfiles):
+    """
+    Test rejected or silently ignored sets are reported as failed while the
+    rest of the batch is still verified
+    """
+    matrix = HDMIMatrixSerial(
+        "avsim://4kmx42?errors=1", AV_DEVICE, registry=errorProfiles
+    )
+    simulator = matrix._port.simulator
+    handle = simulator.handle
+
+    def faultyHandle(line):
+        if line == "SET EDID in2 5":
+            return [b"Command Error\r\n"]
+        if line == "SET AUTOCEC_FN out1 on":
+            # Replies as if applied but keeps the old value
+            return [b"AUTOCEC_FN out1 on\r\n"]
+        return handle(line)
+
+    simulator.handle = faultyHandle
+    report = matrix.applySettings(MatrixSettings.fromDict(SETTINGS))
+    assert not report.ok
+    assert report.failed == [("edid", 2), ("autoCEC", 1)]
+    assert report.fields[("edid", 3)] == APPLIED
+    assert report.fields[("mute", "audioout1")] == APPLIED
+    assert simulator.edid[3] == 7
+
+
+def test_asyncApplySettings():
+    """
+    Test the asyncio client applies settings the same way
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(SIM_URL, AV_DEVICE) as matrix:
+            return await matrix.applySettings(MatrixSettings(mute={"audioout1": True}))
+
+    report = asyncio.run(run())
+    assert report.commands == ["SET MUTE audioout1 on"]
+    assert report.applied == [("mute", "audioout1")]
+
+
+def test_applySettingsResyncsAfterRejectedSet(errorProfiles):
+    """
+    Test replies still on their way after a rejected set are not read as the
+    read-back replies
+    """
+    matrix = HDMIMatrixSerial(
+        "avsim://4kmx42?errors=1&latency_ms=10", AV_DEVICE, registry=errorProfiles
+    )
+    simulator = matrix._port.simulator
+    handle = simulator.handle
+
+    def faultyHandle(line):
+        if line == "SET EDID in2 5":
+            return [b"Command Error\r\n"]
+        return handle(line)
+
+    simulator.handle = faultyHandle
+    report = matrix.applySettings(MatrixSettings.fromDict(SETTINGS))
+    assert report.failed == [("edid", 2)]
+    assert len(report.applied) == 4
+
+
+def test_asyncApplySettingsResyncsAfterRejectedSet(errorProfiles):
+    """
+    Test the asyncio client also drains the rest of a rejected batch
+    """
+
+    async def run():
+        matrix = AsyncHDMIMatrix(
+            "avsim://4kmx42?errors=1&latency_ms=10", AV_DEVICE, registry=errorProfiles
+        )
+        async with matrix:
+            handle = matrix._port.simulator.handle
+            matrix._port.simulator.handle = lambda line: (
+                [b"Command Error\r\n"] if line == "SET EDID in2 5" else handle(line)
+            )
+            return await matrix.applySettings(MatrixSettings.fromDict(SETTINGS))
+
+    report = asyncio.run(run())
+    assert report.failed == [("edid", 2)]
+    assert len(report.applied) == 4
+
+
+def test_applySettingsReportsTimedOutSet(monkeypatch):
+    """
+    Test a set the device never answers is reported as failed while the rest
+    of the batch is still verified
+    """
+    monkeypatch.setattr("pyavaccess.avaccess_serial.COMMAND_TIMEOUT", 0.2)
+    matrix = HDMIMatrixSerial("avsim://4kmx42?latency_ms=10", AV_DEVICE)
+    port = matrix._port
+    write = port.write
+
+    class Draws:
+        """Only the third line of a batch goes unanswered"""
+
+        def __init__(self):
+            self.values = iter([1.0, 1.0, 0.0])
+
+        def random(self):
+            return next(self.values, 1.0)
+
+    def timingOutWrite(data):
+        if b"SET EDID in2 5" not in data:
+            return write(data)
+        port.timeoutRate, port._random = 1.0, Draws()
+        try:
+            return write(data)
+        finally:
+            port.timeoutRate = 0.0
+
+    port.write = timingOutWrite
+    report = matrix.applySettings(MatrixSettings.fromDict(SETTINGS))
+    assert not report.ok
+    assert report.failed == [("autoCEC", 1)]
+    assert report.fields[("edid", 3)] == APPLIED
+    assert report.fields[("mute", "audioout1")] == APPLIED
+    assert report.fields[("irMode", None)] == APPLIED
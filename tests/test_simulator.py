@@ -0,0 +1,88 @@
+import time
+
+import pytest
+import serial
+
+from pyavaccess import HDMIMatrixSerial
+
+SIM_URL = "avsim://4kmx42"
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_simulatorCommandSet():
+    """
+    Test every matrix command against the simulator
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    assert matrix.apiVersion == "VER 1.0.2"
+    assert len(matrix.getAPI().split("\r\n")) == matrix.commandCount
+
+    assert matrix.getMappings() == {1: 1, 2: 2}
+    assert matrix.mapOutput(2, 4) == {2: 4}
+    assert matrix.getMapping(2) == 4
+    assert matrix.mapAllOutputs(3) == {1: 3, 2: 3}
+
+    assert matrix.setMuteStatus("audioout1", True) is True
+    assert matrix.getMuteStatus("audioout1") is True
+    assert matrix.getAllMuteStatus() == {
+        "hdmiaudioout1": False,
+        "hdmiaudioout2": False,
+        "audioout1": True,
+        "spdifaudioout2": False,
+    }
+    assert matrix.setInputEDIDStatus(2, 5) == 5
+    assert matrix.getInputEDIDStatus(2) == 5
+    assert matrix.getAllInputEDIDStatus() == {1: 1, 2: 5, 3: 1, 4: 1}
+    assert matrix.setAutoCEC(1, True) is True
+    assert matrix.getAutoCECStatus(1) is True
+    assert matrix.setCECDelay(1, 10) == 10
+    assert matrix.getCECDelay(1) == 10
+    assert matrix.setCECPower(2, False) is False
+    assert matrix.setIR_SC(2) == 2
+    assert matrix.getIR_SC() == 2
+
+    matrix.factoryReset()
+    assert matrix.getMappings() == {1: 1, 2: 2}
+
+
+def test_simulatorInvalidCommandTimesOut():
+    """
+    Test invalid commands get no reply, like the device
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    with pytest.raises(serial.SerialTimeoutException):
+        matrix._SendData("GET MP out9", timeout=0.1)
+
+
+def test_simulatorLatencyAndFaults():
+    """
+    Test reply latency and dropped commands are configurable from the url
+    """
+    matrix = HDMIMatrixSerial(SIM_URL + "?latency_ms=20", AV_DEVICE)
+    started = time.perf_counter()
+    matrix.getMappings()
+    assert time.perf_counter() - started >= 0.04
+
+    matrix._port.timeoutRate = 1.0
+    with pytest.raises(serial.SerialTimeoutException):
+        matrix._SendData("GET MP out1", timeout=0.1)
+
+
+def test_simulatorFrontPanelEvents():
+    """
+    Test front panel changes are reported without being asked
+    """
+    matrix = HDMIMatrixSerial(SIM_URL, AV_DEVICE)
+    events = []
+    matrix.startListening().subscribe(events.append)
+    try:
+        matrix._port.simulator.frontPanelSwitch(4, 1)
+        deadline = time.monotonic() + 5
+        while not events and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [(event.kind, event.target, event.value) for event in events] == [
+            ("mapping", 1, 4)
+        ]
+        assert matrix.getMapping(1) == 4
+    finally:
+        matrix.stopListening()
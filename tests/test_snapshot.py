@@ -0,0 +1,54 @@
+import asyncio
+
+from pyavaccess import AsyncHDMIMatrix, HDMIMatrixSerial
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def _checkSnapshot(snapshot) -> None:
+    assert snapshot.routing == {1: 1, 2: 3}
+    assert snapshot.mute == {
+        "hdmiaudioout1": False,
+        "hdmiaudioout2": False,
+        "audioout1": True,
+        "spdifaudioout2": False,
+    }
+    assert snapshot.edid == {1: 1, 2: 1, 3: 4, 4: 1}
+    assert snapshot.autoCEC == {1: False, 2: True}
+    assert snapshot.cecDelay == {1: 2, 2: 15}
+
+
+def test_snapshotOneRoundTrip(ptyDevice):
+    """
+    Test the full device state is read and typed in a single round trip
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE)
+
+    snapshot = matrix.snapshot()
+    _checkSnapshot(snapshot)
+    assert snapshot.roundTrips == 1
+    assert snapshot.elapsed > 0
+
+
+def test_snapshotFromCache(ptyDevice):
+    """
+    Test a fresh cache answers a snapshot without touching the device
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE, cacheTTL=60)
+    matrix.snapshot()
+
+    snapshot = matrix.snapshot()
+    _checkSnapshot(snapshot)
+    assert snapshot.roundTrips == 0
+
+
+def test_asyncSnapshot(ptyUrl):
+    """
+    Test the asyncio client returns the same snapshot
+    """
+
+    async def run():
+        async with AsyncHDMIMatrix(ptyUrl, AV_DEVICE) as matrix:
+            return await matrix.snapshot()
+
+    _checkSnapshot(asyncio.run(run()))
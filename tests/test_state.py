@@ -0,0 +1,66 @@
+from pyavaccess import HDMIMatrixSerial, MetricsRecorder
+from pyavaccess.state import MatrixState
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+def test_cacheServesReads(ptyDevice):
+    """
+    Test reads after a full read or a set command do not go to the wire
+    """
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE, cacheTTL=60)
+
+    assert matrix.getMappings() == {1: 1, 2: 3}
+    assert matrix.mapOutput(1, 4) == {1: 4}
+    assert matrix.getMapping(1) == 4
+    assert matrix.getMappings() == {1: 4, 2: 3}
+
+    assert matrix.setMuteStatus("audioout1", True) is True
+    assert matrix.getMuteStatus("audioout1") is True
+
+    assert ptyDevice.received == [
+        b"GET VER",
+        b"GET MP all",
+        b"SET SW in4 out1",
+        b"SET MUTE audioout1 on",
+    ]
+
+
+def test_cacheExpiresAndInvalidates(ptyDevice):
+    """
+    Test expired values and reboots send reads to the device again
+    """
+    now = [0.0]
+    matrix = HDMIMatrixSerial(ptyDevice.url, AV_DEVICE)
+    matrix.state = MatrixState(60, clock=lambda: now[0])
+
+    matrix.mapAllOutputs(2)
+    assert matrix.getMappings() == {1: 2, 2: 2}
+
+    matrix.reboot()
+    assert matrix.getMappings() == {1: 1, 2: 3}
+
+    now[0] += 61
+    matrix.getMapping(1)
+    assert ptyDevice.received.count(b"GET MP all") == 1
+    assert ptyDevice.received[-1] == b"GET MP out1"
+
+
+def test_cacheReadAfterWriteInBatch():
+    """
+    Test a read queued after a set in the same batch is sent, not answered
+    with the value from before the set
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(
+        "avsim://4kmx42", AV_DEVICE, cacheTTL=60, instrumentation=metrics
+    )
+    assert matrix.getMappings() == {1: 1, 2: 2}
+
+    batch = matrix.batch()
+    batch.getMapping(2)
+    batch.mapOutput(1, 4)
+    batch.getMapping(1)
+    assert batch.execute() == [2, {1: 4}, 4]
+    # Only the read queued before the set came from the cache
+    assert metrics.snapshot()["GET MP"]["commands"] == 2
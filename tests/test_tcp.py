@@ -0,0 +1,176 @@
+import socket
+import threading
+import time
+from typing import List
+
+import pytest
+import serial
+
+from pyavaccess import ConnectionLost, HDMIMatrixSerial, MetricsRecorder
+from pyavaccess.simulator import MatrixSimulator
+
+AV_DEVICE = "4KMX42-H2A"
+
+
+class SimulatorGateway:
+    """
+    Serial-to-Ethernet gateway in front of a simulated matrix
+    """
+
+    def __init__(self) -> None:
+        self.simulator = MatrixSimulator(AV_DEVICE)
+        self.received: List[str] = []
+        self._clients: List[socket.socket] = []
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return "avtcp://127.0.0.1:{}".format(self.port)
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return
+            self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client: socket.socket) -> None:
+        buffer = b""
+        while True:
+            try:
+                data = client.recv(1024)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b"\r\n" in buffer:
+                line, buffer = buffer.split(b"\r\n", 1)
+                self.received.append(line.decode("ascii"))
+                reply = b"".join(self.simulator.handle(line.decode("ascii")))
+                try:
+                    client.sendall(reply)
+                except OSError:
+                    return
+
+    def dropConnections(self) -> None:
+        for client in self._clients:
+            client.shutdown(socket.SHUT_RDWR)
+            client.close()
+        self._clients.clear()
+
+    def stop(self) -> None:
+        # Shutting down wakes the thread blocked in accept()
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._server.close()
+        self.dropConnections()
+
+
+@pytest.fixture
+def gateway():
+    gateway = SimulatorGateway()
+    yield gateway
+    gateway.stop()
+
+
+def test_tcpSocketOptions(gateway):
+    """
+    Test Nagle's algorithm is off and keepalive is on
+    """
+    matrix = HDMIMatrixSerial(gateway.url + "?keepalive=30", AV_DEVICE)
+    sock = matrix._port._socket
+    assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 30
+    assert matrix.getMappings() == {1: 1, 2: 2}
+
+
+def test_tcpReconnect(gateway):
+    """
+    Test a dropped connection is reopened and the command sent again,
+    keeping the detected API version and state cache settings
+    """
+    metrics = MetricsRecorder()
+    matrix = HDMIMatrixSerial(
+        gateway.url, AV_DEVICE, cacheTTL=60, instrumentation=metrics
+    )
+    assert matrix.getMappings() == {1: 1, 2: 2}
+
+    gateway.dropConnections()
+    assert matrix.mapOutput(1, 3) == {1: 3}
+    assert metrics.snapshot()["SET SW"]["retries"] == 1
+    assert gateway.received.count("GET VER") == 1
+
+    # The cache was cleared, changes made while disconnected are read again
+    gateway.simulator.routing[2] = 4
+    assert matrix.getMapping(2) == 4
+
+
+def test_tcpReconnectWithoutResendingReboot(gateway):
+    """
+    Test a command that is not safe to repeat is raised after reconnecting
+    instead of being sent again
+    """
+    matrix = HDMIMatrixSerial(gateway.url, AV_DEVICE)
+    gateway.dropConnections()
+    with pytest.raises(serial.SerialException):
+        matrix.reboot()
+    assert "REBOOT" not in gateway.received
+
+    # The connection was reopened for the next command
+    assert matrix.getMappings() == {1: 1, 2: 2}
+    assert gateway.received.count("GET VER") == 1
+
+
+def test_tcpConnectionLost(gateway):
+    """
+    Test ConnectionLost is raised once the gateway stays away
+    """
+    matrix = HDMIMatrixSerial(gateway.url, AV_DEVICE, reconnectAttempts=2)
+    gateway.stop()
+    with pytest.raises(ConnectionLost):
+        matrix.getMappings()
+
+
+def test_tcpReconnectAfterListenerStops(gateway):
+    """
+    Test a listener whose connection dropped hands the port back, so the next
+    command reconnects instead of timing out
+    """
+    matrix = HDMIMatrixSerial(gateway.url, AV_DEVICE)
+    listener = matrix.startListening()
+
+    gateway.dropConnections()
+    deadline = time.monotonic() + 5
+    while matrix._listener is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert matrix._listener is None
+    assert listener.error is not None
+    assert not listener.running
+
+    assert matrix.mapOutput(1, 3) == {1: 3}
+    # Listening can start again on the new connection
+    matrix.startListening()
+    handle = gateway.simulator.handle
+
+    def droppingHandle(line):
+        if line == "SET SW in2 out1" and gateway.received.count(line) == 1:
+            gateway.dropConnections()
+        return handle(line)
+
+    gateway.simulator.handle = droppingHandle
+    try:
+        assert matrix.getMappings() == {1: 3, 2: 2}
+        # A command waiting on the listener when the connection drops is sent again
+        assert matrix.mapOutput(1, 2) == {1: 2}
+        assert matrix._listener is None
+    finally:
+        matrix.stopListening()